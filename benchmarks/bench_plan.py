@@ -0,0 +1,140 @@
+"""
+    benchmarks.bench_plan
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Compares applying a transform plan to transforming templates node by
+    node, as `/transform` does for templates without a static layout.
+
+    The benchmark generates templates with many small fields grouped below
+    a few levels of nesting, since offsets are resolved recursively along
+    siblings. Transforming node by node matches each destination leaf
+    against each source leaf, so its duration grows quadratically with the
+    number of fields and is only measured once, up to `--max-tree-fields`.
+
+    Usage::
+
+        ~$ python3 -m benchmarks.bench_plan --fields 1000 --fields 10000
+
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+from binalyzer import Binalyzer, XMLTemplateParser
+
+from binalyzer_rest import utils
+from binalyzer_rest.plan import compile_plan
+
+from .bench_transform import _template, _field
+
+
+def grouped_templates(fields, group_size=100, field_size=4, step=1):
+    """Fields in groups of `group_size`, where the destination keeps every
+    `step`-th field of each group.
+    """
+    def groups(step):
+        return [_field('g{}'.format(i), None, [
+            _field('g{}_f{}'.format(i, j), field_size)
+            for j in range(0, min(group_size, fields - i * group_size), step)
+        ]) for i in range((fields + group_size - 1) // group_size)]
+
+    return (_template('a', groups(1)), _template('a', groups(step)),
+            fields * field_size)
+
+
+def _best_of(repeat, fn):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def run(fields, step, repeat, max_tree_fields):
+    """Runs the benchmark for a number of fields and returns its results as
+    dictionary.
+    """
+    (source, destination, data_size) = grouped_templates(fields, step=step)
+    data = os.urandom(data_size)
+
+    def parse():
+        return (XMLTemplateParser(source).parse(),
+                XMLTemplateParser(destination).parse())
+
+    start = time.perf_counter()
+    templates = parse()
+    parse_duration = time.perf_counter() - start
+    transform_plan = compile_plan(*templates)
+    compile_duration = time.perf_counter() - start - parse_duration
+
+    def apply_plan():
+        return transform_plan.apply(data)
+
+    def transform():
+        (source_template, destination_template) = parse()
+        utils.bind_data(source_template, source_template.name, data)
+        Binalyzer().transform(source_template, destination_template)
+        return b''.join(utils.iter_chunks(destination_template))
+
+    result = {
+        'fields': fields,
+        'step': step,
+        'data_size': data_size,
+        'copies': len(transform_plan.copies),
+        'parse': parse_duration,
+        'compile': compile_duration,
+        'plan': _best_of(repeat, apply_plan),
+        'tree': None,
+    }
+    if fields <= max_tree_fields:
+        # The transformation is slow enough to be measured once, which also
+        # checks that both produce the same data.
+        start = time.perf_counter()
+        output = transform()
+        result['tree'] = time.perf_counter() - start
+        if output != apply_plan():
+            raise AssertionError('Plan and transformation differ.')
+    return result
+
+
+def report(result):
+    tree = ('{:>10.2f} ms'.format(result['tree'] * 1000)
+            if result['tree'] is not None else '{:>13}'.format('skipped'))
+    print('{:>6} fields, step {}, {:>6} copies  parse {:>10.2f} ms  '
+          'compile {:>8.2f} ms  plan {:>8.3f} ms  tree {}'.format(
+              result['fields'], result['step'], result['copies'],
+              result['parse'] * 1000, result['compile'] * 1000,
+              result['plan'] * 1000, tree))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--fields', type=int, action='append',
+                        help='Number of fields, 1000, 5000 and 10000 by '
+                        'default.')
+    parser.add_argument('--step', type=int, action='append',
+                        help='Keep every n-th field in the destination, 1 '
+                        'and 2 by default.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-tree-fields', type=int, default=1000)
+    parser.add_argument('--json', metavar='PATH',
+                        help='Write the results to a JSON file.')
+    args = parser.parse_args(argv)
+
+    results = []
+    for fields in args.fields or [1000, 5000, 10000]:
+        for step in args.step or [1, 2]:
+            result = run(fields, step, args.repeat, args.max_tree_fields)
+            report(result)
+            results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
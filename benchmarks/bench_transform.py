@@ -0,0 +1,412 @@
+"""
+    benchmarks.bench_transform
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures latency, throughput and memory usage of the `/transform`
+    endpoint.
+
+    The benchmark generates synthetic templates and data, serves them from a
+    local HTTP server and drives `/transform` at a fixed concurrency. Results
+    are either returned inline or deployed to a local upload sink. Each
+    scenario runs in a fresh process, so its peak RSS is measured in
+    isolation.
+
+    The server started by the benchmark also reports the RSS of the process
+    at the end of each stage of the `Server-Timing` header, e.g. `fetch`,
+    `bind` and `transform`, as the maximum over all requests. Requests run
+    concurrently, so the RSS of a stage includes the memory of other
+    requests, run with `--concurrency 1` to attribute memory to stages.
+    Results are streamed to the client or the upload sink after the stages
+    have been timed, so serializing them has no stage of its own and is only
+    part of the latency and of the peak RSS.
+
+    Results are requested with `Accept-Encoding: identity` by default, so
+    the timings don't include compressing random data, see
+    `--accept-encoding`.
+
+    The result cache of the server started by the benchmark is disabled, so
+    each request is transformed. A running server given by `--url` should
+    be started with the result cache disabled as well.
+
+    Usage::
+
+        ~$ python3 -m benchmarks.bench_transform --scenario flat --requests 200
+        ~$ python3 -m benchmarks.bench_transform --scenario blob \\
+               --concurrency 1 --accept-encoding gzip
+        ~$ python3 -m benchmarks.bench_transform --url http://localhost:8000
+
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import contextlib
+import argparse
+import resource
+import tempfile
+import threading
+import multiprocessing
+
+from http.server import (
+    ThreadingHTTPServer,
+    SimpleHTTPRequestHandler,
+    BaseHTTPRequestHandler,
+)
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def flat_templates(fields=4096, field_size=8, group_size=128):
+    """Thousands of small fields, half of which are kept in the destination.
+
+    Offsets are resolved recursively along siblings, which limits the number
+    of fields a template may have at the same level, so the fields are
+    grouped in groups of `group_size`.
+    """
+    def groups(step):
+        return [_field('g{}'.format(i), None, [
+            _field('g{}_f{}'.format(i, j), field_size)
+            for j in range(0, min(group_size, fields - i * group_size), step)
+        ]) for i in range((fields + group_size - 1) // group_size)]
+
+    return (_template('a', groups(1)), _template('a', groups(2)),
+            fields * field_size)
+
+
+def deep_templates(depth=5, fanout=3, field_size=4):
+    """Deeply nested fields, where the destination grows every leaf.
+    """
+    def nodes(level, prefix, size):
+        if level == depth:
+            return _field(prefix, size)
+        return _field(prefix, None, [nodes(level + 1,
+                                           '{}_{}'.format(prefix, i),
+                                           size)
+                                     for i in range(fanout)])
+
+    source = _template('a', [nodes(1, 'n{}'.format(i), field_size)
+                             for i in range(fanout)])
+    destination = _template('a', [nodes(1, 'n{}'.format(i), field_size * 2)
+                                  for i in range(fanout)])
+    return (source, destination, fanout ** depth * field_size)
+
+
+def blob_templates(size=16 * 1024 * 1024, fields=4):
+    """A few multi-megabyte fields, where the destination drops one.
+    """
+    field_size = size // fields
+    source = _template('a', [_field('f{}'.format(i), field_size)
+                             for i in range(fields)])
+    destination = _template('a', [_field('f{}'.format(i), field_size)
+                                  for i in range(1, fields)])
+    return (source, destination, field_size * fields)
+
+
+def wasm_templates(sections=8, entries=32, entry_size=16):
+    """A WebAssembly-like module of sections, each with a header and a
+    payload of entries. The destination drops every other entry.
+    """
+    def section(i, step):
+        return _field('section{}'.format(i), None, [
+            _field('section{}_id'.format(i), 1),
+            _field('section{}_size'.format(i), 4),
+            _field('section{}_payload'.format(i), None, [
+                _field('section{}_entry{}'.format(i, j), entry_size)
+                for j in range(0, entries, step)
+            ]),
+        ])
+
+    header = [_field('magic', 4), _field('version', 4)]
+    source = _template('module', header + [section(i, 1)
+                                           for i in range(sections)])
+    destination = _template('module', header + [section(i, 2)
+                                                for i in range(sections)])
+    size = 8 + sections * (5 + entries * entry_size)
+    return (source, destination, size)
+
+
+SCENARIOS = {
+    'flat': flat_templates,
+    'deep': deep_templates,
+    'blob': blob_templates,
+    'wasm': wasm_templates,
+}
+
+
+def _template(name, children):
+    return '<template name="{}">\n{}\n</template>\n'.format(
+        name, '\n'.join(children))
+
+
+def _field(name, size, children=()):
+    size_attribute = ' size="{}"'.format(size) if size is not None else ''
+    return '<field name="{}"{}>{}</field>'.format(
+        name, size_attribute, '\n'.join(children))
+
+
+class StaticHandler(SimpleHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    """Accepts and discards uploads.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_PUT(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                self.rfile.read(size + 2)
+                if not size:
+                    break
+        else:
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def _serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+
+def _percentile(values, percentile):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(int(round(percentile / 100 * (len(values) - 1))),
+                len(values) - 1)
+    return values[index]
+
+
+def _stages(server_timing):
+    stages = {}
+    for metric in filter(None, server_timing.split(', ')):
+        (stage, duration) = metric.split(';dur=')
+        stages[stage] = float(duration) / 1000
+    return stages
+
+
+def _rss_kb():
+    # The current RSS, where /proc isn't available the peak RSS is used.
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _track_stage_rss(metrics):
+    """Records the RSS at the end of each stage timed by the server running
+    in the benchmark process, as the maximum per stage.
+    """
+    stage_rss = {}
+    timed = metrics.timed
+
+    @contextlib.contextmanager
+    def tracked(stage):
+        with timed(stage):
+            try:
+                yield
+            finally:
+                stage_rss[stage] = max(stage_rss.get(stage, 0), _rss_kb())
+
+    metrics.timed = tracked
+    return stage_rss
+
+
+def run_scenario(name, requests_count, concurrency, deploy, url=None,
+                 result_cache=False, accept_encoding='identity'):
+    """Runs a scenario and returns its results as dictionary.
+
+    :param result_cache: whether the result cache of the server started by
+                         the benchmark is enabled, which measures cache hits
+                         instead of transformations
+    :param accept_encoding: `Accept-Encoding` of the requests, results are
+                            compressed unless it is `identity`
+    """
+    (source, destination, data_size) = SCENARIOS[name]()
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, 'source.xml'), 'w') as f:
+            f.write(source)
+        with open(os.path.join(directory, 'destination.xml'), 'w') as f:
+            f.write(destination)
+        with open(os.path.join(directory, 'source.bin'), 'wb') as f:
+            f.write(os.urandom(data_size))
+
+        def handler(*args, **kwargs):
+            return StaticHandler(*args, directory=directory, **kwargs)
+
+        files_url = _serve(ThreadingHTTPServer(('127.0.0.1', 0), handler))
+        sink_url = _serve(ThreadingHTTPServer(('127.0.0.1', 0), SinkHandler))
+
+        stage_rss = {}
+        if url is None:
+            from werkzeug.serving import make_server, WSGIRequestHandler
+            from binalyzer_rest import cache
+            from binalyzer_rest import metrics
+            from binalyzer_rest.rest import flask_app
+
+            cache.configure(maxsize=64 * 1024 * 1024 if result_cache else 0)
+            stage_rss = _track_stage_rss(metrics)
+
+            class QuietHandler(WSGIRequestHandler):
+
+                def log_request(self, *args, **kwargs):
+                    pass
+
+            url = _serve(make_server('127.0.0.1', 0, flask_app, threaded=True,
+                                     request_handler=QuietHandler))
+
+        params = {
+            'source_template_url': files_url + '/source.xml',
+            'source_binding': [{
+                'template_name': source.split('"')[1],
+                'data_url': files_url + '/source.bin',
+            }],
+            'destination_template_url': files_url + '/destination.xml',
+            'destination_binding': [],
+            'deployment_url': sink_url + '/upload.bin' if deploy else None,
+        }
+
+        session = requests.Session()
+        session.headers['Accept-Encoding'] = accept_encoding
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+        session.mount('http://', adapter)
+
+        def send(_):
+            start = time.perf_counter()
+            response = session.post(url + '/transform', json=params)
+            response.raise_for_status()
+            elapsed = time.perf_counter() - start
+            return (elapsed, _stages(response.headers.get('Server-Timing', '')))
+
+        # The first request pays for cold caches and is not measured.
+        send(None)
+        stage_rss.clear()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(send, range(requests_count)))
+        duration = time.perf_counter() - start
+    finally:
+        shutil.rmtree(directory)
+
+    latencies = [latency for (latency, _) in results]
+    stage_names = sorted({stage for (_, stages) in results
+                          for stage in stages})
+    return {
+        'scenario': name,
+        'requests': requests_count,
+        'concurrency': concurrency,
+        'deploy': deploy,
+        'result_cache': result_cache,
+        'accept_encoding': accept_encoding,
+        'data_size': data_size,
+        'requests_per_second': requests_count / duration,
+        'p50': _percentile(latencies, 50),
+        'p99': _percentile(latencies, 99),
+        'stages': {
+            stage: {
+                'p50': _percentile([stages.get(stage, 0.0)
+                                    for (_, stages) in results], 50),
+                'p99': _percentile([stages.get(stage, 0.0)
+                                    for (_, stages) in results], 99),
+                'rss_kb': stage_rss.get(stage),
+            }
+            for stage in stage_names
+        },
+        # Only meaningful if the server runs in the benchmark process.
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def _run_isolated(queue, *args):
+    try:
+        queue.put(run_scenario(*args))
+    except Exception as error:
+        queue.put(error)
+        raise
+
+
+def report(result):
+    print('{}: {} requests, concurrency {}, {} bytes, {}, {}{}'.format(
+        result['scenario'], result['requests'], result['concurrency'],
+        result['data_size'], 'deployed' if result['deploy'] else 'returned',
+        result['accept_encoding'],
+        ', result cache' if result['result_cache'] else ''))
+    print('  {:>10.1f} requests/s  p50 {:>8.2f} ms  p99 {:>8.2f} ms  '
+          'peak RSS {:>8.1f} MiB'.format(result['requests_per_second'],
+                                         result['p50'] * 1000,
+                                         result['p99'] * 1000,
+                                         result['peak_rss_kb'] / 1024))
+    for (stage, timing) in result['stages'].items():
+        rss = ''
+        if timing['rss_kb'] is not None:
+            rss = '  RSS {:>8.1f} MiB'.format(timing['rss_kb'] / 1024)
+        print('  {:>10}  p50 {:>8.2f} ms  p99 {:>8.2f} ms{}'.format(
+            stage, timing['p50'] * 1000, timing['p99'] * 1000, rss))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenario', action='append',
+                        choices=sorted(SCENARIOS),
+                        help='Scenario to run, all scenarios by default.')
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--deploy', action='store_true',
+                        help='Deploy results to an upload sink instead of '
+                        'returning them.')
+    parser.add_argument('--result-cache', action='store_true',
+                        help='Enable the result cache of the server started '
+                        'by the benchmark, which measures cache hits.')
+    parser.add_argument('--accept-encoding', default='identity',
+                        help='Accept-Encoding of the requests, e.g. gzip to '
+                        'include compressing the results.')
+    parser.add_argument('--url',
+                        help='URL of a running server, by default a server '
+                        'is started within the benchmark.')
+    parser.add_argument('--json', metavar='PATH',
+                        help='Write the results to a JSON file.')
+    args = parser.parse_args(argv)
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for name in args.scenario or sorted(SCENARIOS):
+        queue = context.Queue()
+        process = context.Process(target=_run_isolated,
+                                  args=(queue, name, args.requests,
+                                        args.concurrency, args.deploy,
+                                        args.url, args.result_cache,
+                                        args.accept_encoding))
+        process.start()
+        result = queue.get()
+        process.join()
+        if isinstance(result, Exception):
+            raise result
+        report(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
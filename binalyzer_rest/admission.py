@@ -0,0 +1,167 @@
+"""
+    binalyzer_rest.admission
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module implements the admission control of transformations, which
+    limits the number of concurrent transformations and the size of the data
+    they hold. Requests exceeding the limits wait for a bounded time and are
+    rejected afterwards, before any data is fetched.
+"""
+import time
+import threading
+
+from . import metrics
+
+
+class OverloadedError(Exception):
+    """Raised if a transformation is not admitted.
+
+    :param status: HTTP status code of the response, `429` if too many
+                   transformations are waiting, `503` if waiting timed out
+    :param retry_after: seconds after which the request may be retried
+    """
+
+    def __init__(self, message, status, retry_after):
+        super(OverloadedError, self).__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Ticket(object):
+    """An admitted transformation, which is released once it is done.
+    """
+
+    def __init__(self, controller, size):
+        self.controller = controller
+        self.size = size
+        self._released = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self.size)
+
+
+class AdmissionController(object):
+    """Admits transformations within the configured limits, where a limit
+    of zero disables it.
+
+    :param max_transforms: maximum number of concurrent transformations
+    :param max_bytes: maximum size of the data bound by concurrent
+                      transformations. A transformation larger than this is
+                      admitted if no other one is running.
+    :param max_wait: seconds a transformation waits to be admitted
+    :param max_waiting: maximum number of waiting transformations
+    :param retry_after: seconds clients are asked to wait before retrying a
+                        rejected transformation
+    """
+
+    def __init__(self, max_transforms=0, max_bytes=0, max_wait=10.0,
+                 max_waiting=0, retry_after=1):
+        self.max_transforms = max_transforms
+        self.max_bytes = max_bytes
+        self.max_wait = max_wait
+        self.max_waiting = max_waiting
+        self.retry_after = retry_after
+        self.transforms = 0
+        self.bytes = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    @property
+    def measures_size(self):
+        """Whether the size of a transformation's data is needed to admit it.
+        """
+        return self.max_bytes > 0
+
+    def admit(self, size=0):
+        """Waits until a transformation of the given size is within the
+        limits and returns its :class:`Ticket`.
+
+        :raises OverloadedError: if too many transformations are waiting or
+                                 waiting timed out
+        """
+        deadline = time.monotonic() + self.max_wait
+        with self._condition:
+            if not self._fits(size):
+                if self.max_waiting and self.waiting >= self.max_waiting:
+                    rejected_transforms.inc(reason='queue_full')
+                    raise OverloadedError('Too many transformations waiting.',
+                                          429, self.retry_after)
+                self.waiting += 1
+                try:
+                    with metrics.timed('admission'):
+                        self._wait(size, deadline)
+                finally:
+                    self.waiting -= 1
+            self.transforms += 1
+            self.bytes += size
+        return Ticket(self, size)
+
+    def load(self):
+        """Returns the current load and the limits as dictionary.
+        """
+        with self._condition:
+            return {
+                'transforms': self.transforms,
+                'bytes': self.bytes,
+                'waiting': self.waiting,
+                'max_transforms': self.max_transforms,
+                'max_bytes': self.max_bytes,
+                'max_waiting': self.max_waiting,
+            }
+
+    def _wait(self, size, deadline):
+        while not self._fits(size):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                rejected_transforms.inc(reason='timeout')
+                raise OverloadedError('Timed out waiting for admission.',
+                                      503, self.retry_after)
+            self._condition.wait(remaining)
+
+    def _fits(self, size):
+        if self.max_transforms and self.transforms >= self.max_transforms:
+            return False
+        if (self.max_bytes and self.transforms and
+                self.bytes + size > self.max_bytes):
+            return False
+        return True
+
+    def _release(self, size):
+        with self._condition:
+            self.transforms -= 1
+            self.bytes -= size
+            self._condition.notify_all()
+
+
+controller = AdmissionController()
+
+
+def configure(**kwargs):
+    """Replaces the shared admission controller by one created with the
+    given arguments, see :class:`AdmissionController`.
+    """
+    global controller
+    controller = AdmissionController(**kwargs)
+
+
+rejected_transforms = metrics.Counter(
+    'binalyzer_rejected_transforms_total',
+    'Transformations rejected by the admission control.',
+    ('reason',))
+metrics.Callback('binalyzer_admitted_transforms',
+                 'Transformations currently admitted.',
+                 'gauge', lambda: controller.transforms)
+metrics.Callback('binalyzer_waiting_transforms',
+                 'Transformations waiting for admission.',
+                 'gauge', lambda: controller.waiting)
+metrics.Callback('binalyzer_admitted_bytes',
+                 'Size of the data bound by admitted transformations.',
+                 'gauge', lambda: controller.bytes)
@@ -0,0 +1,362 @@
+"""
+    binalyzer_rest.cache
+    ~~~~~~~~~~~~~~~~~~~~
+
+    This module implements the caches used by the Binalyzer REST API.
+"""
+import os
+import hashlib
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+from binalyzer import XMLTemplateParser
+from binalyzer_core.factory import TemplateFactory
+
+from . import metrics
+from . import compiler
+from .plan import compile_plan
+from .index import TemplateIndex
+from .layout import TemplateLayout
+
+_MISSING = object()
+
+
+def digest(content):
+    """Returns the hex encoded SHA-256 digest of the given text or bytes.
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
+class LRUCache(object):
+    """A bounded, thread-safe mapping that evicts the least recently used
+    entries once the size of all entries exceeds `maxsize`. Each entry has a
+    size of one, unless :meth:`sizeof` is overridden.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def sizeof(self, value):
+        return 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        value = self._load(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        LRUCache.put(self, key, value)
+        return value
+
+    def put(self, key, value):
+        if self.sizeof(value) > self.maxsize:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= self.sizeof(self._entries[key])
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self.size += self.sizeof(value)
+            while self.size > self.maxsize:
+                (_, evicted) = self._entries.popitem(last=False)
+                self.size -= self.sizeof(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def _load(self, key):
+        """Called on a miss to load the value from elsewhere, returns `None`
+        if there is none.
+        """
+        return None
+
+
+class TemplateCache(LRUCache):
+    """Caches parsed templates keyed by their URL and content digest.
+
+    Templates are cached in a compact form, as compiled template, see
+    :mod:`~binalyzer_rest.compiler`, and as
+    :class:`~binalyzer_rest.layout.TemplateLayout`. Each lookup loads a new
+    template from the compiled template, which is considerably cheaper than
+    parsing the template description again. Its nodes are looked up using
+    the layout. Templates that can't be compiled are cached as prototypes,
+    which are never bound to data and cloned by each lookup.
+
+    Template descriptions are either XML or compiled templates. If a
+    directory is given, compiled templates are stored there keyed by their
+    digest, so they aren't parsed again after restarts or by other
+    processes.
+    """
+
+    def __init__(self, maxsize=64, directory=None):
+        super(TemplateCache, self).__init__(maxsize)
+        self.directory = directory
+        self._template_factory = TemplateFactory()
+
+    def get_template(self, template_url, template_text):
+        (compiled, template_layout, prototype) = self._get_entry(
+            template_url, template_text)
+        if compiled is not None:
+            template = compiler.load_template(compiled)
+        else:
+            template = self._template_factory.clone(prototype)
+        template._template_index = TemplateIndex(template, template_layout)
+        return template
+
+    def get_layout(self, template_url, template_text):
+        """Returns the :class:`~binalyzer_rest.layout.TemplateLayout` of a
+        template description.
+        """
+        (_, template_layout, _) = self._get_entry(template_url, template_text)
+        return template_layout
+
+    def get_compiled(self, template_url, template_text):
+        """Returns the compiled form of a template description.
+        """
+        (compiled, _, prototype) = self._get_entry(template_url,
+                                                   template_text)
+        if compiled is None:
+            # Raises the error that prevented compiling the template.
+            compiled = compiler.compile_template(prototype)
+        return compiled
+
+    def _get_entry(self, template_url, template_text):
+        template_digest = digest(template_text)
+        key = (template_url, template_digest)
+        entry = self.get(key)
+        if entry is None:
+            entry = self._create_entry(template_digest, template_text)
+            self.put(key, entry)
+        return entry
+
+    def _create_entry(self, template_digest, template_text):
+        if compiler.is_compiled(template_text):
+            compiled = bytes(template_text)
+        else:
+            compiled = self._load_compiled(template_digest)
+
+        with metrics.timed('parse'):
+            if compiled is not None:
+                prototype = compiler.load_template(compiled)
+            else:
+                prototype = XMLTemplateParser(template_text).parse()
+                try:
+                    compiled = compiler.compile_template(prototype)
+                except compiler.CompileError:
+                    compiled = None
+                if compiled is not None and self.directory:
+                    self._store_compiled(template_digest, compiled)
+            template_layout = TemplateLayout.from_template(prototype)
+
+        if compiled is not None:
+            # Templates are loaded from their compiled form, so the nodes of
+            # the prototype aren't kept.
+            prototype = None
+        return (compiled, template_layout, prototype)
+
+    def _load_compiled(self, template_digest):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(template_digest), 'rb') as compiled_file:
+                compiled = compiled_file.read()
+        except OSError:
+            return None
+        return compiled if compiler.is_compiled(compiled) else None
+
+    def _store_compiled(self, template_digest, compiled):
+        os.makedirs(self.directory, exist_ok=True)
+        (fd, tmp_path) = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(compiled)
+        os.replace(tmp_path, self._path(template_digest))
+
+    def _path(self, template_digest):
+        return os.path.join(self.directory, template_digest + '.template')
+
+
+class PlanCache(LRUCache):
+    """Caches transform plans keyed by the content digests of their template
+    pair, see :mod:`binalyzer_rest.plan`. Template pairs without a plan are
+    cached as well, so each pair is compiled at most once.
+    """
+
+    def get_plan(self, source_template_url, source_template_text,
+                 destination_template_url, destination_template_text):
+        """Returns the transform plan of a template pair, or `None` if it
+        has none.
+        """
+        key = (digest(source_template_text), digest(destination_template_text))
+        transform_plan = self.get(key, _MISSING)
+        if transform_plan is _MISSING:
+            source_layout = template_cache.get_layout(
+                source_template_url, source_template_text)
+            destination_layout = template_cache.get_layout(
+                destination_template_url, destination_template_text)
+            with metrics.timed('compile'):
+                transform_plan = compile_plan(source_layout,
+                                              destination_layout)
+            self.put(key, transform_plan)
+        return transform_plan
+
+
+class ResultCache(LRUCache):
+    """Caches transformation results keyed by the digests of the templates
+    and data they are computed from, see :func:`result_key`.
+
+    Results are kept in memory up to a total of `maxsize` bytes. If a
+    directory is given, results are also stored there up to a total of
+    `max_disk_size` bytes, so they outlive their eviction from memory and
+    restarts of the server. The cache is disabled by default, since keys
+    are computed on each transformation.
+    """
+
+    def __init__(self, maxsize=0, directory=None,
+                 max_disk_size=1024 * 1024 * 1024):
+        super(ResultCache, self).__init__(maxsize)
+        self.directory = directory
+        self.max_disk_size = max_disk_size
+        self._disk_lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0 or bool(self.directory)
+
+    def sizeof(self, value):
+        return len(value)
+
+    def cacheable(self, size):
+        """Returns whether a result of the given size is cached at all.
+        """
+        return (size <= self.maxsize or
+                bool(self.directory) and size <= self.max_disk_size)
+
+    def put(self, key, value):
+        super(ResultCache, self).put(key, value)
+        if self.directory and len(value) <= self.max_disk_size:
+            self._store(key, value)
+
+    def _load(self, key):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as result_file:
+                value = result_file.read()
+            # The modification time orders results for eviction.
+            os.utime(path)
+        except OSError:
+            return None
+        return value
+
+    def _store(self, key, value):
+        (fd, tmp_path) = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(value)
+        os.replace(tmp_path, self._path(key))
+        with self._disk_lock:
+            self._evict_from_disk()
+
+    def _evict_from_disk(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.result'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        disk_size = sum(size for (_, size, _) in entries)
+        for (_, size, path) in entries:
+            if disk_size <= self.max_disk_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            disk_size -= size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.result')
+
+
+def result_key(source_template_text, source_data, destination_template_text,
+               destination_data):
+    """Returns the key of a transformation result in the :class:`ResultCache`.
+
+    :param source_data: a list of `(template_name, data)` tuples bound to the
+                        source template
+    :param destination_data: a list of `(template_name, data)` tuples bound to
+                             the destination template
+    """
+    key = hashlib.sha256()
+    for (template_text, bindings) in ((source_template_text, source_data),
+                                      (destination_template_text,
+                                       destination_data)):
+        key.update(digest(template_text).encode('ascii'))
+        for (template_name, data) in bindings:
+            key.update(b'\0' + str(template_name).encode('utf-8') + b'\0')
+            key.update(digest(data).encode('ascii'))
+        key.update(b'\n')
+    return key.hexdigest()
+
+
+template_cache = TemplateCache()
+plan_cache = PlanCache()
+result_cache = ResultCache()
+
+
+def configure(**kwargs):
+    """Replaces the shared result cache by one created with the given
+    arguments, see :class:`ResultCache`.
+    """
+    global result_cache
+    result_cache = ResultCache(**kwargs)
+
+
+metrics.Callback('binalyzer_template_cache_hits_total',
+                 'Templates served from the template cache.',
+                 'counter', lambda: template_cache.hits)
+metrics.Callback('binalyzer_template_cache_misses_total',
+                 'Templates missing in the template cache.',
+                 'counter', lambda: template_cache.misses)
+metrics.Callback('binalyzer_template_cache_entries',
+                 'Templates stored in the template cache.',
+                 'gauge', lambda: len(template_cache))
+metrics.Callback('binalyzer_plan_cache_entries',
+                 'Template pairs stored in the transform plan cache.',
+                 'gauge', lambda: len(plan_cache))
+metrics.Callback('binalyzer_result_cache_hits_total',
+                 'Transformation results served from the result cache.',
+                 'counter', lambda: result_cache.hits)
+metrics.Callback('binalyzer_result_cache_misses_total',
+                 'Transformation results missing in the result cache.',
+                 'counter', lambda: result_cache.misses)
+metrics.Callback('binalyzer_result_cache_bytes',
+                 'Bytes of transformation results stored in memory.',
+                 'gauge', lambda: result_cache.size)
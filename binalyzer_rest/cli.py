@@ -16,7 +16,16 @@ from flask.cli import (
     show_server_banner,
 )
 
+from . import jobs
+from . import cache
+from . import admission
+from . import deployment
+from . import server
+from . import workers
+from . import registry
+from . import transport
 from .rest import flask_app
+from .cache import template_cache
 
 
 @click.command()
@@ -38,9 +47,170 @@ from .rest import flask_app
               'is active if debug is enabled.')
 @click.option('--with-threads/--without-threads', default=True,
               help='Enable or disable multithreading.')
-def rest(host, port, reload, debugger, with_threads, cert):
+@click.option('--server', 'server_type',
+              type=click.Choice(['development', 'production']),
+              default='development', show_default=True,
+              help='Run the development server or the production server, '
+              'which requires gunicorn.')
+@click.option('--server-processes', default=1, show_default=True,
+              help='Number of processes of the production server. Jobs and '
+              'metrics are kept per process, so with more than one process '
+              '/jobs/<id> only finds jobs submitted to the same process and '
+              '/metrics only reports the process that answers.')
+@click.option('--threads', default=8, show_default=True,
+              help='Number of request threads per production server process.')
+@click.option('--backlog', default=2048, show_default=True,
+              help='Maximum number of pending connections of the production '
+              'server.')
+@click.option('--keep-alive', default=5, show_default=True,
+              help='Seconds the production server waits for requests on a '
+              'keep-alive connection.')
+@click.option('--graceful-timeout', default=30, show_default=True,
+              help='Seconds given to production server processes to finish '
+              'their requests on restarts and shutdown.')
+@click.option('--max-requests', default=0, show_default=True,
+              help='Number of requests after which a production server '
+              'process is gracefully restarted. Disabled if zero.')
+@click.option('--template-cache-size', default=64, show_default=True,
+              help='Number of parsed templates to keep in memory.')
+@click.option('--template-cache-dir',
+              type=click.Path(file_okay=False, resolve_path=True),
+              help='Directory used to store compiled templates, so they '
+              'aren\'t parsed again after restarts.')
+@click.option('--templates', 'templates_path',
+              type=click.Path(exists=True, resolve_path=True),
+              help='Directory of *.xml or compiled *.template templates or '
+              'JSON file mapping names to template paths or URLs. The '
+              'templates are registered by name and parsed at startup.')
+@click.option('--result-cache-size', default=0, show_default=True,
+              help='Size in MiB of transformation results kept in memory. '
+              'The result cache is disabled if zero and no result cache '
+              'directory is given.')
+@click.option('--result-cache-dir',
+              type=click.Path(file_okay=False, resolve_path=True),
+              help='Directory used to cache transformation results.')
+@click.option('--result-cache-disk-size', default=1024, show_default=True,
+              help='Size in MiB of transformation results kept in the result '
+              'cache directory.')
+@click.option('--http-pool-size', default=10, show_default=True,
+              help='Number of pooled connections per host.')
+@click.option('--http-timeout', default=30.0, show_default=True,
+              help='Timeout in seconds of outgoing HTTP requests.')
+@click.option('--http-retries', default=3, show_default=True,
+              help='Number of retries of failed outgoing HTTP requests.')
+@click.option('--http-cache-dir',
+              type=click.Path(file_okay=False, resolve_path=True),
+              help='Directory used to cache fetched templates and data.')
+@click.option('--fetch-concurrency', default=8, show_default=True,
+              help='Number of concurrent fetches per request.')
+@click.option('--local-root',
+              type=click.Path(exists=True, file_okay=False, resolve_path=True),
+              help='Directory from which file:// URLs are served.')
+@click.option('--job-workers', default=2, show_default=True,
+              help='Number of threads processing transformation jobs.')
+@click.option('--job-queue-size', default=64, show_default=True,
+              help='Maximum number of jobs waiting to be processed.')
+@click.option('--job-results-size', default=256, show_default=True,
+              help='Maximum size in MiB of the job results retained until '
+              'they are requested, the least recently requested results '
+              'are dropped first.')
+@click.option('--max-transforms', default=0, show_default=True,
+              help='Maximum number of concurrent /transform requests. '
+              'Unlimited if zero.')
+@click.option('--max-transform-size', default=0, show_default=True,
+              help='Maximum size in MiB of the data bound by concurrent '
+              '/transform requests, as told by its Content-Length. '
+              'Unlimited if zero.')
+@click.option('--max-queue-wait', default=10.0, show_default=True,
+              help='Seconds a /transform request waits for admission before '
+              'it is rejected with 503.')
+@click.option('--max-queued-transforms', default=0, show_default=True,
+              help='Maximum number of /transform requests waiting for '
+              'admission, further requests are rejected with 429. '
+              'Unlimited if zero.')
+@click.option('--worker-processes', type=int,
+              help='Number of processes transforming data. '
+              'Defaults to the number of CPUs.')
+@click.option('--offload/--no-offload', default=False,
+              help='Parse and transform /transform requests in worker '
+              'processes instead of the server process.')
+@click.option('--split-transforms/--no-split-transforms', default=False,
+              help='Split destination templates with a static layout into '
+              'their top-level subtrees and transform them in worker '
+              'processes in parallel.')
+@click.option('--deployment-backend',
+              type=click.Choice(sorted(deployment.BACKENDS)),
+              default='put', show_default=True,
+              help='Deploy results by a single PUT request or by S3 '
+              'multipart uploads, whose parts are uploaded in parallel.')
+@click.option('--deployment-part-size', default=8, show_default=True,
+              help='Size in MiB of the parts of multipart uploads.')
+@click.option('--deployment-concurrency', default=4, show_default=True,
+              help='Number of parts of a multipart upload uploaded in '
+              'parallel.')
+def rest(host, port, reload, debugger, with_threads, server_type,
+         server_processes, threads, backlog, keep_alive, graceful_timeout,
+         max_requests, cert, templates_path, template_cache_size,
+         template_cache_dir, result_cache_size, result_cache_dir,
+         result_cache_disk_size,
+         http_pool_size, http_timeout, http_retries, http_cache_dir,
+         fetch_concurrency, local_root, job_workers, job_queue_size,
+         job_results_size,
+         max_transforms, max_transform_size, max_queue_wait,
+         max_queued_transforms, worker_processes, offload,
+         split_transforms, deployment_backend, deployment_part_size,
+         deployment_concurrency):
     """Run a local server (experimental).
     """
+    template_cache.maxsize = template_cache_size
+    template_cache.directory = template_cache_dir
+    cache.configure(maxsize=result_cache_size * 1024 * 1024,
+                    directory=result_cache_dir,
+                    max_disk_size=result_cache_disk_size * 1024 * 1024)
+    transport.configure(pool_size=http_pool_size,
+                        timeout=http_timeout,
+                        retries=http_retries,
+                        cache_dir=http_cache_dir,
+                        concurrency=fetch_concurrency,
+                        local_root=local_root)
+    if deployment_backend == 'multipart':
+        deployment.configure(deployment_backend,
+                             part_size=deployment_part_size * 1024 * 1024,
+                             concurrency=deployment_concurrency,
+                             retries=http_retries)
+    jobs.configure(workers=job_workers, max_queue_size=job_queue_size,
+                   max_result_size=job_results_size * 1024 * 1024)
+    admission.configure(max_transforms=max_transforms,
+                        max_bytes=max_transform_size * 1024 * 1024,
+                        max_wait=max_queue_wait,
+                        max_waiting=max_queued_transforms)
+    if templates_path:
+        registry.configure(templates_path)
+    workers.configure(processes=worker_processes,
+                      offload=offload,
+                      split=split_transforms,
+                      templates=registry.registry.templates.values())
+
+    if server_type == 'production':
+        try:
+            server.run(flask_app,
+                       host,
+                       port,
+                       ssl_context=cert,
+                       workers_count=server_processes,
+                       threads=threads,
+                       backlog=backlog,
+                       keep_alive=keep_alive,
+                       graceful_timeout=graceful_timeout,
+                       max_requests=max_requests)
+        except RuntimeError as e:
+            raise click.UsageError(str(e))
+        return
+
+    registry.registry.start_warm_up()
+    if offload or split_transforms:
+        workers.worker_pool.start()
+
     show_server_banner('production', False)
 
     run_simple(host,
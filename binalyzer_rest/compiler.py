@@ -0,0 +1,389 @@
+"""
+    binalyzer_rest.compiler
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module implements compiled templates, a binary form of parsed
+    templates that is loaded without parsing their XML description.
+
+    A compiled template starts with :data:`MAGIC`, followed by the format
+    version and the number of nodes. The remainder is compressed and stores
+    the nodes in pre-order as columns: the position of each node's parent,
+    the id of its name and the kind and value of each of its properties.
+    Names, references and other strings are stored once in a string table.
+"""
+import sys
+import zlib
+import struct
+
+from array import array
+
+from binalyzer_core import (
+    Template,
+    PropertyBase,
+    ValueProperty,
+    ReferenceProperty,
+    AutoSizeValueProperty,
+    StretchSizeProperty,
+    OffsetValueProperty,
+    RelativeOffsetValueProperty,
+    RelativeOffsetReferenceProperty,
+    TemplateValueProvider,
+)
+from binalyzer_core.value_provider import (
+    ValueProvider,
+    OffsetValueProvider,
+    RelativeOffsetValueProvider,
+    RelativeOffsetReferenceValueProvider,
+    AutoSizeValueProvider,
+    StretchSizeValueProvider,
+)
+from anytree import PreOrderIter
+
+MAGIC = b'BNLZTPL\0'
+VERSION = 1
+
+_HEADER = struct.Struct('<8sHI')
+
+PROPERTIES = (
+    'offset_property',
+    'size_property',
+    'boundary_property',
+    'padding_before_property',
+    'padding_after_property',
+    'count_property',
+)
+
+# Kinds of properties, subclasses are listed before their base classes.
+VALUE = 0
+OFFSET_VALUE = 1
+RELATIVE_OFFSET_VALUE = 2
+RELATIVE_OFFSET_REFERENCE = 3
+STRETCH_SIZE = 4
+AUTO_SIZE = 5
+REFERENCE = 6
+VALUE_PROVIDER = 7
+
+KINDS = (
+    (OffsetValueProperty, OFFSET_VALUE),
+    (RelativeOffsetValueProperty, RELATIVE_OFFSET_VALUE),
+    (RelativeOffsetReferenceProperty, RELATIVE_OFFSET_REFERENCE),
+    (StretchSizeProperty, STRETCH_SIZE),
+    (AutoSizeValueProperty, AUTO_SIZE),
+    (ReferenceProperty, REFERENCE),
+    (ValueProperty, VALUE),
+    (PropertyBase, VALUE_PROVIDER),
+)
+
+# Value providers are stored by name. Compiled templates may come from
+# untrusted sources, so only these providers are loaded, while templates
+# using others, e.g. those of extensions, aren't compiled.
+VALUE_PROVIDERS = {
+    '{}:{}'.format(provider_type.__module__, provider_type.__qualname__):
+        provider_type
+    for provider_type in (
+        ValueProvider,
+        OffsetValueProvider,
+        RelativeOffsetValueProvider,
+        RelativeOffsetReferenceValueProvider,
+        AutoSizeValueProvider,
+        StretchSizeValueProvider,
+    )
+}
+
+NONE = -1
+
+# Compiled templates are decompressed up to this size, so a small compiled
+# template can't inflate to an arbitrary amount of memory.
+MAX_PAYLOAD_SIZE = 256 * 1024 * 1024
+
+# Bytes of the columns stored for each node.
+_NODE_SIZE = 4 + 4 + len(PROPERTIES) * (1 + 8 + 4) + 3 * 4
+
+
+class CompileError(ValueError):
+    """Raised if a template can't be compiled or a compiled template can't
+    be loaded.
+    """
+
+
+def is_compiled(content):
+    """Returns whether the content of a template description is a compiled
+    template.
+    """
+    return isinstance(content, (bytes, bytearray)) and content[:8] == MAGIC
+
+
+def template_description(response):
+    """Returns the description of a fetched template, which is bytes for
+    compiled templates and text otherwise.
+    """
+    content = response.content
+    if is_compiled(content):
+        return content
+    return response.text
+
+
+def compile_template(template):
+    """Returns the compiled form of a parsed template, which must not be
+    bound to data.
+    """
+    strings = _StringTable()
+    nodes = list(PreOrderIter(template))
+    positions = {id(node): position for (position, node) in enumerate(nodes)}
+
+    parents = array('i')
+    names = array('i')
+    kinds = array('b')
+    values = array('q')
+    providers = array('i')
+    extras = array('i')
+    for node in nodes:
+        parents.append(NONE if node is template
+                       else positions[id(node.parent)])
+        names.append(strings.add(node.name))
+        for name in PROPERTIES:
+            (kind, value, provider) = _compile_property(getattr(node, name),
+                                                        strings)
+            kinds.append(kind)
+            values.append(value)
+            providers.append(provider)
+        extras.append(strings.add(node.hint_property))
+        extras.append(strings.add(_hex(node.signature_property)))
+        extras.append(strings.add(_hex(node.text_property)))
+
+    columns = [parents, names, kinds, values, providers, extras]
+    if sys.byteorder != 'little':
+        for column in columns:
+            column.byteswap()
+    payload = strings.encode() + b''.join(column.tobytes()
+                                          for column in columns)
+    return (_HEADER.pack(MAGIC, VERSION, len(nodes)) +
+            zlib.compress(payload))
+
+
+def load_template(content):
+    """Returns the template of a compiled template. Raises a
+    :class:`CompileError` if the content is not a valid compiled template.
+    """
+    if not is_compiled(content):
+        raise CompileError('Not a compiled template.')
+    try:
+        return _load(content)
+    except CompileError:
+        raise
+    except (zlib.error, struct.error, UnicodeDecodeError, ValueError,
+            IndexError) as error:
+        raise CompileError('Invalid compiled template: {}'.format(error))
+
+
+def _load(content):
+    (_, version, count) = _HEADER.unpack_from(content)
+    if version != VERSION:
+        raise CompileError(
+            'Unsupported compiled template version: {}'.format(version))
+    if not count:
+        raise CompileError('Invalid compiled template: no nodes')
+    payload = _Payload(memoryview(content)[_HEADER.size:], count * _NODE_SIZE)
+    strings = _StringTable.decode(payload)
+
+    columns = []
+    for (typecode, length) in (('i', count), ('i', count),
+                               ('b', count * len(PROPERTIES)),
+                               ('q', count * len(PROPERTIES)),
+                               ('i', count * len(PROPERTIES)),
+                               ('i', count * 3)):
+        column = array(typecode)
+        column.frombytes(payload.read(column.itemsize * length))
+        if sys.byteorder != 'little':
+            column.byteswap()
+        columns.append(column)
+    payload.close()
+    (parents, names, kinds, values, providers, extras) = columns
+
+    nodes = []
+    for position in range(count):
+        # Parents precede their children, only the root has none.
+        parent = parents[position]
+        if (parent == NONE) != (position == 0) or parent >= position:
+            raise CompileError(
+                'Invalid compiled template: parent of node {}'.format(
+                    position))
+        node = Template(name=_string(strings, names[position]))
+        first = position * len(PROPERTIES)
+        for (index, name) in enumerate(PROPERTIES):
+            setattr(node, name, _load_property(node,
+                                               kinds[first + index],
+                                               values[first + index],
+                                               providers[first + index],
+                                               strings))
+        node.hint_property = _string(strings, extras[3 * position])
+        node.signature_property = _bytes(strings, extras[3 * position + 1])
+        node.text_property = _bytes(strings, extras[3 * position + 2])
+        if parent != NONE:
+            node.parent = nodes[parent]
+        nodes.append(node)
+    return nodes[0]
+
+
+class _Payload(object):
+    # Decompresses the payload as it is read. Its expected size grows as the
+    # sizes of the strings are read and is checked against MAX_PAYLOAD_SIZE
+    # before the bytes are decompressed.
+
+    def __init__(self, compressed, size):
+        self.size = size
+        self._position = 0
+        self._tail = compressed
+        self._decompressor = zlib.decompressobj()
+        self.expect(0)
+
+    def expect(self, size):
+        """Adds `size` bytes to the expected size of the payload.
+        """
+        self.size += size
+        if self.size > MAX_PAYLOAD_SIZE:
+            raise CompileError('Invalid compiled template: exceeds {} bytes'
+                               .format(MAX_PAYLOAD_SIZE))
+
+    def read(self, size):
+        if self._position + size > self.size:
+            raise CompileError('Invalid compiled template: truncated')
+        data = self._inflate(size)
+        if len(data) != size:
+            raise CompileError('Invalid compiled template: truncated')
+        self._position += size
+        return data
+
+    def close(self):
+        if self._position != self.size or self._inflate(1):
+            raise CompileError('Invalid compiled template: trailing data')
+        if not self._decompressor.eof:
+            raise CompileError('Invalid compiled template: truncated')
+
+    def _inflate(self, size):
+        if not size:
+            # A maximum length of zero doesn't limit decompression.
+            return b''
+        data = self._decompressor.decompress(self._tail, size)
+        self._tail = self._decompressor.unconsumed_tail
+        return data
+
+
+class _StringTable(object):
+
+    def __init__(self):
+        self.strings = []
+        self._ids = {}
+
+    def add(self, string):
+        if string is None:
+            return NONE
+        if string not in self._ids:
+            self._ids[string] = len(self.strings)
+            self.strings.append(string)
+        return self._ids[string]
+
+    def encode(self):
+        encoded = [string.encode('utf-8') for string in self.strings]
+        lengths = array('I', [len(string) for string in encoded])
+        if sys.byteorder != 'little':
+            lengths.byteswap()
+        return (struct.pack('<I', len(encoded)) + lengths.tobytes() +
+                b''.join(encoded))
+
+    @staticmethod
+    def decode(payload):
+        payload.expect(4)
+        (count,) = struct.unpack('<I', payload.read(4))
+        lengths = array('I')
+        payload.expect(lengths.itemsize * count)
+        lengths.frombytes(payload.read(lengths.itemsize * count))
+        if sys.byteorder != 'little':
+            lengths.byteswap()
+        payload.expect(sum(lengths))
+        return [payload.read(length).decode('utf-8')
+                for length in lengths]
+
+
+def _compile_property(prop, strings):
+    kind = [kind for (cls, kind) in KINDS if isinstance(prop, cls)][0]
+    provider = NONE
+    value = 0
+    if kind in (VALUE, OFFSET_VALUE):
+        value = prop.value
+        if not isinstance(value, int) or not -2 ** 63 <= value < 2 ** 63:
+            raise CompileError('Unsupported value: {!r}'.format(value))
+    elif kind == RELATIVE_OFFSET_VALUE:
+        value = int(prop.ignore_boundary)
+    elif kind in (REFERENCE, RELATIVE_OFFSET_REFERENCE):
+        value = strings.add(prop.reference_name)
+    if kind in (REFERENCE, VALUE_PROVIDER):
+        provider_type = type(prop.value_provider)
+        if provider_type is TemplateValueProvider:
+            # The byte order is the only state of a value provider.
+            provider = strings.add(prop.value_provider.byteorder)
+        else:
+            name = '{}:{}'.format(provider_type.__module__,
+                                  provider_type.__qualname__)
+            if name not in VALUE_PROVIDERS:
+                raise CompileError(
+                    'Unsupported value provider: {}'.format(name))
+            provider = strings.add(name)
+    return (kind, value, provider)
+
+
+def _load_property(template, kind, value, provider, strings):
+    if kind == VALUE:
+        return ValueProperty(value, template)
+    if kind == OFFSET_VALUE:
+        return OffsetValueProperty(template, value)
+    if kind == RELATIVE_OFFSET_VALUE:
+        return RelativeOffsetValueProperty(template, bool(value))
+    if kind == RELATIVE_OFFSET_REFERENCE:
+        return RelativeOffsetReferenceProperty(template,
+                                               _lookup(strings, value))
+    if kind == STRETCH_SIZE:
+        return StretchSizeProperty(template)
+    if kind == AUTO_SIZE:
+        return AutoSizeValueProperty(template)
+    if kind == REFERENCE:
+        prop = ReferenceProperty(template, _lookup(strings, value))
+    elif kind == VALUE_PROVIDER:
+        prop = PropertyBase(template)
+    else:
+        raise CompileError('Unknown property kind: {}'.format(kind))
+    provider = _lookup(strings, provider)
+    if ':' in provider:
+        if provider not in VALUE_PROVIDERS:
+            raise CompileError(
+                'Unsupported value provider: {}'.format(provider))
+        prop.value_provider = VALUE_PROVIDERS[provider](prop)
+    else:
+        prop.value_provider = TemplateValueProvider(prop)
+        prop.value_provider.byteorder = provider
+    return prop
+
+
+def _hex(content):
+    if content is None:
+        return None
+    return bytes(content).hex()
+
+
+def _lookup(strings, string_id):
+    if not 0 <= string_id < len(strings):
+        raise CompileError(
+            'Invalid compiled template: string {}'.format(string_id))
+    return strings[string_id]
+
+
+def _string(strings, string_id):
+    if string_id == NONE:
+        return None
+    return _lookup(strings, string_id)
+
+
+def _bytes(strings, string_id):
+    if string_id == NONE:
+        return None
+    return bytes.fromhex(_lookup(strings, string_id))
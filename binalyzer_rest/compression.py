@@ -0,0 +1,107 @@
+"""
+    binalyzer_rest.compression
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module implements the streaming compression and decompression of
+    fetched, returned and deployed data. gzip is always supported, zstd if
+    the zstandard package is installed.
+"""
+import zlib
+import posixpath
+
+from urllib.parse import urlparse, unquote
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+SUFFIXES = {
+    '.gz': GZIP,
+    '.zst': ZSTD,
+}
+
+
+def encodings():
+    """Returns the supported encodings, most preferred first.
+    """
+    if zstandard is None:
+        return [GZIP]
+    return [ZSTD, GZIP]
+
+
+def url_encoding(url):
+    """Returns the encoding of a compressed file given by its suffix, e.g.
+    `gzip` for `data.bin.gz`, or `None` if the URL has no such suffix.
+    """
+    suffix = posixpath.splitext(unquote(urlparse(url).path))[1]
+    return SUFFIXES.get(suffix.lower())
+
+
+class UnsupportedEncodingError(ValueError):
+    """Raised if data is compressed or decompressed using an encoding that
+    is not supported.
+    """
+
+
+def compress(chunks, encoding, level=6):
+    """Returns an iterator that compresses an iterable of chunks and yields
+    the compressed chunks.
+    """
+    return _compress(chunks, _compressor(encoding, level))
+
+
+def decompress(chunks, encoding):
+    """Returns an iterator that decompresses an iterable of compressed chunks
+    and yields the decompressed chunks.
+    """
+    return _decompress(chunks, _decompressor(encoding), encoding)
+
+
+def _compress(chunks, compressor):
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _decompress(chunks, decompressor, encoding):
+    for chunk in chunks:
+        decompressed = decompressor.decompress(chunk)
+        if decompressed:
+            yield decompressed
+    if encoding == GZIP:
+        remaining = decompressor.flush()
+        if remaining:
+            yield remaining
+        if not decompressor.eof:
+            raise ValueError('Compressed data is truncated.')
+
+
+def _compressor(encoding, level):
+    if encoding == GZIP:
+        # The window bits select the gzip container instead of zlib's.
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return _zstandard(encoding).ZstdCompressor(level=level).compressobj()
+
+
+def _decompressor(encoding):
+    if encoding == GZIP:
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    return _zstandard(encoding).ZstdDecompressor().decompressobj()
+
+
+def _zstandard(encoding):
+    if encoding != ZSTD:
+        raise UnsupportedEncodingError(
+            'Unsupported encoding: {}'.format(encoding))
+    if zstandard is None:
+        raise UnsupportedEncodingError(
+            'zstd requires zstandard, install it using '
+            '"pip install binalyzer_rest[zstd]".'
+        )
+    return zstandard
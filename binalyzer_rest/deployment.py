@@ -0,0 +1,216 @@
+"""
+    binalyzer_rest.deployment
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module implements the backends deploying transformation results to
+    their deployment URL.
+
+    By default, results are uploaded by a single chunked `PUT`. Large results
+    may be deployed to S3-compatible storage by multipart uploads instead,
+    whose parts are uploaded in parallel, verified by their checksum and
+    retried on their own.
+"""
+import base64
+import hashlib
+import itertools
+import collections
+
+from urllib.parse import urlsplit, urlunsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from . import metrics
+from . import transport
+
+PART_SIZE = 8 * 1024 * 1024
+
+S3_NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+retried_parts = metrics.Counter(
+    'binalyzer_deployment_retried_parts_total',
+    'Parts of multipart uploads retried after a failed upload or checksum '
+    'mismatch.'
+)
+
+
+class DeploymentError(Exception):
+    """Raised if the storage rejects or corrupts a deployed result.
+    """
+
+
+class Deployer(object):
+    """Deploys results by a single `PUT` request. The result is streamed, so
+    a failed upload can't be sent again and raises instead of being retried.
+    """
+
+    def deploy(self, url, chunks, headers=None):
+        """Uploads the given chunks to the URL.
+        """
+        transport.put(url, data=chunks, headers=headers)
+
+
+class MultipartDeployer(Deployer):
+    """Deploys results by S3 multipart uploads. Results that fit into a
+    single part are deployed by a single `PUT` request.
+
+    The result is read as it is uploaded, so at most `concurrency` parts are
+    held in memory. Each part is sent with its `Content-MD5` and its `ETag`
+    is compared with its MD5 digest. Since parts are held in memory, failed
+    parts are retried, and the upload is aborted if a part fails repeatedly.
+
+    :param part_size: size of each part but the last in bytes, S3 requires
+                      at least 5 MiB
+    :param concurrency: maximum number of parts uploaded in parallel
+    :param retries: number of retries of each part
+    """
+
+    def __init__(self, part_size=PART_SIZE, concurrency=4, retries=3):
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.retries = retries
+
+    def deploy(self, url, chunks, headers=None):
+        parts = _iter_parts(chunks, self.part_size)
+        first = next(parts, b'')
+        second = next(parts, None)
+        if second is None:
+            self._retry(lambda: transport.put(url, data=first,
+                                              headers=headers))
+            return
+
+        upload_id = self._initiate(url, headers)
+        try:
+            etags = self._upload_parts(
+                url, upload_id, itertools.chain((first, second), parts))
+            self._complete(url, upload_id, etags)
+        except Exception:
+            self._abort(url, upload_id)
+            raise
+
+    def _initiate(self, url, headers):
+        response = transport.post(_with_query(url, 'uploads'),
+                                  headers=headers)
+        upload_id = _find_text(ElementTree.fromstring(response.content),
+                               'UploadId')
+        if not upload_id:
+            raise DeploymentError(
+                'Multipart upload to {} was not initiated.'.format(url))
+        return upload_id
+
+    def _upload_parts(self, url, upload_id, parts):
+        # Parts are read while earlier ones are uploaded, at most
+        # `concurrency` of them are pending at a time.
+        etags = []
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            try:
+                for (number, part) in enumerate(parts, 1):
+                    if len(pending) >= self.concurrency:
+                        etags.append(pending.popleft().result())
+                    pending.append(executor.submit(
+                        self._upload_part, url, upload_id, number, part))
+                while pending:
+                    etags.append(pending.popleft().result())
+            finally:
+                for future in pending:
+                    future.cancel()
+        return etags
+
+    def _upload_part(self, url, upload_id, number, part):
+        digest = hashlib.md5(part).digest()
+        headers = {'Content-MD5': base64.b64encode(digest).decode('ascii')}
+        part_url = _with_query(url, 'partNumber={}&uploadId={}'.format(
+            number, upload_id))
+
+        def upload():
+            response = transport.put(part_url, data=part, headers=headers)
+            etag = response.headers.get('ETag', '')
+            if etag.strip('"') != digest.hex():
+                raise DeploymentError(
+                    'Checksum mismatch of part {} uploaded to {}.'.format(
+                        number, url))
+            return etag
+
+        return self._retry(upload)
+
+    def _retry(self, upload):
+        for attempt in range(self.retries + 1):
+            try:
+                return upload()
+            except (requests.RequestException, DeploymentError):
+                if attempt == self.retries:
+                    raise
+                retried_parts.inc()
+
+    def _complete(self, url, upload_id, etags):
+        body = ''.join(
+            '<Part><PartNumber>{}</PartNumber><ETag>{}</ETag></Part>'.format(
+                number, escape(etag))
+            for (number, etag) in enumerate(etags, 1))
+        body = ('<CompleteMultipartUpload xmlns="{}">{}'
+                '</CompleteMultipartUpload>').format(S3_NAMESPACE, body)
+        response = transport.post(
+            _with_query(url, 'uploadId={}'.format(upload_id)),
+            data=body.encode('utf-8'),
+            headers={'Content-Type': 'application/xml'})
+        # Completing may fail after the response has started, which is told
+        # by an error document instead of the status.
+        root = ElementTree.fromstring(response.content)
+        if _local_name(root.tag) == 'Error':
+            raise DeploymentError(
+                'Multipart upload to {} failed: {}'.format(
+                    url, _find_text(root, 'Message')))
+
+    def _abort(self, url, upload_id):
+        try:
+            transport.delete(_with_query(url,
+                                         'uploadId={}'.format(upload_id)))
+        except requests.RequestException:
+            pass
+
+
+BACKENDS = {
+    'put': Deployer,
+    'multipart': MultipartDeployer,
+}
+
+deployer = Deployer()
+
+
+def configure(backend='put', **kwargs):
+    """Replaces the shared deployer by one of the given backend created with
+    the given arguments, see :data:`BACKENDS`.
+    """
+    global deployer
+    deployer = BACKENDS[backend](**kwargs)
+
+
+def _iter_parts(chunks, part_size):
+    part = bytearray()
+    for chunk in chunks:
+        part += chunk
+        while len(part) >= part_size:
+            yield bytes(part[:part_size])
+            del part[:part_size]
+    if part:
+        yield bytes(part)
+
+
+def _with_query(url, query):
+    (scheme, netloc, path, url_query, fragment) = urlsplit(url)
+    query = url_query + '&' + query if url_query else query
+    return urlunsplit((scheme, netloc, path, query, fragment))
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _find_text(root, name):
+    for element in root.iter():
+        if _local_name(element.tag) == name:
+            return element.text
+    return None
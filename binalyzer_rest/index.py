@@ -0,0 +1,55 @@
+"""
+    binalyzer_rest.index
+    ~~~~~~~~~~~~~~~~~~~~
+
+    This module implements the index used to look up the templates a
+    binding refers to.
+"""
+from anytree import PreOrderIter
+
+from .layout import TemplateLayout
+
+
+class TemplateIndex(object):
+    """Looks up the nodes of a template by their names and paths using the
+    template's :class:`~binalyzer_rest.layout.TemplateLayout`, which maps
+    them to positions in pre-order.
+
+    The layout is built once when a template is parsed. Clones have the same
+    structure, so the positions are valid for each clone of the template.
+    The nodes of a clone are enumerated on first lookup.
+
+    Names may be used by several nodes, in which case the first node in
+    pre-order is found, like :func:`anytree.search.find_by_attr` does. Paths
+    are the names of a node and its ancestors joined by slashes, starting
+    with the name of the indexed template, e.g. `a/b/c`.
+    """
+
+    def __init__(self, template, layout=None):
+        self.template = template
+        if layout is None:
+            layout = TemplateLayout.from_template(template, resolve=False)
+        self.layout = layout
+        self._nodes = None
+
+    def find(self, name):
+        """Returns the node with the given name or path, or `None` if there
+        is none.
+        """
+        position = self.layout.find(name)
+        if position is None:
+            return None
+        if self._nodes is None:
+            self._nodes = list(PreOrderIter(self.template))
+        return self._nodes[position]
+
+
+def find(root_template, name):
+    """Returns the template with the given name or path below the given
+    template, or `None` if there is none. Templates created by the template
+    cache are looked up using their index, others are indexed first.
+    """
+    template_index = getattr(root_template, '_template_index', None)
+    if template_index is None or template_index.template is not root_template:
+        template_index = TemplateIndex(root_template)
+    return template_index.find(name)
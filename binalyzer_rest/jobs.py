@@ -0,0 +1,175 @@
+"""
+    binalyzer_rest.jobs
+    ~~~~~~~~~~~~~~~~~~~
+
+    This module implements a job queue that runs transformations in background
+    worker threads.
+"""
+import time
+import uuid
+import queue
+import threading
+
+from . import metrics
+from .cache import LRUCache
+
+
+class QueueFullError(Exception):
+    """Raised if a job is submitted while the job queue is full.
+    """
+
+
+class Job(object):
+    """A unit of work processed by a :class:`JobQueue`.
+
+    :param fn: function called with `params` by a worker, its return value is
+               retained as the job's result
+    :param params: parameters passed to `fn`
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    def __init__(self, fn, params):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.params = params
+        self.status = self.QUEUED
+        self.error = None
+        self.timings = metrics.Timings()
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def done(self):
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+    def run(self, retain):
+        """Runs the job and passes its result, unless it is `None`, to
+        `retain` along with the job's id before the job succeeds.
+        """
+        self.started_at = time.time()
+        self.status = self.RUNNING
+        try:
+            with metrics.collect_timings() as self.timings:
+                result = self.fn(self.params)
+            if result is not None:
+                retain(self.id, result)
+            self.status = self.SUCCEEDED
+        except Exception as e:
+            self.error = str(e)
+            self.status = self.FAILED
+        finally:
+            self.finished_at = time.time()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'queue_time': _elapsed(self.submitted_at, self.started_at),
+            'run_time': _elapsed(self.started_at, self.finished_at),
+            'stages': self.timings.to_dict(),
+        }
+
+
+class ResultStore(LRUCache):
+    """Retains the results of finished jobs up to a total of `maxsize`
+    bytes, the least recently requested results are dropped first.
+    """
+
+    def sizeof(self, value):
+        return len(value)
+
+
+class JobQueue(object):
+    """Runs submitted jobs using a pool of worker threads.
+
+    Results of finished jobs are moved to a :class:`ResultStore`, so the
+    memory held by results is bounded by their size rather than by the
+    number of jobs. Jobs whose result exceeds `max_result_size` fail.
+
+    :param workers: number of worker threads
+    :param max_queue_size: maximum number of jobs waiting to be processed
+    :param max_jobs: maximum number of jobs retained for status requests, the
+                     least recently requested jobs are dropped first
+    :param max_result_size: maximum size in bytes of the results retained
+                            for result requests
+    """
+
+    def __init__(self, workers=2, max_queue_size=64, max_jobs=1024,
+                 max_result_size=256 * 1024 * 1024):
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._jobs = LRUCache(maxsize=max_jobs)
+        self._results = ResultStore(maxsize=max_result_size)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def submit(self, fn, params):
+        self._start()
+        job = Job(fn, params)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise QueueFullError('Job queue is full.')
+        self._jobs.put(job.id, job)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def result(self, job_id):
+        """Returns the result of a finished job, or `None` if it has none or
+        it has been dropped.
+        """
+        return self._results.get(job_id)
+
+    def has_result(self, job_id):
+        return job_id in self._results
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.run(self._retain)
+            self._queue.task_done()
+
+    def _retain(self, job_id, result):
+        if len(result) > self._results.maxsize:
+            raise ValueError('Result of {} bytes exceeds the maximum size of '
+                             'retained results.'.format(len(result)))
+        self._results.put(job_id, result)
+
+
+def _elapsed(start, end):
+    if start is None or end is None:
+        return None
+    return end - start
+
+
+job_queue = JobQueue()
+
+
+def configure(**kwargs):
+    """Replaces the shared job queue by one created with the given arguments,
+    see :class:`JobQueue`.
+    """
+    global job_queue
+    job_queue = JobQueue(**kwargs)
@@ -0,0 +1,291 @@
+"""
+    binalyzer_rest.layout
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    This module implements template layouts, a compact representation of the
+    structure of a template that stores its nodes as columns of arrays
+    instead of an object per node.
+
+    The layout of a template is static, if neither the offsets nor the sizes
+    of its nodes depend on the data it is bound to. Layouts of such templates
+    store the offset and size of each node as well, so fields are looked up
+    and transformed without creating the template's nodes.
+"""
+from array import array
+
+from anytree import PreOrderIter
+from binalyzer_core import (
+    ValueProperty,
+    AutoSizeValueProperty,
+    OffsetValueProperty,
+    RelativeOffsetValueProperty,
+)
+
+SEPARATOR = '/'
+
+NONE = -1
+
+STATIC_OFFSET_PROPERTIES = (
+    ValueProperty,
+    OffsetValueProperty,
+    RelativeOffsetValueProperty,
+)
+STATIC_SIZE_PROPERTIES = (
+    ValueProperty,
+    AutoSizeValueProperty,
+)
+
+
+class TemplateLayout(object):
+    """The nodes of a template in pre-order, where node `i` is described by
+    the `i`-th item of each column. The root is at position `0` and the
+    descendants of each node follow it.
+
+    :param names: the distinct names of the nodes
+    :param name_ids: the position of each node's name in `names`, or `-1` for
+                     nodes without name
+    :param parents: the position of each node's parent, `-1` for the root
+    :param ends: the position following each node's last descendant
+    :param offsets: the offset of each node relative to the root, or `None`
+                    if the layout is not static
+    :param sizes: the size of each node, or `None` if the layout is not
+                  static
+    """
+
+    def __init__(self, names, name_ids, parents, ends, offsets=None,
+                 sizes=None):
+        self.names = names
+        self.name_ids = name_ids
+        self.parents = parents
+        self.ends = ends
+        self.offsets = offsets
+        self.sizes = sizes
+        self._ids = {name: name_id for (name_id, name) in enumerate(names)}
+        # Names and paths are found in constant time. Each name is mapped to
+        # its first node in pre-order, each path to the first node by hash.
+        self._firsts = array('i', [NONE]) * len(names)
+        for (position, name_id) in enumerate(name_ids):
+            if name_id != NONE and self._firsts[name_id] == NONE:
+                self._firsts[name_id] = position
+        self._path_hashes = None
+
+    @classmethod
+    def from_template(cls, template, resolve=True):
+        """Returns the layout of a template. If `resolve` is true and the
+        layout of the template is static, the offsets and sizes of its nodes
+        are stored as well.
+        """
+        static = resolve and is_static(template)
+        origin = template.absolute_address if static else 0
+
+        names = []
+        ids = {}
+        positions = {}
+        name_ids = array('i')
+        parents = array('i')
+        nodes = list(PreOrderIter(template))
+        for (position, node) in enumerate(nodes):
+            positions[id(node)] = position
+            parents.append(NONE if node is template
+                           else positions[id(node.parent)])
+            if node.name is None:
+                name_ids.append(NONE)
+            else:
+                name = str(node.name)
+                if name not in ids:
+                    ids[name] = len(names)
+                    names.append(name)
+                name_ids.append(ids[name])
+
+        offsets = None
+        sizes = None
+        if static:
+            # Offsets are resolved in pre-order and sizes in reverse, so each
+            # of them only depends on values that are already resolved.
+            # Otherwise, they are resolved recursively along all siblings.
+            offsets = array('q', [node.absolute_address - origin
+                                  for node in nodes])
+            sizes = array('q', [node.size for node in reversed(nodes)])
+            sizes.reverse()
+
+        # Iterating backwards, the last child of each node is visited before
+        # any other descendant, and its end is the end of the node.
+        ends = array('i', [0]) * len(parents)
+        for position in range(len(parents) - 1, -1, -1):
+            if not ends[position]:
+                ends[position] = position + 1
+            parent = parents[position]
+            if parent != NONE and not ends[parent]:
+                ends[parent] = ends[position]
+        return cls(names, name_ids, parents, ends, offsets, sizes)
+
+    def __len__(self):
+        return len(self.parents)
+
+    @property
+    def static(self):
+        """Whether the offsets and sizes of the nodes are stored.
+        """
+        return self.offsets is not None
+
+    @property
+    def name(self):
+        """The name of the root.
+        """
+        return self.name_of(0)
+
+    @property
+    def nbytes(self):
+        """The size of the columns in bytes, without the names.
+        """
+        columns = [self.name_ids, self.parents, self.ends]
+        if self.static:
+            columns.extend((self.offsets, self.sizes))
+        return sum(column.itemsize * len(column) for column in columns)
+
+    def name_of(self, position):
+        """Returns the name of the node at the given position.
+        """
+        name_id = self.name_ids[position]
+        return None if name_id == NONE else self.names[name_id]
+
+    def children(self, position):
+        """Yields the positions of the children of a node.
+        """
+        child = position + 1
+        while child < self.ends[position]:
+            yield child
+            child = self.ends[child]
+
+    def leaves(self):
+        """Yields the positions of the nodes without children.
+        """
+        for position in range(len(self)):
+            if self.ends[position] == position + 1:
+                yield position
+
+    def split(self, parts):
+        """Returns the positions of the root's children in at most `parts`
+        groups of adjacent children with about the same number of nodes.
+        Returns no groups if the layout is not static or the ranges of the
+        children overlap.
+        """
+        if not self.static or len(self) < 2:
+            return []
+        children = list(self.children(0))
+        for (child, following) in zip(children, children[1:]):
+            end = self.offsets[child] + self.sizes[child]
+            if end > self.offsets[following]:
+                return []
+
+        groups = [[]]
+        nodes = 0
+        target = (len(self) - 1) / max(parts, 1)
+        for child in children:
+            if nodes >= target * len(groups):
+                groups.append([])
+            groups[-1].append(child)
+            nodes += self.ends[child] - child
+        return groups
+
+    def paths(self):
+        """Returns the path of each node, which are the names of the node and
+        its ancestors joined by slashes. Nodes with an unnamed ancestor, or
+        without name, have no path.
+        """
+        paths = []
+        for position in range(len(self)):
+            name = self.name_of(position)
+            parent = self.parents[position]
+            if name is None or parent != NONE and paths[parent] is None:
+                paths.append(None)
+            elif parent == NONE:
+                paths.append(name)
+            else:
+                paths.append(paths[parent] + SEPARATOR + name)
+        return paths
+
+    def find(self, name):
+        """Returns the position of the node with the given name or path, see
+        :class:`~binalyzer_rest.index.TemplateIndex`, or `None` if there is
+        none.
+        """
+        if name is None:
+            return None
+        name = str(name)
+        if SEPARATOR in name:
+            return self._find_path(name.strip(SEPARATOR).split(SEPARATOR))
+        name_id = self._ids.get(name)
+        if name_id is None:
+            return None
+        return self._firsts[name_id]
+
+    def _find_path(self, names):
+        if self._path_hashes is None:
+            self._path_hashes = self._hash_paths()
+        position = self._path_hashes.get(hash(SEPARATOR.join(names)))
+        if position is None:
+            return None
+        if self._has_path(position, names):
+            return position
+        # Another path with the same hash was found.
+        return self._search_path(names)
+
+    def _hash_paths(self):
+        # Unnamed nodes are empty path components.
+        path_hashes = {}
+        paths = []
+        for position in range(len(self)):
+            name = self.name_of(position) or ''
+            parent = self.parents[position]
+            path = name if parent == NONE else (paths[parent] + SEPARATOR +
+                                                name)
+            paths.append(path)
+            if self.name_ids[position] != NONE:
+                path_hashes.setdefault(hash(path), position)
+        return path_hashes
+
+    def _has_path(self, position, names):
+        for name in reversed(names):
+            if position == NONE or (self.name_of(position) or '') != name:
+                return False
+            position = self.parents[position]
+        return position == NONE
+
+    def _search_path(self, names):
+        # Unnamed nodes match empty path components. Candidates are kept in
+        # pre-order, so the first one left is the first node with the path.
+        name_ids = [NONE if name == '' else self._ids.get(name)
+                    for name in names]
+        if None in name_ids or name_ids[-1] == NONE:
+            return None
+        candidates = [0] if self.name_ids[0] == name_ids[0] else []
+        for name_id in name_ids[1:]:
+            candidates = [child for parent in candidates
+                          for child in self.children(parent)
+                          if self.name_ids[child] == name_id]
+        return candidates[0] if candidates else None
+
+
+def is_static(template):
+    """Returns whether the layout of a template and its descendants does not
+    depend on data.
+    """
+    nodes = [template]
+    while nodes:
+        node = nodes.pop()
+        if node.signature is not None:
+            return False
+        if type(node.count_property) is not ValueProperty or node.count != 1:
+            return False
+        if type(node.offset_property) not in STATIC_OFFSET_PROPERTIES:
+            return False
+        if type(node.size_property) not in STATIC_SIZE_PROPERTIES:
+            return False
+        if any(type(prop) is not ValueProperty
+               for prop in (node.boundary_property,
+                            node.padding_before_property,
+                            node.padding_after_property)):
+            return False
+        nodes.extend(node.children)
+    return True
@@ -0,0 +1,213 @@
+"""
+    binalyzer_rest.metrics
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    This module implements the timing of transformation stages and the
+    metrics exposed in the Prometheus text format.
+"""
+import time
+import threading
+import contextlib
+import contextvars
+
+from collections import OrderedDict
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_registry = []
+_timings = contextvars.ContextVar('timings', default=None)
+
+
+class Metric(object):
+    """Base class of all metrics, which register themselves on creation.
+    """
+
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def collect(self):
+        yield '# HELP {} {}'.format(self.name, self.documentation)
+        yield '# TYPE {} {}'.format(self.name, self.metric_type)
+        for line in self.samples():
+            yield line
+
+    def samples(self):
+        return []
+
+    def _labels(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super(Counter, self).__init__(name, documentation, labelnames)
+        self._values = OrderedDict()
+
+    def inc(self, amount=1, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for (key, value) in values:
+            yield _sample(self.name, self.labelnames, key, value)
+
+
+class Histogram(Metric):
+
+    metric_type = 'histogram'
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+               5.0, 10.0, 30.0, 60.0, float('inf'))
+
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._values = OrderedDict()
+
+    def observe(self, value, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            (counts, _, _) = entry = self._values[key]
+            for (index, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total, count)
+                      for (key, (counts, total, count)) in self._values.items()]
+        labelnames = self.labelnames + ('le',)
+        for (key, counts, total, count) in values:
+            for (bound, bucket_count) in zip(self.buckets, counts):
+                yield _sample(self.name + '_bucket', labelnames,
+                              key + (_format_value(bound),), bucket_count)
+            yield _sample(self.name + '_sum', self.labelnames, key, total)
+            yield _sample(self.name + '_count', self.labelnames, key, count)
+
+
+class Callback(Metric):
+    """A metric whose value is returned by a function when it is collected.
+    """
+
+    def __init__(self, name, documentation, metric_type, fn):
+        super(Callback, self).__init__(name, documentation)
+        self.metric_type = metric_type
+        self.fn = fn
+
+    def samples(self):
+        yield _sample(self.name, (), (), self.fn())
+
+
+class Timings(object):
+    """Collects the time spent in each stage of a single request.
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, stage, elapsed):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + elapsed
+
+    def to_dict(self):
+        with self._lock:
+            return dict(self.stages)
+
+    def server_timing(self):
+        """Returns the timings as value of a `Server-Timing` header.
+        """
+        return ', '.join('{};dur={:.3f}'.format(stage, elapsed * 1000)
+                         for (stage, elapsed) in self.to_dict().items())
+
+
+stage_duration = Histogram(
+    'binalyzer_stage_duration_seconds',
+    'Time spent in the stages of a transformation.',
+    ('stage',)
+)
+
+transferred_bytes = Counter(
+    'binalyzer_transferred_bytes_total',
+    'Bytes fetched, deployed and returned by transformations.',
+    ('direction',)
+)
+
+
+@contextlib.contextmanager
+def collect_timings():
+    """Collects the timings of all stages that run in the current context,
+    including fetches started from it.
+    """
+    timings = Timings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """Measures the time spent in a stage of a transformation.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_duration.observe(elapsed, stage=stage)
+        timings = _timings.get()
+        if timings is not None:
+            timings.add(stage, elapsed)
+
+
+def count_bytes(chunks, direction):
+    """Passes chunks of data through while counting their bytes.
+    """
+    for chunk in chunks:
+        transferred_bytes.inc(len(chunk), direction=direction)
+        yield chunk
+
+
+def render():
+    """Returns all metrics in the Prometheus text format.
+    """
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+def _sample(name, labelnames, labelvalues, value):
+    labels = ','.join('{}="{}"'.format(name, _escape(value))
+                      for (name, value) in zip(labelnames, labelvalues))
+    if labels:
+        name = '{}{{{}}}'.format(name, labels)
+    return '{} {}'.format(name, _format_value(value))
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
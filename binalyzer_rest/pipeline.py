@@ -0,0 +1,743 @@
+"""
+    binalyzer_rest.pipeline
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module implements the transformation pipeline that fetches templates
+    and data, transforms them and deploys the result.
+"""
+import base64
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+from binalyzer import Binalyzer
+
+from . import cache
+from . import index
+from . import utils
+from . import metrics
+from . import workers
+from . import registry
+from . import compiler
+from . import admission
+from . import deployment
+from . import compression
+from . import transport
+
+
+class TemplateOutput(object):
+    """The data a destination template is bound to.
+    """
+
+    def __init__(self, template):
+        self.template = template
+
+    @property
+    def size(self):
+        return self.template.size
+
+    @property
+    def value(self):
+        # Data bound to templates below the root is not part of the root's
+        # value, it is read from the template's leaves instead.
+        return b''.join(self.iter_chunks())
+
+    def iter_chunks(self):
+        return utils.iter_chunks(self.template)
+
+    def release(self):
+        pass
+
+
+class BytesOutput(object):
+    """Data that is available as bytes, e.g. a cached result.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    @property
+    def value(self):
+        return self.data
+
+    def iter_chunks(self, chunk_size=utils.CHUNK_SIZE):
+        data = memoryview(self.data)
+        for offset in range(0, len(data), chunk_size):
+            yield bytes(data[offset:offset + chunk_size])
+
+    def release(self):
+        pass
+
+
+class WorkerOutput(object):
+    """The data returned by a worker process, which is either bytes or
+    :class:`~binalyzer_rest.workers.SharedData` that is unlinked once it has
+    been consumed or released.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    @property
+    def size(self):
+        if isinstance(self.data, workers.SharedData):
+            return self.data.size
+        return len(self.data)
+
+    @property
+    def value(self):
+        if not isinstance(self.data, workers.SharedData):
+            return self.data
+        try:
+            return bytes(self.data.buffer)
+        finally:
+            self.release()
+
+    def iter_chunks(self, chunk_size=utils.CHUNK_SIZE):
+        if not isinstance(self.data, workers.SharedData):
+            yield self.data
+            return
+        try:
+            for offset in range(0, self.size, chunk_size):
+                yield bytes(self.data.buffer[offset:offset + chunk_size])
+        finally:
+            self.release()
+
+    def release(self):
+        data, self.data = self.data, b''
+        workers.unlink(data)
+
+
+def admit(params):
+    """Waits until the transformation described by the parameters of the
+    `/transform` endpoint is admitted and returns its ticket, see
+    :class:`~binalyzer_rest.admission.AdmissionController`.
+
+    The size of a transformation is the size of its bound data, as told by
+    the `Content-Length` of the data URLs. It is only requested if the size
+    of admitted transformations is limited. The sizes are requested
+    concurrently, see :func:`~binalyzer_rest.transport.shared_head_responses`
+    to reuse their responses when the data is opened.
+    """
+    controller = admission.controller
+    size = 0
+    if controller.measures_size:
+        urls = (utils.binding_urls(params.get('source_binding', [])) +
+                utils.binding_urls(params.get('destination_binding', [])))
+        for destination in params.get('destinations') or []:
+            urls += utils.binding_urls(
+                destination.get('destination_binding', []))
+        with transport.fetcher() as fetcher:
+            fetcher.presize(urls)
+            size = sum(fetcher.content_length(url) or 0 for url in urls)
+    return controller.admit(size)
+
+
+def transform(params):
+    """Runs a transformation described by the parameters of the `/transform`
+    endpoint and returns its output.
+
+    Results are looked up in the result cache by the digests of their
+    templates and data, so repeated transformations only fetch, or
+    revalidate, their inputs.
+    """
+    source_binding = params.get('source_binding', [])
+    destination_binding = params.get('destination_binding', [])
+
+    with transport.fetcher() as fetcher:
+        # Fetch templates and open data up front, so the transformation only
+        # waits for its own inputs. Data is fetched once it is read.
+        fetcher.prefetch(_template_urls(params, 'source_template',
+                                        'destination_template'))
+        fetcher.preopen(utils.binding_urls(source_binding) +
+                        utils.binding_urls(destination_binding))
+
+        (source_template_url, source_template_text) = _template(
+            params, 'source_template', fetcher)
+        (destination_template_url, destination_template_text) = _template(
+            params, 'destination_template', fetcher)
+
+        key = None
+        if cache.result_cache.enabled:
+            key = _result_key(source_template_text, source_binding,
+                              destination_template_text, destination_binding,
+                              fetcher)
+            result = None if key is None else cache.result_cache.get(key)
+            if result is not None:
+                return BytesOutput(result)
+
+        # Template pairs with a static layout are transformed by copying
+        # ranges, which doesn't need a worker.
+        transform_plan = _transform_plan(source_template_url,
+                                         source_template_text,
+                                         source_binding,
+                                         destination_template_url,
+                                         destination_template_text,
+                                         destination_binding)
+        if transform_plan is not None:
+            with metrics.timed('bind'):
+                data = utils.resource_data(
+                    fetcher.open_data(source_binding[0].get('data_url')))
+            with metrics.timed('transform'):
+                output = BytesOutput(transform_plan.apply(data))
+            return _cache_output(key, output)
+
+        if workers.worker_pool.split:
+            output = _transform_subtrees(
+                source_template_url,
+                source_template_text,
+                source_binding,
+                destination_template_url,
+                destination_template_text,
+                destination_binding,
+                fetcher
+            )
+            if output is not None:
+                return _cache_output(key, output)
+
+        if workers.worker_pool.offload:
+            output = _transform_in_worker(
+                source_template_url,
+                source_template_text,
+                source_binding,
+                destination_template_url,
+                destination_template_text,
+                destination_binding,
+                fetcher
+            )
+            return _cache_output(key, output)
+
+        source_template = cache.template_cache.get_template(
+            source_template_url,
+            source_template_text
+        )
+
+        destination_template = cache.template_cache.get_template(
+            destination_template_url,
+            destination_template_text
+        )
+
+        utils.bind_data_to_template(
+            source_template,
+            source_binding,
+            fetcher
+        )
+
+        with metrics.timed('transform'):
+            Binalyzer().transform(
+                source_template,
+                destination_template,
+            )
+
+        utils.bind_data_to_template(
+            destination_template,
+            destination_binding,
+            fetcher
+        )
+
+    return _cache_output(key, TemplateOutput(destination_template))
+
+
+def transform_batch(params):
+    """Applies a source and destination template pair to each item of a
+    batch and returns an iterator over the status of each item, which
+    yields each status as soon as its item is done.
+
+    The templates are fetched once. Items are transformed by worker
+    processes, while their data is fetched and deployed by threads of this
+    process.
+    """
+    with transport.fetcher() as fetcher:
+        fetcher.prefetch(_template_urls(params, 'source_template',
+                                        'destination_template'))
+        (source_template_url, source_template_text) = _template(
+            params, 'source_template', fetcher)
+        (destination_template_url, destination_template_text) = _template(
+            params, 'destination_template', fetcher)
+
+    return _transform_items(params.get('items', []),
+                            source_template_url,
+                            source_template_text,
+                            destination_template_url,
+                            destination_template_text)
+
+
+def _transform_items(items, source_template_url, source_template_text,
+                     destination_template_url, destination_template_text):
+    def transform_item(item):
+        source_binding = item.get('source_binding', [])
+        destination_binding = item.get('destination_binding', [])
+
+        with transport.fetcher() as fetcher:
+            fetcher.preopen(utils.binding_urls(source_binding) +
+                            utils.binding_urls(destination_binding))
+            output = _transform_in_worker(
+                source_template_url,
+                source_template_text,
+                source_binding,
+                destination_template_url,
+                destination_template_text,
+                destination_binding,
+                fetcher
+            )
+        return _deliver(output, item)
+
+    return _run_items(transform_item, items)
+
+
+def transform_destinations(params):
+    """Transforms the source data described by the parameters of the
+    `/transform` endpoint into each item of its `destinations` and returns
+    an iterator over the status of each destination, which yields each
+    status as soon as its destination is done. Each destination has its own
+    template, bindings and deployment URL.
+
+    The source template and its data are fetched once. Threads of this
+    process parse and bind the source template once and take turns reading
+    its data. If transformations are offloaded, they run in parallel in the
+    worker processes, which share the source data instead.
+    """
+    source_binding = params.get('source_binding', [])
+    destinations = params['destinations']
+
+    with transport.fetcher() as fetcher:
+        template_urls = _template_urls(params, 'source_template')
+        for destination in destinations:
+            template_urls += _template_urls(destination,
+                                            'destination_template')
+        fetcher.prefetch(template_urls)
+        fetcher.preopen(utils.binding_urls(source_binding))
+
+        (source_template_url, source_template_text) = _template(
+            params, 'source_template', fetcher)
+        destination_templates = [
+            _template(destination, 'destination_template', fetcher)
+            for destination in destinations
+        ]
+        source = _Source(source_template_url, source_template_text,
+                         source_binding, fetcher)
+
+    def transform_destination(item):
+        (destination, (destination_template_url,
+                       destination_template_text)) = item
+        destination_binding = destination.get('destination_binding', [])
+
+        with transport.fetcher() as fetcher:
+            fetcher.preopen(utils.binding_urls(destination_binding))
+            output = source.transform(destination_template_url,
+                                      destination_template_text,
+                                      destination_binding,
+                                      fetcher)
+        return _deliver(output, destination)
+
+    def statuses():
+        try:
+            for status in _run_items(transform_destination,
+                                     list(zip(destinations,
+                                              destination_templates))):
+                yield status
+        finally:
+            source.release()
+
+    return statuses()
+
+
+class _Source(object):
+    # The source of several transformations, see transform_destinations.
+
+    def __init__(self, template_url, template_text, binding, fetcher):
+        self.template_url = template_url
+        self.template_text = template_text
+        self.binding = binding
+        self.data = [(item.get('template_name'),
+                      fetcher.open_data(item.get('data_url')))
+                     for item in binding]
+        self.shared_data = None
+        self._template = None
+        self._lock = threading.Lock()
+        if workers.worker_pool.offload:
+            threshold = workers.worker_pool.shared_memory_threshold
+            self.shared_data = []
+            try:
+                for (template_name, resource) in self.data:
+                    self.shared_data.append((template_name,
+                                             workers.share_resource(
+                                                 resource, threshold,
+                                                 lazy=False)))
+            except Exception:
+                self.release()
+                raise
+
+    def transform(self, destination_template_url, destination_template_text,
+                  destination_binding, fetcher):
+        if self.shared_data is not None:
+            return _transform_shared(self.template_url,
+                                     self.template_text,
+                                     self.shared_data,
+                                     destination_template_url,
+                                     destination_template_text,
+                                     destination_binding,
+                                     fetcher)
+
+        transform_plan = _transform_plan(self.template_url,
+                                         self.template_text,
+                                         self.binding,
+                                         destination_template_url,
+                                         destination_template_text,
+                                         destination_binding)
+        # The source data is a single stream, which is read by one
+        # transformation at a time.
+        with self._lock:
+            if transform_plan is not None:
+                data = utils.resource_data(self.data[0][1])
+                with metrics.timed('transform'):
+                    return BytesOutput(transform_plan.apply(data))
+
+            destination_template = cache.template_cache.get_template(
+                destination_template_url,
+                destination_template_text
+            )
+            with metrics.timed('transform'):
+                Binalyzer().transform(
+                    self._bound_template(),
+                    destination_template,
+                )
+
+        utils.bind_data_to_template(
+            destination_template,
+            destination_binding,
+            fetcher
+        )
+        return TemplateOutput(destination_template)
+
+    def release(self):
+        for (_, data) in self.shared_data or []:
+            workers.unlink(data)
+        self.shared_data = None
+
+    def _bound_template(self):
+        if self._template is None:
+            template = cache.template_cache.get_template(self.template_url,
+                                                         self.template_text)
+            with metrics.timed('bind'):
+                for (template_name, resource) in self.data:
+                    utils.bind_data(template, template_name,
+                                    utils.resource_data(resource))
+            self._template = template
+        return self._template
+
+
+def _deliver(output, item):
+    # Deploys the output of an item or returns it as base64 encoded data.
+    deployment_url = item.get('deployment_url')
+    if deployment_url:
+        deploy(deployment_url, output, item.get('deployment_encoding'))
+        return {'deployment_url': deployment_url}
+    return {'data': base64.b64encode(output.value).decode('ascii')}
+
+
+def _run_items(fn, items):
+    # Twice as many items as worker processes are in flight, so fetching and
+    # deploying overlaps with transforming.
+    max_workers = 2 * workers.worker_pool.processes
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fn, item): index
+                   for (index, item) in enumerate(items)}
+        for future in as_completed(futures):
+            status = {'index': futures[future]}
+            try:
+                status.update(future.result())
+                status['status'] = 'succeeded'
+            except Exception as e:
+                status['status'] = 'failed'
+                status['error'] = str(e)
+            yield status
+
+
+class UnknownFieldError(LookupError):
+    """Raised if a field to extract does not exist in the template.
+    """
+
+
+class Field(object):
+    """A field extracted from data.
+
+    :param name: the name or path the field is looked up by
+    :param offset: the offset of the field within the data
+    :param size: the size of the field
+    :param data_size: the size of the data
+    :param chunks: a callable returning an iterator over the field's data
+    """
+
+    def __init__(self, name, offset, size, data_size, chunks):
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.data_size = data_size
+        self._chunks = chunks
+
+    def iter_chunks(self):
+        return self._chunks()
+
+
+def extract(params):
+    """Looks up the fields described by the parameters of the `/extract`
+    endpoint and returns a list of :class:`Field` objects.
+
+    The data is read lazily, so only the data of the returned fields is
+    fetched, once it is read. Fields of templates with a static layout are
+    looked up in the template's layout without creating the template.
+    """
+    data_url = params['data_url']
+
+    with transport.fetcher() as fetcher:
+        fetcher.prefetch(_template_urls(params, 'template'))
+        fetcher.preopen([data_url])
+
+        (template_url, template_text) = _template(params, 'template', fetcher)
+        template_layout = cache.template_cache.get_layout(template_url,
+                                                          template_text)
+        data = utils.resource_data(fetcher.open_data(data_url))
+        if template_layout.static:
+            return [_layout_field(template_layout, field, data)
+                    for field in params.get('fields', [])]
+
+        template = cache.template_cache.get_template(template_url,
+                                                     template_text)
+        with metrics.timed('bind'):
+            utils.bind_data(template, template.name, data)
+
+    fields = []
+    for field in params.get('fields', []):
+        field_template = index.find(template, field)
+        if field_template is None:
+            raise UnknownFieldError('Unknown field: {}'.format(field))
+        fields.append(Field(field, field_template.absolute_address,
+                            field_template.size, field_template.root.size,
+                            lambda template=field_template:
+                            utils.iter_chunks(template)))
+    return fields
+
+
+def _layout_field(template_layout, field, data):
+    position = template_layout.find(field)
+    if position is None:
+        raise UnknownFieldError('Unknown field: {}'.format(field))
+    offset = template_layout.offsets[position]
+    # Like the template it is bound to, the root takes the size of the data.
+    size = len(data) if position == 0 else template_layout.sizes[position]
+    return Field(field, offset, size, len(data),
+                 lambda: utils.iter_data(data, offset, offset + size))
+
+
+def compile_template(params):
+    """Returns the compiled form of the template described by the parameters
+    of the `/compile` endpoint.
+    """
+    with transport.fetcher() as fetcher:
+        fetcher.prefetch(_template_urls(params, 'template'))
+        return cache.template_cache.get_compiled(
+            *_template(params, 'template', fetcher))
+
+
+def deploy(deployment_url, output, encoding=None):
+    """Uploads the output of a transformation to the deployment URL using the
+    configured deployment backend, see :mod:`~binalyzer_rest.deployment`. If
+    an encoding is given, the output is compressed while it is uploaded, see
+    :mod:`~binalyzer_rest.compression`.
+    """
+    chunks = output.iter_chunks()
+    headers = {'Content-type': 'application/octet-stream'}
+    if encoding:
+        chunks = compression.compress(chunks, encoding)
+        headers['Content-Encoding'] = encoding
+    with metrics.timed('deploy'):
+        deployment.deployer.deploy(deployment_url,
+                                   metrics.count_bytes(chunks, 'deployed'),
+                                   headers=headers)
+
+
+def _transform_in_worker(source_template_url, source_template_text,
+                         source_binding, destination_template_url,
+                         destination_template_text, destination_binding,
+                         fetcher):
+    source_data = _share_bindings(source_binding, fetcher,
+                                  workers.worker_pool.shared_memory_threshold)
+    try:
+        return _transform_shared(source_template_url,
+                                 source_template_text,
+                                 source_data,
+                                 destination_template_url,
+                                 destination_template_text,
+                                 destination_binding,
+                                 fetcher)
+    finally:
+        for (_, data) in source_data:
+            workers.unlink(data)
+
+
+def _transform_shared(source_template_url, source_template_text,
+                      source_data, destination_template_url,
+                      destination_template_text, destination_binding,
+                      fetcher):
+    # Transforms source data that is already shared with the workers.
+    worker_pool = workers.worker_pool
+    destination_data = _share_bindings(destination_binding, fetcher,
+                                       worker_pool.shared_memory_threshold)
+    try:
+        with metrics.timed('worker'):
+            return WorkerOutput(worker_pool.transform(
+                source_template_url,
+                source_template_text,
+                source_data,
+                destination_template_url,
+                destination_template_text,
+                destination_data,
+            ).result())
+    finally:
+        for (_, data) in destination_data:
+            workers.unlink(data)
+
+
+def _transform_subtrees(source_template_url, source_template_text,
+                        source_binding, destination_template_url,
+                        destination_template_text, destination_binding,
+                        fetcher):
+    # The top-level subtrees of destination templates with a static layout
+    # map to disjoint ranges of the output, which are written by the workers
+    # in parallel. Leaves without size take the size of their data, so their
+    # ranges aren't known up front.
+    worker_pool = workers.worker_pool
+    if destination_binding:
+        return None
+    destination_layout = cache.template_cache.get_layout(
+        destination_template_url, destination_template_text)
+    groups = destination_layout.split(worker_pool.processes)
+    if len(groups) < 2 or any(destination_layout.sizes[leaf] <= 0
+                              for leaf in destination_layout.leaves()):
+        return None
+
+    source_data = _share_bindings(source_binding, fetcher,
+                                  worker_pool.shared_memory_threshold)
+    output = workers.SharedData.create(destination_layout.sizes[0])
+    futures = []
+    try:
+        with metrics.timed('worker'):
+            for positions in groups:
+                futures.append(worker_pool.transform_subtrees(
+                    source_template_url,
+                    source_template_text,
+                    source_data,
+                    destination_template_url,
+                    destination_template_text,
+                    positions,
+                    output,
+                ))
+            for future in futures:
+                future.result()
+    except Exception:
+        # Workers may still write to the output and read the shared data.
+        wait(futures)
+        workers.unlink(output)
+        raise
+    finally:
+        for (_, data) in source_data:
+            workers.unlink(data)
+    return WorkerOutput(output)
+
+
+def _transform_plan(source_template_url, source_template_text,
+                    source_binding, destination_template_url,
+                    destination_template_text, destination_binding):
+    # Plans apply to data bound to the source template as a whole, data bound
+    # to the destination template is left to the transformation.
+    if len(source_binding) != 1 or destination_binding:
+        return None
+    transform_plan = cache.plan_cache.get_plan(source_template_url,
+                                               source_template_text,
+                                               destination_template_url,
+                                               destination_template_text)
+    if transform_plan is None:
+        return None
+    source_layout = cache.template_cache.get_layout(source_template_url,
+                                                    source_template_text)
+    if source_layout.find(source_binding[0].get('template_name')) != 0:
+        return None
+    return transform_plan
+
+
+def _template_urls(params, *names):
+    return [params[name + '_url'] for name in names
+            if params.get(name) is None]
+
+
+def _template(params, name, fetcher):
+    # Templates are given either by their registered name or by their URL.
+    template_name = params.get(name)
+    if template_name is not None:
+        return registry.registry.get(template_name)
+    template_url = params[name + '_url']
+    return (template_url,
+            compiler.template_description(fetcher.get(template_url)))
+
+
+def _result_key(source_template_text, source_binding,
+                destination_template_text, destination_binding, fetcher):
+    # Results are only cached if all of their data is identified without
+    # reading it, or if it has been read as a whole anyway.
+    def binding_data(bindings):
+        return [(binding.get('template_name'),
+                 _data_identity(fetcher.open_data(binding.get('data_url'))))
+                for binding in bindings]
+
+    with metrics.timed('digest'):
+        source_data = binding_data(source_binding)
+        destination_data = binding_data(destination_binding)
+        if any(data is None for (_, data) in source_data + destination_data):
+            return None
+        return cache.result_key(source_template_text, source_data,
+                                destination_template_text, destination_data)
+
+
+def _data_identity(resource):
+    # Lazily fetched data is identified by its strong `ETag` and local files
+    # by their metadata instead of their content, so only the pages that are
+    # read are fetched. Lazily fetched data without `ETag` is not identified.
+    if isinstance(resource, transport.RemoteData):
+        if resource.etag:
+            return '{} {}'.format(resource.url, resource.etag)
+        return None
+    if (isinstance(resource, transport.LocalResource) and
+            resource.stat is not None):
+        stat = resource.stat
+        return '{} {} {} {} {}'.format(resource.url, stat.st_dev,
+                                       stat.st_ino, stat.st_size,
+                                       stat.st_mtime_ns)
+    return utils.resource_data(resource)
+
+
+def _cache_output(key, output):
+    result_cache = cache.result_cache
+    if key is None or not result_cache.cacheable(output.size):
+        return output
+    result = bytes(output.value)
+    result_cache.put(key, result)
+    return BytesOutput(result)
+
+
+def _share_bindings(bindings, fetcher, threshold):
+    shared_bindings = []
+    try:
+        for binding in bindings:
+            resource = fetcher.open_data(binding.get('data_url'))
+            shared_bindings.append((binding.get('template_name'),
+                                    workers.share_resource(resource, threshold)))
+    except Exception:
+        for (_, data) in shared_bindings:
+            workers.unlink(data)
+        raise
+    return shared_bindings
@@ -0,0 +1,130 @@
+"""
+    binalyzer_rest.plan
+    ~~~~~~~~~~~~~~~~~~~
+
+    This module implements transform plans, which replace the transformation
+    of templates by copies between byte ranges.
+
+    The layout of a template is static, if neither the offsets nor the sizes
+    of its nodes depend on the data it is bound to. Transforming data between
+    templates with a static layout always copies the same ranges, so these
+    ranges are computed once per template pair and applied to each data file
+    without walking the templates again.
+"""
+from .layout import TemplateLayout
+
+
+class TransformPlan(object):
+    """Copies the data of a source template's leaves to the destination
+    template's leaves with the same path, where data of destination leaves
+    without a source leaf is filled with zeros.
+
+    :param source_name: name of the source template the data is bound to
+    :param copies: a list of `(source_offset, destination_offset, size)`
+                   tuples, later copies overwrite earlier ones. Adjacent
+                   copies are coalesced, see :func:`coalesce`.
+    :param size: size of the destination template
+    """
+
+    def __init__(self, source_name, copies, size):
+        self.source_name = source_name
+        self.copies = coalesce(copies)
+        self.size = size
+
+    def apply(self, data):
+        """Returns the destination data for the given source data, which is
+        either bytes-like or a seekable stream. Source data that is not
+        available is filled with zeros.
+        """
+        output = bytearray(self.size)
+        with memoryview(output) as destination:
+            if hasattr(data, 'read'):
+                self._copy_stream(data, destination)
+            else:
+                with memoryview(data) as source:
+                    self._copy(source, destination)
+        return output
+
+    def _copy(self, source, destination):
+        # Slices of memory views copy the data once, directly into the
+        # output. Slices beyond the source data are truncated.
+        for (source_offset, destination_offset, size) in self.copies:
+            piece = source[source_offset:source_offset + size]
+            destination[destination_offset:
+                        destination_offset + len(piece)] = piece
+
+    def _copy_stream(self, source, destination):
+        try:
+            for (source_offset, destination_offset, size) in self.copies:
+                source.seek(source_offset)
+                piece = source.read(size)
+                destination[destination_offset:
+                            destination_offset + len(piece)] = piece
+        finally:
+            source.seek(0)
+
+
+def compile_plan(source_template, destination_template):
+    """Returns the :class:`TransformPlan` of a template pair, or `None` if the
+    layout of either template is not static. The templates are given by
+    their :class:`~binalyzer_rest.layout.TemplateLayout` or as templates,
+    which must not be bound to data.
+    """
+    source_layout = _layout(source_template)
+    destination_layout = _layout(destination_template)
+    if not (source_layout.static and destination_layout.static):
+        return None
+
+    source_paths = source_layout.paths()
+    source_leaves = {}
+    for position in source_layout.leaves():
+        path = source_paths[position]
+        if path is None:
+            return None
+        # Like the transformation, the last source leaf with the same path
+        # is copied.
+        source_leaves[path] = position
+
+    destination_paths = destination_layout.paths()
+    copies = []
+    for position in destination_layout.leaves():
+        path = destination_paths[position]
+        size = destination_layout.sizes[position]
+        if path is None or size <= 0:
+            # Unnamed leaves aren't matched, leaves without size take the
+            # size of their data.
+            return None
+        source_position = source_leaves.get(path)
+        if source_position is None:
+            continue
+        size = min(source_layout.sizes[source_position], size)
+        if size > 0:
+            copies.append((source_layout.offsets[source_position],
+                           destination_layout.offsets[position],
+                           size))
+    return TransformPlan(source_layout.name, copies,
+                         destination_layout.sizes[0])
+
+
+def coalesce(copies):
+    """Merges consecutive copies of adjacent ranges into a single copy,
+    e.g. the copies of adjacent fields that are kept in the destination.
+    """
+    coalesced = []
+    for (source_offset, destination_offset, size) in copies:
+        if coalesced:
+            (last_source_offset, last_destination_offset,
+             last_size) = coalesced[-1]
+            if (last_source_offset + last_size == source_offset and
+                    last_destination_offset + last_size == destination_offset):
+                coalesced[-1] = (last_source_offset, last_destination_offset,
+                                 last_size + size)
+                continue
+        coalesced.append((source_offset, destination_offset, size))
+    return coalesced
+
+
+def _layout(template):
+    if isinstance(template, TemplateLayout):
+        return template
+    return TemplateLayout.from_template(template)
@@ -0,0 +1,129 @@
+"""
+    binalyzer_rest.registry
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module implements the registry of named templates, which are parsed
+    before the server reports to be ready.
+"""
+import os
+import json
+import logging
+import threading
+
+from urllib.parse import urlparse
+
+from . import compiler
+from . import transport
+from .cache import template_cache
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownTemplateError(LookupError):
+    """Raised if a template name is not registered.
+    """
+
+
+class TemplateRegistry(object):
+    """Templates registered by name, given as a mapping of names to
+    `(template_url, template_text)` tuples.
+
+    The registry is ready once all templates are parsed into the template
+    cache, see :meth:`warm_up`. An empty registry is ready right away.
+    Templates that fail to parse are reported by :attr:`errors`.
+    """
+
+    def __init__(self, templates=None):
+        self.templates = dict(templates or {})
+        self.errors = {}
+        self._ready = threading.Event()
+        if not self.templates:
+            self._ready.set()
+
+    @classmethod
+    def load(cls, path):
+        """Loads the templates of a directory or a configuration file.
+
+        Each `*.xml` and compiled `*.template` file of a directory is
+        registered by its name without extension. A configuration file is a
+        JSON object that maps names to paths or URLs, where relative paths
+        are resolved against the directory of the configuration file.
+        """
+        if os.path.isdir(path):
+            locations = {os.path.splitext(name)[0]: os.path.join(path, name)
+                         for name in sorted(os.listdir(path))
+                         if name.endswith(('.xml', '.template'))}
+        else:
+            with open(path, 'r') as config_file:
+                locations = json.load(config_file)
+            directory = os.path.dirname(os.path.abspath(path))
+            locations = {name: (location if urlparse(location).scheme
+                                else os.path.join(directory, location))
+                         for (name, location) in locations.items()}
+        return cls({name: _read(location)
+                    for (name, location) in locations.items()})
+
+    def __len__(self):
+        return len(self.templates)
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    @property
+    def failed(self):
+        """Whether a template failed to parse during the warm-up.
+        """
+        return bool(self.errors)
+
+    def get(self, name):
+        """Returns the `(template_url, template_text)` tuple of a registered
+        template.
+        """
+        if name not in self.templates:
+            raise UnknownTemplateError('Unknown template: {}'.format(name))
+        return self.templates[name]
+
+    def warm_up(self):
+        """Parses all templates into the template cache and marks the
+        registry as ready. Templates that fail to parse are logged and
+        recorded in :attr:`errors` by name, the others are warmed up anyway.
+        """
+        for (name, (template_url, template_text)) in self.templates.items():
+            try:
+                template_cache.get_template(template_url, template_text)
+            except Exception as e:
+                logger.exception('Failed to parse template %s from %s',
+                                 name, template_url)
+                self.errors[name] = str(e)
+        self._ready.set()
+
+    def start_warm_up(self):
+        """Warms up the registry in a background thread.
+        """
+        thread = threading.Thread(target=self.warm_up)
+        thread.daemon = True
+        thread.start()
+
+
+def _read(location):
+    if urlparse(location).scheme:
+        return (location,
+                compiler.template_description(transport.get(location)))
+    path = os.path.abspath(location)
+    with open(path, 'rb') as template_file:
+        content = template_file.read()
+    if not compiler.is_compiled(content):
+        content = content.decode('utf-8')
+    return ('file://' + path, content)
+
+
+registry = TemplateRegistry()
+
+
+def configure(path):
+    """Replaces the shared registry by one loaded from the given path, see
+    :meth:`TemplateRegistry.load`.
+    """
+    global registry
+    registry = TemplateRegistry.load(path)
@@ -6,13 +6,20 @@
 """
 import os
 import io
+import json
 import time
-import requests
+import uuid
+import base64
 import antlr4
 
-from . import utils
-
-from threading import Thread
+from . import jobs
+from . import metrics
+from . import pipeline
+from . import registry
+from . import compiler
+from . import transport
+from . import admission
+from . import compression
 
 from flasgger import Swagger
 from flasgger.utils import swag_from
@@ -25,10 +32,9 @@ from flask import (
     send_file,
     Response
 )
-from werkzeug.wsgi import FileWrapper
+from werkzeug.wsgi import FileWrapper, ClosingIterator
 
 from binalyzer import (
-    Binalyzer,
     XMLTemplateParser,
     TemplateProvider,
     DataProvider,
@@ -55,6 +61,8 @@ swagger_template = {
     "tags": [
         {"name": "general"},
         {"name": "transformation"},
+        {"name": "jobs"},
+        {"name": "monitoring"},
     ],
 }
 
@@ -76,7 +84,20 @@ def index():
 @flask_app.route('/health', methods=['GET'])
 @swag_from('resources/health.yml')
 def health():
-    return jsonify()
+    if registry.registry.failed:
+        # Failed templates aren't parsed again, retrying doesn't help.
+        return jsonify(status='failed', errors=registry.registry.errors), 503
+    if not registry.registry.ready:
+        response = jsonify(status='warming up')
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    return jsonify(load=admission.controller.load())
+
+
+@flask_app.route('/metrics', methods=['GET'])
+@swag_from('resources/metrics.yml')
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 
 @flask_app.route('/transform', methods=['POST'])
@@ -84,43 +105,209 @@ def health():
 def transform():
     params = request.get_json()
 
-    source_template_url = params['source_template_url']
-    source_binding = params['source_binding']
-    destination_template_url = params['destination_template_url']
-    destination_binding = params['destination_binding']
-    deployment_url = params['deployment_url']
-
-    source_template = utils.create_template(
-        source_template_url,
-        source_binding
-    )
-
-    destination_template = utils.create_template(
-        destination_template_url,
-        destination_binding
-    )
-
-    utils.bind_data_to_template(
-        source_template,
-        source_binding
-    )
-
-    Binalyzer().transform(
-        source_template,
-        destination_template,
-    )
-
-    utils.bind_data_to_template(
-        destination_template,
-        destination_binding
-    )
-
-    if deployment_url:
-        requests.put(deployment_url,
-                    data=io.BytesIO(destination_template.value),
-                    headers={'Content-type': 'application/octet-stream'})
-        return jsonify(), 200
-    else:
-        destination_data = io.BytesIO(destination_template.value)
-        destination_file = FileWrapper(destination_data)
-        return Response(destination_file, direct_passthrough=True)
+    deployment_url = params.get('deployment_url')
+    encoding = request.accept_encodings.best_match(compression.encodings())
+
+    # The data is HEADed once, when admitting and when opening it.
+    with metrics.collect_timings() as timings, \
+            transport.shared_head_responses():
+        ticket = pipeline.admit(params)
+        try:
+            if params.get('destinations') is not None:
+                response = _transform_destinations(params, ticket)
+            else:
+                output = pipeline.transform(params)
+
+                if deployment_url:
+                    with ticket:
+                        pipeline.deploy(deployment_url, output,
+                                        params.get('deployment_encoding'))
+                    response = jsonify()
+                else:
+                    chunks = output.iter_chunks()
+                    if encoding:
+                        chunks = compression.compress(chunks, encoding)
+                    # The output is held until it has been sent. Passed through
+                    # responses aren't closed by Flask, but their iterable is.
+                    chunks = ClosingIterator(
+                        metrics.count_bytes(chunks, 'returned'),
+                        [output.release, ticket.release])
+                    response = Response(chunks,
+                                        mimetype='application/octet-stream',
+                                        direct_passthrough=True)
+                    response.vary.add('Accept-Encoding')
+                    if encoding:
+                        response.content_encoding = encoding
+                    else:
+                        response.content_length = output.size
+        except Exception:
+            ticket.release()
+            raise
+
+    response.headers['Server-Timing'] = timings.server_timing()
+    return response
+
+
+@flask_app.route('/transform/batch', methods=['POST'])
+@swag_from('resources/transform_batch.yml')
+def transform_batch():
+    params = request.get_json()
+
+    results = pipeline.transform_batch(params)
+
+    if request.accept_mimetypes.best == 'application/x-ndjson':
+        return Response((json.dumps(result) + '\n' for result in results),
+                        mimetype='application/x-ndjson')
+    items = sorted(results, key=lambda result: result['index'])
+    return jsonify(items=items)
+
+
+@flask_app.route('/extract', methods=['POST'])
+@swag_from('resources/extract.yml')
+def extract():
+    params = request.get_json()
+
+    with metrics.collect_timings() as timings:
+        fields = pipeline.extract(params)
+
+        if request.accept_mimetypes.best == 'multipart/mixed':
+            boundary = uuid.uuid4().hex
+            response = Response(
+                metrics.count_bytes(_iter_multipart(fields, boundary),
+                                    'returned'),
+                content_type='multipart/mixed; boundary=' + boundary
+            )
+        else:
+            with metrics.timed('extract'):
+                response = jsonify(fields=[{
+                    'name': field.name,
+                    'offset': field.offset,
+                    'size': field.size,
+                    'data': base64.b64encode(
+                        b''.join(field.iter_chunks())
+                    ).decode('ascii'),
+                } for field in fields])
+
+    response.headers['Server-Timing'] = timings.server_timing()
+    return response
+
+
+@flask_app.route('/compile', methods=['POST'])
+@swag_from('resources/compile.yml')
+def compile_template():
+    params = request.get_json()
+
+    with metrics.collect_timings() as timings:
+        compiled = pipeline.compile_template(params)
+
+    response = Response(compiled, mimetype='application/octet-stream')
+    response.headers['Server-Timing'] = timings.server_timing()
+    return response
+
+
+@flask_app.route('/jobs/transform', methods=['POST'])
+@swag_from('resources/jobs_transform.yml')
+def jobs_transform():
+    params = request.get_json()
+
+    if params.get('destinations') is not None:
+        return jsonify(error='Jobs with destinations are not supported.'), 400
+
+    try:
+        job = jobs.job_queue.submit(_run_transform_job, params)
+    except jobs.QueueFullError as e:
+        response = jsonify(error=str(e))
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    response = jsonify(_job_status(job))
+    response.headers['Location'] = url_for('job', job_id=job.id)
+    return response, 202
+
+
+@flask_app.route('/jobs/<job_id>', methods=['GET'])
+@swag_from('resources/job.yml')
+def job(job_id):
+    job = jobs.job_queue.get(job_id)
+    if job is None:
+        return jsonify(error='Unknown job.'), 404
+    return jsonify(_job_status(job))
+
+
+@flask_app.route('/jobs/<job_id>/result', methods=['GET'])
+@swag_from('resources/job_result.yml')
+def job_result(job_id):
+    result = jobs.job_queue.result(job_id)
+    if result is None:
+        return jsonify(error='No result available.'), 404
+    destination_file = FileWrapper(io.BytesIO(result))
+    return Response(destination_file, direct_passthrough=True)
+
+
+@flask_app.errorhandler(admission.OverloadedError)
+def overloaded(error):
+    response = jsonify(error=error.args[0])
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, error.status
+
+
+@flask_app.errorhandler(registry.UnknownTemplateError)
+@flask_app.errorhandler(pipeline.UnknownFieldError)
+@flask_app.errorhandler(compression.UnsupportedEncodingError)
+@flask_app.errorhandler(compiler.CompileError)
+def unknown_name(error):
+    return jsonify(error=error.args[0]), 400
+
+
+def _run_transform_job(params):
+    deployment_url = params.get('deployment_url')
+
+    # Jobs are admitted like /transform requests, once a worker runs them.
+    with transport.shared_head_responses(), pipeline.admit(params):
+        output = pipeline.transform(params)
+
+        if deployment_url:
+            pipeline.deploy(deployment_url, output,
+                            params.get('deployment_encoding'))
+            return None
+        return output.value
+
+
+def _iter_multipart(fields, boundary):
+    # Each part carries the field's name and its range within the data.
+    for field in fields:
+        yield ('--{}\r\n'
+               'Content-Type: application/octet-stream\r\n'
+               'Content-Disposition: attachment; name="{}"\r\n'
+               'Content-Range: bytes {}-{}/{}\r\n'
+               '\r\n').format(boundary, field.name.replace('"', '\\"'),
+                              field.offset, field.offset + field.size - 1,
+                              field.data_size).encode('utf-8')
+        for chunk in field.iter_chunks():
+            yield chunk
+        yield b'\r\n'
+    yield '--{}--\r\n'.format(boundary).encode('utf-8')
+
+
+def _transform_destinations(params, ticket):
+    # The ticket is held until each destination is done.
+    results = pipeline.transform_destinations(params)
+    if request.accept_mimetypes.best == 'application/x-ndjson':
+        return Response(ClosingIterator((json.dumps(result) + '\n'
+                                         for result in results),
+                                        [results.close, ticket.release]),
+                        mimetype='application/x-ndjson')
+    with ticket:
+        destinations = sorted(results, key=lambda result: result['index'])
+    return jsonify(destinations=destinations)
+
+
+def _job_status(job):
+    status = job.to_dict()
+    status['status_url'] = url_for('job', job_id=job.id)
+    if job.status == jobs.Job.SUCCEEDED:
+        if job.params.get('deployment_url'):
+            status['deployment_url'] = job.params['deployment_url']
+        elif jobs.job_queue.has_result(job.id):
+            status['result_url'] = url_for('job_result', job_id=job.id)
+    return status
@@ -0,0 +1,73 @@
+"""
+    binalyzer_rest.server
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    This module implements the production server, which runs the REST API in
+    pre-forked gunicorn worker processes.
+"""
+from . import workers
+from . import registry
+
+
+def run(app, host, port, ssl_context=None, workers_count=1, threads=8,
+        backlog=2048, keep_alive=5, graceful_timeout=30, timeout=120,
+        max_requests=0):
+    """Runs the WSGI application using gunicorn.
+
+    :param workers_count: number of server processes
+    :param threads: number of request threads per server process
+    :param backlog: maximum number of pending connections
+    :param keep_alive: seconds to wait for requests on a keep-alive connection
+    :param graceful_timeout: seconds given to server processes to finish their
+                             requests on restarts and shutdown
+    :param timeout: seconds after which a silent server process is restarted
+    :param max_requests: number of requests after which a server process is
+                         gracefully restarted, disabled if zero
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise RuntimeError(
+            'The production server requires gunicorn, install it using '
+            '"pip install binalyzer_rest[production]".'
+        )
+
+    options = {
+        'bind': '{}:{}'.format(host, port),
+        'workers': workers_count,
+        'threads': threads,
+        'worker_class': 'gthread',
+        'backlog': backlog,
+        'keepalive': keep_alive,
+        'graceful_timeout': graceful_timeout,
+        'timeout': timeout,
+        'max_requests': max_requests,
+        'max_requests_jitter': max_requests // 10,
+        'post_worker_init': _post_worker_init,
+    }
+
+    if ssl_context is not None:
+        if not isinstance(ssl_context, tuple):
+            raise RuntimeError(
+                'The production server requires a certificate and key file.'
+            )
+        (options['certfile'], options['keyfile']) = ssl_context
+
+    class Application(BaseApplication):
+
+        def load_config(self):
+            for (name, value) in options.items():
+                self.cfg.set(name, value)
+
+        def load(self):
+            return app
+
+    Application().run()
+
+
+def _post_worker_init(worker):
+    # Template caches and worker pools aren't shared, each server process
+    # warms up its own.
+    registry.registry.start_warm_up()
+    if workers.worker_pool.offload or workers.worker_pool.split:
+        workers.worker_pool.start()
@@ -0,0 +1,604 @@
+"""
+    binalyzer_rest.transport
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module implements the HTTP transport used to fetch templates and data
+    and to deploy transformation results.
+"""
+import os
+import json
+import mmap
+import hashlib
+import tempfile
+import threading
+import contextlib
+import contextvars
+
+import requests
+
+from urllib.parse import urlparse, unquote
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+from . import metrics
+from . import compression
+
+BLOCK_SIZE = 64 * 1024
+
+revalidated_responses = metrics.Counter(
+    'binalyzer_http_cache_revalidated_total',
+    'Responses of the HTTP cache revalidated by a conditional request.'
+)
+
+_head_responses = contextvars.ContextVar('head_responses', default=None)
+
+range_requests = metrics.Counter(
+    'binalyzer_http_range_requests_total',
+    'Range requests sent to fetch parts of lazily bound data.'
+)
+
+
+class DiskCache(object):
+    """Stores response bodies together with their validators (`ETag` and
+    `Last-Modified`) in a directory, so they can be revalidated using
+    conditional requests.
+    """
+
+    VALIDATORS = ('ETag', 'Last-Modified')
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self, url):
+        (body_path, meta_path) = self._paths(url)
+        try:
+            with open(meta_path, 'r') as meta_file:
+                meta = json.load(meta_file)
+            with open(body_path, 'rb') as body_file:
+                body = body_file.read()
+        except (OSError, ValueError):
+            return None
+        return (meta, body)
+
+    def store(self, url, response):
+        headers = {name: response.headers[name]
+                   for name in self.VALIDATORS + ('Content-Type',)
+                   if name in response.headers}
+        if not any(name in headers for name in self.VALIDATORS):
+            return
+        meta = {
+            'url': url,
+            'encoding': response.encoding,
+            'headers': headers,
+        }
+        (body_path, meta_path) = self._paths(url)
+        self._write(body_path, response.content)
+        self._write(meta_path, json.dumps(meta).encode('utf-8'))
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        path = os.path.join(self.directory, key)
+        return (path + '.body', path + '.json')
+
+    def _write(self, path, content):
+        (fd, tmp_path) = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(content)
+        os.replace(tmp_path, path)
+
+
+class LocalResource(object):
+    """A file below the local root, which is memory-mapped instead of being
+    read. It provides the attributes of a :class:`requests.Response` that are
+    used by the REST API.
+
+    The mapping is copy-on-write, so it can be used as a writable buffer
+    without modifying the file. Empty files are not mapped and have no
+    `buffer`. The status of the file when it was mapped is kept as `stat`.
+    """
+
+    status_code = 200
+
+    def __init__(self, url, path):
+        self.url = url
+        self.path = path
+        self.headers = CaseInsensitiveDict()
+        with open(path, 'rb') as local_file:
+            self.stat = os.fstat(local_file.fileno())
+            self.buffer = _map(local_file)
+
+    @property
+    def content(self):
+        if self.buffer is None:
+            return b''
+        return self.buffer[:]
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+
+class DecompressedResource(LocalResource):
+    """A compressed resource, which is decompressed while it is fetched.
+
+    The decompressed data is spooled to an anonymous temporary file that is
+    memory-mapped like a local file, so neither the compressed nor the
+    decompressed data is held in memory as a whole. It has neither `path`
+    nor `stat`.
+
+    :param chunks: an iterable of compressed chunks
+    :param encoding: the encoding of the chunks, see
+                     :mod:`binalyzer_rest.compression`
+    """
+
+    def __init__(self, url, chunks, encoding):
+        self.url = url
+        self.path = None
+        self.stat = None
+        self.headers = CaseInsensitiveDict()
+        with tempfile.TemporaryFile() as spool_file:
+            for chunk in compression.decompress(chunks, encoding):
+                spool_file.write(chunk)
+            spool_file.flush()
+            self.buffer = _map(spool_file)
+
+
+class RemoteData(object):
+    """A seekable binary stream over a remote resource whose data is fetched
+    on demand using HTTP range requests. Data is fetched in blocks of
+    `block_size` bytes and each block is fetched at most once.
+
+    Only the URL, size and `ETag` are pickled, so the stream can be passed
+    to worker processes, which fetch the blocks they read themselves.
+    """
+
+    def __init__(self, url, size, etag=None, block_size=BLOCK_SIZE):
+        self.url = url
+        self.size = size
+        self.etag = etag
+        self.block_size = block_size
+        self._blocks = {}
+        self._position = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'url': self.url, 'size': self.size, 'etag': self.etag,
+                'block_size': self.block_size}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        return self.size
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self.size
+        self._position = max(offset, 0)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def read(self, size=-1):
+        start = self._position
+        end = self.size
+        if size is not None and size >= 0:
+            end = min(start + size, end)
+        if start >= end:
+            return b''
+        first = start // self.block_size
+        last = (end - 1) // self.block_size
+        blocks = self._load(first, last)
+        offset = first * self.block_size
+        self._position = end
+        return b''.join(blocks)[start - offset:end - offset]
+
+    def _load(self, first, last):
+        with self._lock:
+            missing = [index for index in range(first, last + 1)
+                       if index not in self._blocks]
+            # Adjacent missing blocks are fetched by a single request.
+            runs = []
+            for index in missing:
+                if runs and runs[-1][1] == index - 1:
+                    runs[-1][1] = index
+                else:
+                    runs.append([index, index])
+            for (run_first, run_last) in runs:
+                start = run_first * self.block_size
+                end = min((run_last + 1) * self.block_size, self.size)
+                data = get_range(self.url, start, end, self.etag)
+                for index in range(run_first, run_last + 1):
+                    offset = index * self.block_size - start
+                    self._blocks[index] = data[offset:offset + self.block_size]
+            return [self._blocks[index] for index in range(first, last + 1)]
+
+
+class Transport(object):
+    """A connection-pooled HTTP client with retries, timeouts and an optional
+    on-disk cache.
+
+    :param pool_size: number of connections kept alive per host
+    :param timeout: connect and read timeout in seconds
+    :param retries: number of retries on connection errors and on 502, 503
+                    and 504 responses. Uploads are only retried if they
+                    failed to connect, since streamed bodies can't be sent
+                    again, see :mod:`~binalyzer_rest.deployment`.
+    :param cache_dir: directory of the HTTP cache, caching is disabled if
+                      omitted
+    :param concurrency: maximum number of concurrent fetches per request
+    :param local_root: directory from which `file://` URLs are served,
+                       `file://` URLs are rejected if omitted
+    """
+
+    RETRY_STATUS = (502, 503, 504)
+    RETRY_METHODS = ('GET', 'HEAD', 'DELETE', 'OPTIONS')
+
+    def __init__(self, pool_size=10, timeout=30, retries=3, cache_dir=None,
+                 concurrency=8, local_root=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.cache_dir = cache_dir
+        self.concurrency = concurrency
+        self.local_root = os.path.realpath(local_root) if local_root else None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=0.5,
+                status_forcelist=self.RETRY_STATUS,
+                allowed_methods=self.RETRY_METHODS,
+                raise_on_status=False,
+            ),
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = ', '.join(
+            compression.encodings() + ['deflate'])
+        self.cache = DiskCache(cache_dir) if cache_dir else None
+
+    def options(self):
+        """Returns the arguments to create a transport configured like this
+        one, e.g. in a worker process.
+        """
+        return {
+            'pool_size': self.pool_size,
+            'timeout': self.timeout,
+            'retries': self.retries,
+            'cache_dir': self.cache_dir,
+            'concurrency': self.concurrency,
+            'local_root': self.local_root,
+        }
+
+    def get(self, url):
+        """Fetches a resource as a whole. Responses with a
+        `Content-Encoding` are decoded and resources with a compressed
+        suffix, e.g. `.gz`, are decompressed.
+        """
+        response = self._get(url)
+        encoding = compression.url_encoding(url)
+        if encoding is None:
+            return response
+        return DecompressedResource(url, _iter_content(response), encoding)
+
+    def _get(self, url):
+        if urlparse(url).scheme == 'file':
+            return LocalResource(url, self.local_path(url))
+
+        headers = {}
+        cached = self.cache.load(url) if self.cache else None
+        if cached:
+            (meta, _) = cached
+            if 'ETag' in meta['headers']:
+                headers['If-None-Match'] = meta['headers']['ETag']
+            if 'Last-Modified' in meta['headers']:
+                headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+
+        with metrics.timed('fetch'):
+            response = self.session.get(url,
+                                        headers=headers,
+                                        timeout=self.timeout)
+
+            if cached and response.status_code == 304:
+                revalidated_responses.inc()
+                return self._cached_response(url, *cached)
+
+            response.raise_for_status()
+            metrics.transferred_bytes.inc(len(response.content),
+                                          direction='fetched')
+        if self.cache:
+            self.cache.store(url, response)
+        return response
+
+    def open_data(self, url):
+        """Returns a resource whose data is fetched on demand if possible.
+
+        Local files are memory-mapped. Remote resources are returned as
+        :class:`RemoteData` if the server supports range requests, otherwise
+        they are fetched as a whole. Resources with a compressed suffix are
+        streamed through the decompressor.
+        """
+        encoding = compression.url_encoding(url)
+        if encoding is not None:
+            return self._open_compressed(url, encoding)
+
+        if urlparse(url).scheme == 'file':
+            return LocalResource(url, self.local_path(url))
+
+        response = self._head(url)
+        content_length = response.headers.get('Content-Length')
+        # Ranges of encoded responses refer to the encoded data.
+        if (response.ok and content_length is not None and
+                response.headers.get('Accept-Ranges') == 'bytes' and
+                response.headers.get('Content-Encoding',
+                                     'identity') == 'identity'):
+            etag = response.headers.get('ETag')
+            if etag and etag.startswith('W/'):
+                etag = None
+            return RemoteData(url, int(content_length), etag)
+        return self.get(url)
+
+    def content_length(self, url):
+        """Returns the size of a resource without fetching it, or `None` if
+        the server doesn't tell.
+        """
+        if urlparse(url).scheme == 'file':
+            return os.path.getsize(self.local_path(url))
+
+        response = self._head(url)
+        content_length = response.headers.get('Content-Length')
+        if not response.ok or content_length is None:
+            return None
+        return int(content_length)
+
+    def _head(self, url):
+        responses = _head_responses.get()
+        if responses is not None and url in responses:
+            return responses[url]
+        with metrics.timed('fetch'):
+            response = self.session.head(url, timeout=self.timeout,
+                                         allow_redirects=True)
+        if responses is not None:
+            responses[url] = response
+        return response
+
+    def get_range(self, url, start, end, etag=None):
+        """Returns the bytes from `start` up to `end` of a remote resource.
+        If an `ETag` is given, the request fails if the resource changed.
+        """
+        headers = {'Range': 'bytes={}-{}'.format(start, end - 1),
+                   'Accept-Encoding': 'identity'}
+        if etag:
+            headers['If-Match'] = etag
+        with metrics.timed('fetch'):
+            response = self.session.get(url,
+                                        headers=headers,
+                                        timeout=self.timeout)
+            response.raise_for_status()
+            range_requests.inc()
+            content = response.content
+            metrics.transferred_bytes.inc(len(content), direction='fetched')
+        if response.status_code != 206:
+            # The server ignored the range and sent the whole resource.
+            content = content[start:end]
+        return content
+
+    def _open_compressed(self, url, encoding):
+        if urlparse(url).scheme == 'file':
+            with open(self.local_path(url), 'rb') as local_file:
+                return DecompressedResource(
+                    url, iter(lambda: local_file.read(BLOCK_SIZE), b''),
+                    encoding)
+
+        with metrics.timed('fetch'):
+            with self.session.get(url, stream=True,
+                                  timeout=self.timeout) as response:
+                response.raise_for_status()
+                return DecompressedResource(
+                    url,
+                    metrics.count_bytes(
+                        response.iter_content(BLOCK_SIZE), 'fetched'),
+                    encoding)
+
+    def put(self, url, data, headers=None):
+        response = self.session.put(url,
+                                    data=data,
+                                    headers=headers,
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def post(self, url, data=None, headers=None):
+        response = self.session.post(url,
+                                     data=data,
+                                     headers=headers,
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def delete(self, url):
+        response = self.session.delete(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def local_path(self, url):
+        """Returns the path of a `file://` URL. Relative paths are resolved
+        against the local root. Raises a :class:`PermissionError` if the path
+        is outside of the local root.
+        """
+        if self.local_root is None:
+            raise PermissionError('Local files are disabled.')
+        path = os.path.realpath(os.path.join(self.local_root,
+                                             unquote(urlparse(url).path)))
+        if os.path.commonpath([self.local_root, path]) != self.local_root:
+            raise PermissionError('Access outside of the local root is denied.')
+        return path
+
+    def _cached_response(self, url, meta, body):
+        response = requests.Response()
+        response.url = url
+        response.status_code = 200
+        response.encoding = meta['encoding']
+        response.headers = CaseInsensitiveDict(meta['headers'])
+        response._content = body
+        return response
+
+
+def _map(file):
+    if not os.fstat(file.fileno()).st_size:
+        return None
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+
+def _iter_content(response):
+    if isinstance(response, LocalResource):
+        if response.buffer is not None:
+            buffer = memoryview(response.buffer)
+            for offset in range(0, len(buffer), BLOCK_SIZE):
+                yield buffer[offset:offset + BLOCK_SIZE]
+        return
+    content = response.content
+    for offset in range(0, len(content), BLOCK_SIZE):
+        yield content[offset:offset + BLOCK_SIZE]
+
+
+class Fetcher(object):
+    """Fetches the resources of a single request concurrently using a
+    bounded thread pool. Each URL is fetched, or opened, at most once.
+
+    :param max_workers: maximum number of concurrent fetches
+    """
+
+    def __init__(self, max_workers):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def prefetch(self, urls):
+        """Starts fetching the given URLs in the given order.
+        """
+        for url in urls:
+            self.submit(url)
+
+    def preopen(self, urls):
+        """Starts opening the given URLs in the given order, see
+        :func:`open_data`.
+        """
+        for url in urls:
+            self._submit('open', open_data, url)
+
+    def presize(self, urls):
+        """Starts requesting the sizes of the given URLs in the given order,
+        see :func:`content_length`.
+        """
+        for url in urls:
+            self._submit('size', content_length, url)
+
+    def submit(self, url):
+        return self._submit('get', get, url)
+
+    def get(self, url):
+        return self.submit(url).result()
+
+    def open_data(self, url):
+        return self._submit('open', open_data, url).result()
+
+    def content_length(self, url):
+        return self._submit('size', content_length, url).result()
+
+    def _submit(self, kind, fn, url):
+        key = (kind, url)
+        with self._lock:
+            if key not in self._futures:
+                # Fetches are timed as part of the submitting request.
+                context = contextvars.copy_context()
+                self._futures[key] = self._executor.submit(context.run,
+                                                           fn, url)
+            return self._futures[key]
+
+    def close(self):
+        for future in self._futures.values():
+            future.cancel()
+        self._executor.shutdown(wait=True)
+
+
+_transport = Transport()
+
+
+def configure(**kwargs):
+    """Replaces the shared transport by one created with the given arguments,
+    see :class:`Transport`.
+    """
+    global _transport
+    _transport = Transport(**kwargs)
+
+
+def options():
+    """Returns the arguments of the shared transport, see
+    :meth:`Transport.options`.
+    """
+    return _transport.options()
+
+
+@contextlib.contextmanager
+def shared_head_responses():
+    """Shares the responses of HEAD requests within the current context,
+    including fetches started from it. Each URL is requested once, e.g.
+    when the size of a transformation is measured and when its data is
+    opened afterwards.
+    """
+    token = _head_responses.set({})
+    try:
+        yield
+    finally:
+        _head_responses.reset(token)
+
+
+def fetcher():
+    """Returns a :class:`Fetcher` limited to the configured concurrency.
+    """
+    return Fetcher(_transport.concurrency)
+
+
+def get(url):
+    return _transport.get(url)
+
+
+def open_data(url):
+    return _transport.open_data(url)
+
+
+def content_length(url):
+    return _transport.content_length(url)
+
+
+def get_range(url, start, end, etag=None):
+    return _transport.get_range(url, start, end, etag)
+
+
+def put(url, data, headers=None):
+    return _transport.put(url, data=data, headers=headers)
+
+
+def post(url, data=None, headers=None):
+    return _transport.post(url, data=data, headers=headers)
+
+
+def delete(url):
+    return _transport.delete(url)
@@ -1,30 +1,223 @@
-import requests
+import io
 
-from anytree import find_by_attr
+from binalyzer import DataProvider, TemplateProvider
+from binalyzer_core.binding import BindingContext
 
-from binalyzer import XMLTemplateParser
+from . import index
+from . import metrics
+from . import transport
 
+CHUNK_SIZE = 64 * 1024
 
-def create_template(template_url, bindings):
-    root_template_response = requests.get(template_url)
-    root_template_text = root_template_response.text
-    root_template = XMLTemplateParser(root_template_text).parse()
 
-    for binding in bindings:
-        (data_url, template_name) = binding.values()
-        if root_template.name == template_name:
-            root_data = requests.get(data_url).content
-            root_template = XMLTemplateParser(
-                root_template_text, root_data).parse()
-
-    return root_template
+def binding_urls(bindings):
+    return [binding.get('data_url') for binding in bindings]
 
 
-def bind_data_to_template(root_template, bindings):
+def bind_data_to_template(root_template, bindings, fetcher=None):
+    """Binds the data of each binding to the template with the given name or
+    path, see :func:`~binalyzer_rest.index.find`. The data is opened lazily,
+    so only the parts that are read, either by the transformation or when
+    writing the output, are fetched.
+    """
     for binding in bindings:
         data_url = binding.get('data_url')
         template_name = binding.get('template_name')
-        template = find_by_attr(root_template, template_name)
+        template = index.find(root_template, template_name)
         if template:
-            data = requests.get(data_url).content
+            data = resource_data(_open(data_url, fetcher))
+            with metrics.timed('bind'):
+                _bind(template, data)
+
+
+def bind_data(root_template, template_name, data):
+    """Binds data to the template with the given name or path. The data is
+    either a bytes-like object or a seekable binary stream, like a memory-map
+    or a :class:`MemoryStream`.
+
+    Data bound to the root template becomes its value. Data bound to other
+    templates is read through a binding context of their own and takes the
+    template's size, either way. It is not written to the root's data, so it
+    is part of the output of :func:`iter_chunks`, but not of the root's
+    value.
+    """
+    template = index.find(root_template, template_name)
+    if template:
+        _bind(template, data)
+
+
+def resource_data(resource):
+    """Returns the data of a fetched resource, memory-mapped local files and
+    lazily fetched remote data are returned as stream.
+    """
+    if isinstance(resource, transport.RemoteData):
+        return resource
+    if (isinstance(resource, transport.LocalResource) and
+            resource.buffer is not None):
+        return resource.buffer
+    return resource.content
+
+
+class OffsetDataProvider(DataProvider):
+    """Provides the data of a stream bound to a template that is not the
+    root template. Addresses are translated, so the stream is read relative
+    to the address of the bound template.
+    """
+
+    def __init__(self, data, template):
+        super(OffsetDataProvider, self).__init__(data)
+        self.template = template
+
+    def address(self, template):
+        return template.absolute_address - self.template.absolute_address
+
+    def read(self, template):
+        self.data.seek(self.address(template))
+        value = self.data.read(template.size)
+        self.data.seek(0)
+        return value
+
+    def write(self, template, value):
+        self.data.seek(self.address(template))
+        self.data.write(value)
+        self.data.seek(0)
+
+
+class MemoryStream(object):
+    """A seekable binary stream over a fixed-size buffer, e.g. shared memory,
+    that reads and writes the buffer in place.
+    """
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._position = 0
+
+    def __len__(self):
+        return len(self._view)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += len(self._view)
+        self._position = max(offset, 0)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def read(self, size=-1):
+        end = len(self._view)
+        if size is not None and size >= 0:
+            end = min(self._position + size, end)
+        data = bytes(self._view[self._position:end])
+        self._position = max(end, self._position)
+        return data
+
+    def write(self, data):
+        end = self._position + len(data)
+        if end > len(self._view):
+            raise ValueError('Unable to write beyond the end of the buffer.')
+        self._view[self._position:end] = data
+        self._position = end
+        return len(data)
+
+    def close(self):
+        self._view.release()
+
+
+def iter_chunks(template, chunk_size=CHUNK_SIZE):
+    """Yields the data the template is bound to as chunks of at most
+    `chunk_size` bytes. The chunks are read from the template's leaves in
+    offset order, so the data is never copied as a whole.
+    """
+    size = template.size
+    position = 0
+    buffer = bytearray()
+
+    ranges = []
+    leaves = sorted(template.leaves, key=lambda leaf: leaf.absolute_address)
+    for leaf in leaves:
+        start = min(leaf.absolute_address - template.absolute_address, size)
+        end = min(start + leaf.size, size)
+        if start > position:
+            ranges.append((template, position, start))
+        if end > position:
+            ranges.append((leaf, max(position - start, 0), end - start))
+            position = end
+    if size > position:
+        ranges.append((template, position, size))
+
+    for (node, start, end) in ranges:
+        for piece in _iter_range(node, start, end, chunk_size):
+            buffer += piece
+            while len(buffer) >= chunk_size:
+                yield bytes(buffer[:chunk_size])
+                del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def iter_data(data, start, end, chunk_size=CHUNK_SIZE):
+    """Yields exactly `end - start` bytes of data, which is either bytes-like
+    or a seekable stream, as chunks of at most `chunk_size` bytes. Data that
+    is not available is filled with zeros.
+    """
+    if not hasattr(data, 'read'):
+        with memoryview(data) as view:
+            for position in range(start, end, chunk_size):
+                size = min(chunk_size, end - position)
+                piece = bytes(view[position:position + size])
+                yield piece + bytes(size - len(piece))
+        return
+    while start < end:
+        data.seek(start)
+        size = min(chunk_size, end - start)
+        piece = data.read(size) or bytes(size)
+        yield piece
+        start += len(piece)
+    data.seek(0)
+
+
+def _iter_range(template, start, end, chunk_size):
+    # Yields exactly `end - start` bytes of the template's data, data that is
+    # not available is filled with zeros.
+    data_provider = template.binding_context.data_provider
+    if isinstance(data_provider, OffsetDataProvider):
+        address = data_provider.address(template)
+    elif type(data_provider).read is DataProvider.read:
+        address = template.absolute_address
+    else:
+        piece = template.value[start:end]
+        yield piece + bytes(end - start - len(piece))
+        return
+    for piece in iter_data(data_provider.data, address + start,
+                           address + end, chunk_size):
+        yield piece
+
+
+def _bind(template, data):
+    if template.is_root:
+        if isinstance(data, (bytes, bytearray)):
             template.value = data
+        else:
+            # Streams are bound without copying them, so only the parts read
+            # by the transformation are loaded.
+            template.size = len(data)
+            template.binding_context.data = data
+        return
+    # Templates below the root get a binding context of their own, which is
+    # propagated to their children, so their data is never written to the
+    # root's data. Bytes are bound as stream, so the output doesn't depend on
+    # whether data arrived as bytes or as stream.
+    template.size = len(data)
+    if isinstance(data, (bytes, bytearray)):
+        data = io.BytesIO(data)
+    BindingContext(TemplateProvider(template),
+                   OffsetDataProvider(data, template))
+
+
+def _open(url, fetcher):
+    if fetcher:
+        return fetcher.open_data(url)
+    return transport.open_data(url)
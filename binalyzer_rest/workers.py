@@ -0,0 +1,352 @@
+"""
+    binalyzer_rest.workers
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    This module implements the worker processes that run the CPU-bound stages
+    of a transformation, parsing and transforming templates, outside of the
+    server process.
+
+    Templates can't be passed between processes. Workers receive template
+    descriptions and data instead and keep their own template cache, so each
+    template is parsed at most once per worker. Large data is passed through
+    shared memory and local files are memory-mapped by the workers.
+"""
+import os
+import threading
+import multiprocessing
+
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from anytree import PreOrderIter
+from binalyzer import Binalyzer
+from binalyzer_core import modify
+
+from . import utils
+from . import transport
+from .cache import template_cache
+
+SHARED_MEMORY_THRESHOLD = 1024 * 1024
+
+
+class SharedData(object):
+    """Refers to data stored in a shared memory block. The block is owned by
+    the server process, which unlinks it once the data is consumed.
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self._shm = None
+        self._stream = None
+
+    @classmethod
+    def create(cls, size):
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        shared_data = cls(shm.name, size)
+        shared_data._shm = shm
+        return shared_data
+
+    def __getstate__(self):
+        return {'name': self.name, 'size': self.size}
+
+    def __setstate__(self, state):
+        self.__init__(state['name'], state['size'])
+
+    @property
+    def buffer(self):
+        return self._attach().buf[:self.size]
+
+    def open(self):
+        self._stream = utils.MemoryStream(self.buffer)
+        return self._stream
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def unlink(self):
+        self._attach().unlink()
+        self.close()
+
+    def _attach(self):
+        if self._shm is None:
+            self._shm = shared_memory.SharedMemory(name=self.name)
+        return self._shm
+
+
+class LocalData(object):
+    """Refers to a local file, which is memory-mapped by the worker.
+    """
+
+    def __init__(self, url, path):
+        self.url = url
+        self.path = path
+        self._resource = None
+
+    def open(self):
+        self._resource = transport.LocalResource(self.url, self.path)
+        return utils.resource_data(self._resource)
+
+    def close(self):
+        self._resource = None
+
+
+def share(data, threshold=SHARED_MEMORY_THRESHOLD):
+    """Prepares data to be passed to another process. Small data is passed as
+    it is, large data is copied to shared memory.
+    """
+    if len(data) < threshold:
+        return bytes(data)
+    shared_data = SharedData.create(len(data))
+    shared_data.buffer[:] = data
+    shared_data.close()
+    return shared_data
+
+
+def share_resource(resource, threshold=SHARED_MEMORY_THRESHOLD, lazy=True):
+    """Prepares the data of a fetched resource to be passed to a worker.
+    Lazily fetched data is passed as it is and fetched by the worker, unless
+    `lazy` is false, e.g. if it is read by several workers. It is fetched as
+    a whole and passed like other data then.
+    """
+    if isinstance(resource, transport.RemoteData):
+        if lazy:
+            return resource
+        resource.seek(0)
+        data = resource.read()
+        resource.seek(0)
+        return share(data, threshold)
+    if (isinstance(resource, transport.LocalResource) and
+            resource.path is not None):
+        return LocalData(resource.url, resource.path)
+    return share(utils.resource_data(resource), threshold)
+
+
+def unlink(data):
+    """Releases data prepared by :func:`share` once it is no longer needed.
+    """
+    if isinstance(data, SharedData):
+        data.unlink()
+
+
+class WorkerPool(object):
+    """A lazily started pool of worker processes.
+
+    :param processes: number of worker processes, defaults to the number of
+                      CPUs
+    :param offload: whether the `/transform` endpoint runs its parse and
+                    transform stages in the worker processes
+    :param split: whether the `/transform` endpoint splits destination
+                  templates with a static layout into their top-level
+                  subtrees, which are transformed by the worker processes in
+                  parallel
+    :param templates: `(template_url, template_text)` tuples parsed by each
+                      worker when it starts
+    :param shared_memory_threshold: minimum size of data passed through
+                                    shared memory
+    """
+
+    def __init__(self, processes=None, offload=False, split=False,
+                 templates=(),
+                 shared_memory_threshold=SHARED_MEMORY_THRESHOLD):
+        self.processes = processes or os.cpu_count() or 1
+        self.offload = offload
+        self.split = split
+        self.templates = list(templates)
+        self.shared_memory_threshold = shared_memory_threshold
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts all worker processes and waits until they are warmed up.
+        """
+        executor = self._start()
+        wait([executor.submit(_warm_up) for _ in range(self.processes)])
+
+    def submit(self, fn, *args):
+        return self._start().submit(fn, *args)
+
+    def transform(self, source_template_url, source_template_text,
+                  source_data, destination_template_url,
+                  destination_template_text, destination_data):
+        """Transforms data in a worker process, see :func:`transform`.
+        """
+        return self.submit(
+            transform,
+            source_template_url,
+            source_template_text,
+            source_data,
+            destination_template_url,
+            destination_template_text,
+            destination_data,
+            self.shared_memory_threshold,
+        )
+
+    def transform_subtrees(self, source_template_url, source_template_text,
+                           source_data, destination_template_url,
+                           destination_template_text, positions, output):
+        """Transforms subtrees of the destination template in a worker
+        process, see :func:`transform_subtrees`.
+        """
+        return self.submit(
+            transform_subtrees,
+            source_template_url,
+            source_template_text,
+            source_data,
+            destination_template_url,
+            destination_template_text,
+            positions,
+            output,
+        )
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def _start(self):
+        with self._lock:
+            if self._executor is None:
+                # Forking a multi-threaded server is unsafe, workers are
+                # forked from a dedicated server process instead.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context('forkserver'),
+                    initializer=_initialize,
+                    initargs=(self.templates, template_cache.directory,
+                              template_cache.maxsize, transport.options()),
+                )
+            return self._executor
+
+
+def _initialize(templates, template_cache_directory=None,
+                template_cache_size=None, transport_options=None):
+    # Workers are configured like the server process, e.g. range requests of
+    # lazily bound data use its timeout, retries and HTTP cache.
+    template_cache.directory = template_cache_directory
+    if template_cache_size is not None:
+        template_cache.maxsize = template_cache_size
+    if transport_options is not None:
+        transport.configure(**transport_options)
+    for (template_url, template_text) in templates:
+        template_cache.get_template(template_url, template_text)
+
+
+def _warm_up():
+    pass
+
+
+def transform(source_template_url, source_template_text, source_data,
+              destination_template_url, destination_template_text,
+              destination_data, shared_memory_threshold=SHARED_MEMORY_THRESHOLD):
+    """Transforms data in a worker process and returns the data of the
+    destination template prepared by :func:`share`.
+
+    :param source_data: a list of `(template_name, data)` tuples bound to the
+                        source template, where data is prepared by
+                        :func:`share` or :func:`share_resource`
+    :param destination_data: a list of `(template_name, data)` tuples bound to
+                             the destination template after transformation
+    """
+    opened = []
+    try:
+        source_template = template_cache.get_template(source_template_url,
+                                                      source_template_text)
+        destination_template = template_cache.get_template(
+            destination_template_url,
+            destination_template_text
+        )
+
+        _bind(source_template, source_data, opened)
+
+        Binalyzer().transform(
+            source_template,
+            destination_template,
+        )
+
+        _bind(destination_template, destination_data, opened)
+
+        size = destination_template.size
+        if size < shared_memory_threshold:
+            return b''.join(utils.iter_chunks(destination_template))
+
+        shared_data = SharedData.create(size)
+        position = 0
+        for chunk in utils.iter_chunks(destination_template):
+            shared_data.buffer[position:position + len(chunk)] = chunk
+            position += len(chunk)
+        shared_data.close()
+        return shared_data
+    finally:
+        for data in opened:
+            data.close()
+
+
+def transform_subtrees(source_template_url, source_template_text,
+                       source_data, destination_template_url,
+                       destination_template_text, positions, output):
+    """Transforms the subtrees of a destination template with a static
+    layout and writes their data to the output at their offsets.
+
+    :param positions: the positions of the subtrees' roots in pre-order, see
+                      :meth:`~binalyzer_rest.layout.TemplateLayout.split`
+    :param output: :class:`SharedData` of the destination template's size,
+                   data outside of the subtrees is left as it is
+    """
+    opened = []
+    try:
+        source_template = template_cache.get_template(source_template_url,
+                                                      source_template_text)
+        destination_template = template_cache.get_template(
+            destination_template_url,
+            destination_template_text
+        )
+        destination_layout = template_cache.get_layout(
+            destination_template_url,
+            destination_template_text
+        )
+        nodes = list(PreOrderIter(destination_template))
+
+        _bind(source_template, source_data, opened)
+
+        with output.buffer as buffer:
+            for position in positions:
+                # Like the transformation of the whole template, the leaves
+                # are projected and their data is written in pre-order.
+                modify.project(source_template, nodes[position])
+                for leaf in range(position, destination_layout.ends[position]):
+                    if destination_layout.ends[leaf] != leaf + 1:
+                        continue
+                    offset = destination_layout.offsets[leaf]
+                    value = nodes[leaf].value[:destination_layout.sizes[leaf]]
+                    buffer[offset:offset + len(value)] = value
+    finally:
+        output.close()
+        for data in opened:
+            data.close()
+
+
+def _bind(template, bindings, opened):
+    for (template_name, data) in bindings:
+        if hasattr(data, 'open'):
+            opened.append(data)
+            data = data.open()
+        utils.bind_data(template, template_name, data)
+
+
+worker_pool = WorkerPool()
+
+
+def configure(**kwargs):
+    """Replaces the shared worker pool by one created with the given
+    arguments, see :class:`WorkerPool`.
+    """
+    global worker_pool
+    worker_pool.shutdown()
+    worker_pool = WorkerPool(**kwargs)
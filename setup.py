@@ -41,6 +41,10 @@ setuptools.setup(
         "jsonschema>=2.6.0",
         "requests>=2.25.1"
     ],
+    extras_require={
+        "production": ["gunicorn>=20.0"],
+        "zstd": ["zstandard>=0.15"],
+    },
     entry_points='''
         [binalyzer.commands]
         rest=binalyzer_rest.cli:rest
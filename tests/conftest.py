@@ -0,0 +1,220 @@
+import gzip
+import uuid
+import base64
+import hashlib
+import threading
+
+import pytest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from xml.etree import ElementTree
+
+from binalyzer_rest import cache
+
+
+S3_NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+
+class FileServer(ThreadingHTTPServer):
+    """A local HTTP server that serves and stores in-memory files. Files in
+    `encoded` are sent with `Content-Encoding: gzip` if accepted.
+
+    `unavailable` maps paths to the number of times an upload is answered
+    with `503 Service Unavailable`.
+
+    Files may also be uploaded by S3 multipart uploads. `corrupted_parts`
+    maps part numbers to the number of times a wrong `ETag` is returned for
+    the part.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super(FileServer, self).__init__(('127.0.0.1', 0), FileRequestHandler)
+        self.files = {}
+        self.encoded = set()
+        self.requests = []
+        self.unavailable = {}
+        self.uploads = {}
+        self.corrupted_parts = {}
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+
+class FileRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.server.requests.append(('HEAD', self.path, dict(self.headers)))
+        if self.path not in self.server.files:
+            self.send_error(404)
+            return
+        content = self.server.files[self.path]
+        self.send_response(200)
+        if self._encoded():
+            content = gzip.compress(content)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('ETag', self._etag(content))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path, dict(self.headers)))
+        if self.path not in self.server.files:
+            self.send_error(404)
+            return
+
+        content = self.server.files[self.path]
+        etag = self._etag(content)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        if self.headers.get('If-Match', etag) != etag:
+            self.send_error(412)
+            return
+
+        if self._encoded():
+            content = gzip.compress(content)
+            self.send_response(200)
+            self.send_header('Content-Encoding', 'gzip')
+        elif self.headers.get('Range'):
+            (start, end) = self.headers['Range'][len('bytes='):].split('-')
+            content = content[int(start):int(end) + 1]
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_PUT(self):
+        self.server.requests.append(('PUT', self.path, dict(self.headers)))
+        (path, query) = self._split_path()
+        body = self._read_body()
+        if self.server.unavailable.get(path):
+            self.server.unavailable[path] -= 1
+            self.send_error(503)
+            return
+        if 'partNumber' in query:
+            self._put_part(query, body)
+            return
+        self.server.files[path] = body
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        self.server.requests.append(('POST', self.path, dict(self.headers)))
+        (path, query) = self._split_path()
+        body = self._read_body()
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            self.server.uploads[upload_id] = {}
+            self._send_xml(
+                '<InitiateMultipartUploadResult xmlns="{}">'
+                '<UploadId>{}</UploadId>'
+                '</InitiateMultipartUploadResult>'.format(S3_NAMESPACE,
+                                                          upload_id))
+            return
+
+        parts = self.server.uploads.pop(query['uploadId'][0])
+        completed = ElementTree.fromstring(body)
+        content = b''
+        for part in completed.iter('{%s}Part' % S3_NAMESPACE):
+            number = int(part.find('{%s}PartNumber' % S3_NAMESPACE).text)
+            etag = part.find('{%s}ETag' % S3_NAMESPACE).text
+            if etag != self._etag(parts[number]):
+                self.send_error(400)
+                return
+            content += parts[number]
+        self.server.files[path] = content
+        self._send_xml(
+            '<CompleteMultipartUploadResult xmlns="{}">'
+            '<ETag>{}</ETag>'
+            '</CompleteMultipartUploadResult>'.format(S3_NAMESPACE,
+                                                      self._etag(content)))
+
+    def do_DELETE(self):
+        self.server.requests.append(('DELETE', self.path, dict(self.headers)))
+        (_, query) = self._split_path()
+        self.server.uploads.pop(query['uploadId'][0], None)
+        self.send_response(204)
+        self.end_headers()
+
+    def _put_part(self, query, body):
+        number = int(query['partNumber'][0])
+        content_md5 = base64.b64encode(hashlib.md5(body).digest())
+        if self.headers.get('Content-MD5', '').encode('ascii') != content_md5:
+            self.send_error(400)
+            return
+        self.server.uploads[query['uploadId'][0]][number] = body
+        etag = self._etag(body)
+        if self.server.corrupted_parts.get(number):
+            self.server.corrupted_parts[number] -= 1
+            etag = self._etag(b'')
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send_xml(self, xml):
+        body = xml.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _split_path(self):
+        url = urlparse(self.path)
+        return (url.path, parse_qs(url.query, keep_blank_values=True))
+
+    def _encoded(self):
+        return (self.path in self.server.encoded and
+                'gzip' in self.headers.get('Accept-Encoding', ''))
+
+    def _etag(self, content):
+        return '"{}"'.format(hashlib.md5(content).hexdigest())
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                chunk = self.rfile.read(size + 2)[:size]
+                if not size:
+                    return body
+                body += chunk
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+
+@pytest.fixture
+def file_server():
+    server = FileServer()
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={'poll_interval': 0.01})
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def result_cache(monkeypatch):
+    """Each test starts with an empty result cache."""
+    result_cache = cache.ResultCache(maxsize=64 * 1024 * 1024)
+    monkeypatch.setattr(cache, 'result_cache', result_cache)
+    return result_cache
@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+from binalyzer_rest.admission import AdmissionController, OverloadedError
+
+
+def test_admit_within_limits():
+    controller = AdmissionController(max_transforms=2, max_bytes=100)
+
+    with controller.admit(60):
+        with controller.admit(40):
+            assert controller.load()['transforms'] == 2
+            assert controller.load()['bytes'] == 100
+    assert controller.load()['transforms'] == 0
+    assert controller.load()['bytes'] == 0
+
+
+def test_admit_oversized_transform_alone():
+    controller = AdmissionController(max_bytes=100, max_wait=0)
+
+    with controller.admit(200):
+        with pytest.raises(OverloadedError) as error:
+            controller.admit(1)
+    assert error.value.status == 503
+
+
+def test_reject_if_too_many_waiting():
+    controller = AdmissionController(max_transforms=1, max_waiting=1,
+                                     retry_after=5)
+    ticket = controller.admit()
+    waiting = threading.Thread(target=lambda: controller.admit().release())
+    waiting.start()
+    while controller.load()['waiting'] == 0:
+        pass
+
+    with pytest.raises(OverloadedError) as error:
+        controller.admit()
+    assert error.value.status == 429
+    assert error.value.retry_after == 5
+
+    ticket.release()
+    waiting.join()
+    assert controller.load()['transforms'] == 0
+
+
+def test_reject_after_waiting():
+    controller = AdmissionController(max_transforms=1, max_wait=0.01)
+
+    with controller.admit():
+        with pytest.raises(OverloadedError) as error:
+            controller.admit()
+    assert error.value.status == 503
+    assert controller.load()['waiting'] == 0
@@ -0,0 +1,144 @@
+import pytest
+
+from binalyzer_rest import cache
+from binalyzer_rest.cache import (
+    LRUCache,
+    ResultCache,
+    TemplateCache,
+    result_key,
+)
+
+
+TEST_TEMPLATE = """
+    <template name="a">
+        <field name="b" size="8"></field>
+        <field name="c" size="8"></field>
+    </template>
+"""
+
+
+@pytest.fixture
+def parse_counter(monkeypatch):
+    counter = {'parsed': 0}
+    parse = cache.XMLTemplateParser.parse
+
+    def counting_parse(self):
+        counter['parsed'] += 1
+        return parse(self)
+
+    monkeypatch.setattr(cache.XMLTemplateParser, 'parse', counting_parse)
+    return counter
+
+
+def test_lru_cache_evicts_least_recently_used():
+    lru_cache = LRUCache(maxsize=2)
+    lru_cache.put('a', 1)
+    lru_cache.put('b', 2)
+    assert lru_cache.get('a') == 1
+    lru_cache.put('c', 3)
+    assert 'a' in lru_cache
+    assert 'b' not in lru_cache
+    assert 'c' in lru_cache
+    assert lru_cache.hits == 1
+
+
+def test_template_cache_parses_once(parse_counter):
+    template_cache = TemplateCache()
+    first = template_cache.get_template('http://localhost/a.xml', TEST_TEMPLATE)
+    second = template_cache.get_template('http://localhost/a.xml', TEST_TEMPLATE)
+    assert parse_counter['parsed'] == 1
+    assert first is not second
+    assert [child.name for child in second.children] == ['b', 'c']
+    assert second.size == 16
+
+
+def test_template_cache_reparses_changed_content(parse_counter):
+    template_cache = TemplateCache()
+    template_cache.get_template('http://localhost/a.xml', TEST_TEMPLATE)
+    template_cache.get_template('http://localhost/a.xml',
+                                TEST_TEMPLATE.replace('"8"', '"4"'))
+    assert parse_counter['parsed'] == 2
+
+
+def test_template_cache_clone_is_independent():
+    template_cache = TemplateCache()
+    first = template_cache.get_template('http://localhost/a.xml', TEST_TEMPLATE)
+    first.value = bytes([0x11] * 32)
+    second = template_cache.get_template('http://localhost/a.xml', TEST_TEMPLATE)
+    assert first.size == 32
+    assert second.size == 16
+
+
+def test_template_cache_layout(parse_counter):
+    template_cache = TemplateCache()
+    template_layout = template_cache.get_layout('http://localhost/a.xml',
+                                                TEST_TEMPLATE)
+    template = template_cache.get_template('http://localhost/a.xml',
+                                           TEST_TEMPLATE)
+
+    assert parse_counter['parsed'] == 1
+    assert template_layout.static
+    assert list(template_layout.offsets) == [0, 0, 8]
+    assert template._template_index.layout is template_layout
+
+
+def test_template_cache_stores_compiled_templates(parse_counter, tmpdir):
+    TemplateCache(directory=str(tmpdir)).get_template(
+        'http://localhost/a.xml', TEST_TEMPLATE)
+    template = TemplateCache(directory=str(tmpdir)).get_template(
+        'http://localhost/b.xml', TEST_TEMPLATE)
+
+    assert parse_counter['parsed'] == 1
+    assert len(tmpdir.listdir()) == 1
+    assert [child.name for child in template.children] == ['b', 'c']
+    assert template.size == 16
+
+
+def test_template_cache_loads_compiled_templates(parse_counter):
+    template_cache = TemplateCache()
+    compiled = template_cache.get_compiled('http://localhost/a.xml',
+                                           TEST_TEMPLATE)
+    template = template_cache.get_template('http://localhost/a.bin',
+                                           compiled)
+
+    assert parse_counter['parsed'] == 1
+    assert [child.name for child in template.children] == ['b', 'c']
+    assert template.size == 16
+
+
+def test_result_cache_evicts_by_size():
+    result_cache = ResultCache(maxsize=16)
+    result_cache.put('a', bytes(8))
+    result_cache.put('b', bytes(8))
+    result_cache.put('c', bytes(8))
+    result_cache.put('d', bytes(32))
+    assert 'a' not in result_cache
+    assert 'd' not in result_cache
+    assert result_cache.size == 16
+    assert result_cache.get('c') == bytes(8)
+
+
+def test_result_cache_loads_from_disk(tmpdir):
+    result_cache = ResultCache(maxsize=0, directory=str(tmpdir),
+                               max_disk_size=16)
+    result_cache.put('a', bytes([0x11] * 8))
+    assert result_cache.get('a') == bytes([0x11] * 8)
+    assert ResultCache(directory=str(tmpdir)).get('a') == bytes([0x11] * 8)
+
+    result_cache.put('b', bytes([0x22] * 8))
+    result_cache.put('c', bytes([0x33] * 8))
+    assert len(tmpdir.listdir()) == 2
+    assert result_cache.get('c') == bytes([0x33] * 8)
+    assert result_cache.hits == 2
+
+
+def test_result_key_covers_templates_and_data():
+    key = result_key(TEST_TEMPLATE, [('a', bytes(16))], TEST_TEMPLATE, [])
+    assert key == result_key(TEST_TEMPLATE, [('a', bytes(16))],
+                             TEST_TEMPLATE, [])
+    assert key != result_key(TEST_TEMPLATE, [('a', bytes([1] * 16))],
+                             TEST_TEMPLATE, [])
+    assert key != result_key(TEST_TEMPLATE, [('b', bytes(16))],
+                             TEST_TEMPLATE, [])
+    assert key != result_key(TEST_TEMPLATE, [],
+                             TEST_TEMPLATE, [('a', bytes(16))])
@@ -0,0 +1,139 @@
+import os
+import zlib
+import struct
+import tracemalloc
+
+import pytest
+
+from anytree import PreOrderIter
+from binalyzer import XMLTemplateParser
+
+from binalyzer_rest import utils
+from binalyzer_rest import compiler
+
+
+TESTS_ABS_PATH = os.path.dirname(os.path.abspath(__file__))
+
+TEST_TEMPLATE = """
+    <template name="a">
+        <header name="b" size="2" signature="0x0003"></header>
+        <field name="c" size="{name=b, byteorder=big}" padding-after="2"
+               hint="c"></field>
+        <field name="d" offset="{b}" sizing="fix" size="4"></field>
+        <field name="e" offset="0x20" addressing-mode="absolute"
+               boundary="8">
+            <field size="3">11 22 33</field>
+        </field>
+    </template>
+"""
+
+
+def layout(template, data):
+    utils.bind_data(template, template.name, data)
+    return [(node.name, node.absolute_address, node.size, node.signature,
+             node.hint, node.text)
+            for node in PreOrderIter(template)]
+
+
+@pytest.mark.parametrize('template_text', [
+    TEST_TEMPLATE,
+    open(os.path.join(TESTS_ABS_PATH,
+                      'resources/wasm_source_template.xml')).read(),
+])
+def test_load_compiled_template(template_text):
+    compiled = compiler.compile_template(
+        XMLTemplateParser(template_text).parse())
+    data = bytes([0, 3]) + bytes(range(64))
+
+    assert compiler.is_compiled(compiled)
+    assert (layout(compiler.load_template(compiled), data) ==
+            layout(XMLTemplateParser(template_text).parse(), data))
+
+
+def test_load_invalid_template():
+    with pytest.raises(compiler.CompileError):
+        compiler.load_template(b'<template name="a"></template>')
+
+    compiled = compiler.compile_template(
+        XMLTemplateParser(TEST_TEMPLATE).parse())
+    with pytest.raises(compiler.CompileError):
+        compiler.load_template(bytes(compiled[:8]) + b'\xff' + compiled[9:])
+    with pytest.raises(compiler.CompileError):
+        compiler.load_template(bytes(compiled[:-4]))
+
+
+class UntrustedValueProvider(object):
+
+    def __init__(self, property):
+        raise AssertionError('Untrusted value provider was loaded.')
+
+
+def test_load_template_with_unknown_value_provider(monkeypatch):
+    template = XMLTemplateParser(TEST_TEMPLATE).parse()
+    template.children[1].size_property.value_provider = (
+        UntrustedValueProvider.__new__(UntrustedValueProvider))
+
+    with pytest.raises(compiler.CompileError):
+        compiler.compile_template(template)
+
+    with monkeypatch.context() as patch:
+        patch.setitem(compiler.VALUE_PROVIDERS,
+                      '{}:UntrustedValueProvider'.format(__name__),
+                      UntrustedValueProvider)
+        compiled = compiler.compile_template(template)
+    with pytest.raises(compiler.CompileError):
+        compiler.load_template(compiled)
+
+
+def test_load_malformed_template():
+    compiled = compiler.compile_template(
+        XMLTemplateParser(TEST_TEMPLATE).parse())
+    payload = zlib.decompress(compiled[compiler._HEADER.size:])
+    header = compiled[:compiler._HEADER.size]
+
+    for content in (compiler.MAGIC,
+                    header + zlib.compress(payload[:-3]),
+                    header + zlib.compress(payload + b'\0'),
+                    header + zlib.compress(payload[:4]),
+                    compiler._HEADER.pack(compiler.MAGIC, compiler.VERSION,
+                                          0) + zlib.compress(payload)):
+        with pytest.raises(compiler.CompileError):
+            compiler.load_template(content)
+
+    # String ids beyond the string table.
+    corrupted = bytearray(payload)
+    corrupted[-4:] = b'\xff\xff\xff\x7f'
+    with pytest.raises(compiler.CompileError):
+        compiler.load_template(header + zlib.compress(bytes(corrupted)))
+
+
+def test_load_oversized_template(monkeypatch):
+    compiled = compiler.compile_template(
+        XMLTemplateParser(TEST_TEMPLATE).parse())
+    payload = zlib.decompress(compiled[compiler._HEADER.size:])
+    header = compiled[:compiler._HEADER.size]
+    monkeypatch.setattr(compiler, 'MAX_PAYLOAD_SIZE', 64 * 1024)
+
+    # A payload inflating far beyond its expected size.
+    compressor = zlib.compressobj(9)
+    bomb = compressor.compress(payload)
+    for _ in range(64):
+        bomb += compressor.compress(bytes(1024 * 1024))
+    bomb += compressor.flush()
+    # Nodes whose columns exceed the maximum size.
+    count = compiler.MAX_PAYLOAD_SIZE // compiler._NODE_SIZE + 1
+    oversized = compiler._HEADER.pack(compiler.MAGIC, compiler.VERSION, count)
+    # Strings whose lengths exceed the maximum size.
+    strings = struct.pack('<II', 1, 0xffffffff)
+
+    for content in (header + bomb,
+                    oversized + zlib.compress(payload),
+                    header + zlib.compress(strings)):
+        tracemalloc.start()
+        try:
+            with pytest.raises(compiler.CompileError):
+                compiler.load_template(content)
+            (_, peak) = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert peak < 1024 * 1024
@@ -0,0 +1,46 @@
+import gzip
+
+import pytest
+
+from binalyzer_rest import compression
+
+
+def test_gzip_round_trip():
+    data = bytes(range(256)) * 64
+    chunks = [data[offset:offset + 1000]
+              for offset in range(0, len(data), 1000)]
+
+    compressed = b''.join(compression.compress(chunks, compression.GZIP))
+    assert gzip.decompress(compressed) == data
+
+    decompressed = compression.decompress(
+        [compressed[:10], compressed[10:]], compression.GZIP)
+    assert b''.join(decompressed) == data
+
+
+def test_zstd_round_trip():
+    pytest.importorskip('zstandard')
+    data = bytes(range(256)) * 64
+
+    compressed = b''.join(compression.compress([data], compression.ZSTD))
+    decompressed = compression.decompress([compressed], compression.ZSTD)
+    assert b''.join(decompressed) == data
+
+
+def test_decompress_truncated_data():
+    compressed = gzip.compress(bytes(1024))
+
+    with pytest.raises(ValueError):
+        b''.join(compression.decompress([compressed[:-4]], compression.GZIP))
+
+
+def test_unsupported_encoding():
+    with pytest.raises(compression.UnsupportedEncodingError):
+        compression.compress([b''], 'br')
+
+
+def test_url_encoding():
+    assert compression.url_encoding('http://localhost/a.bin.gz') == 'gzip'
+    assert compression.url_encoding('file:///a.bin.ZST') == 'zstd'
+    assert compression.url_encoding('http://localhost/a.gz/b.bin') is None
+    assert compression.url_encoding('http://localhost/a.bin?b.gz') is None
@@ -0,0 +1,90 @@
+import pytest
+import requests
+
+from binalyzer_rest import deployment
+from binalyzer_rest.deployment import Deployer, MultipartDeployer
+
+
+def _chunks(data, size=1000):
+    for offset in range(0, len(data), size):
+        yield data[offset:offset + size]
+
+
+def test_deploy_put(file_server):
+    data = bytes(range(256)) * 16
+
+    Deployer().deploy(file_server.url + '/a.bin', _chunks(data))
+
+    assert file_server.files['/a.bin'] == data
+    assert [method for (method, _, _) in file_server.requests] == ['PUT']
+
+
+def test_deploy_put_fails_on_unavailable_storage(file_server):
+    file_server.unavailable['/a.bin'] = 1
+
+    with pytest.raises(requests.HTTPError):
+        Deployer().deploy(file_server.url + '/a.bin',
+                          _chunks(bytes(range(256)) * 16))
+
+    assert '/a.bin' not in file_server.files
+    assert [method for (method, _, _) in file_server.requests] == ['PUT']
+
+
+def test_deploy_multipart(file_server):
+    data = bytes(range(256)) * 16
+    deployer = MultipartDeployer(part_size=1024, concurrency=2)
+
+    deployer.deploy(file_server.url + '/a.bin', _chunks(data),
+                    headers={'Content-Type': 'application/octet-stream'})
+
+    assert file_server.files['/a.bin'] == data
+    methods = [method for (method, _, _) in file_server.requests]
+    assert methods == ['POST'] + ['PUT'] * 4 + ['POST']
+    assert file_server.uploads == {}
+
+
+def test_deploy_multipart_single_part(file_server):
+    data = bytes(range(256))
+    deployer = MultipartDeployer(part_size=1024)
+
+    deployer.deploy(file_server.url + '/a.bin', _chunks(data))
+
+    assert file_server.files['/a.bin'] == data
+    assert [(method, path) for (method, path, _) in file_server.requests] == [
+        ('PUT', '/a.bin')]
+
+
+def test_deploy_multipart_retries_corrupted_part(file_server):
+    data = bytes(range(256)) * 16
+    file_server.corrupted_parts[2] = 1
+    deployer = MultipartDeployer(part_size=1024, retries=1)
+
+    deployer.deploy(file_server.url + '/a.bin', _chunks(data))
+
+    assert file_server.files['/a.bin'] == data
+    parts = [path for (method, path, _) in file_server.requests
+             if method == 'PUT' and 'partNumber=2&' in path]
+    assert len(parts) == 2
+
+
+def test_deploy_multipart_aborts_failed_upload(file_server):
+    data = bytes(range(256)) * 16
+    file_server.corrupted_parts[2] = 2
+    deployer = MultipartDeployer(part_size=1024, retries=1)
+
+    with pytest.raises(deployment.DeploymentError):
+        deployer.deploy(file_server.url + '/a.bin', _chunks(data))
+
+    assert '/a.bin' not in file_server.files
+    assert file_server.uploads == {}
+    assert file_server.requests[-1][0] == 'DELETE'
+
+
+def test_deploy_multipart_retries_unavailable_storage(file_server):
+    data = bytes(range(256)) * 16
+    file_server.unavailable['/a.bin'] = 1
+    deployer = MultipartDeployer(part_size=1024, retries=1)
+
+    deployer.deploy(file_server.url + '/a.bin', _chunks(data))
+
+    assert file_server.files['/a.bin'] == data
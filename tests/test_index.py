@@ -0,0 +1,40 @@
+from binalyzer import XMLTemplateParser
+
+from binalyzer_rest import index
+from binalyzer_rest.cache import TemplateCache
+from binalyzer_rest.index import TemplateIndex
+
+
+TEST_TEMPLATE = """
+    <template name="a">
+        <field name="b">
+            <field name="c" size="4"></field>
+        </field>
+        <field name="d">
+            <field name="c" size="8"></field>
+        </field>
+    </template>
+"""
+
+
+def test_find_by_name_and_path():
+    template = XMLTemplateParser(TEST_TEMPLATE).parse()
+    template_index = TemplateIndex(template)
+
+    assert template_index.find('a') is template
+    assert template_index.find('d') is template.d
+    assert template_index.find('c') is template.b.c
+    assert template_index.find('a/d/c') is template.d.c
+    assert template_index.find('/a/b/c') is template.b.c
+    assert template_index.find('e') is None
+    assert template_index.find('a/e/c') is None
+
+
+def test_find_in_clone():
+    template_cache = TemplateCache()
+    template_cache.get_template('http://localhost/a.xml', TEST_TEMPLATE)
+    template = template_cache.get_template('http://localhost/a.xml',
+                                           TEST_TEMPLATE)
+
+    assert index.find(template, 'a/d/c') is template.d.c
+    assert index.find(template.d, 'c') is template.d.c
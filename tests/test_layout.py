@@ -0,0 +1,98 @@
+from anytree import PreOrderIter
+from binalyzer import XMLTemplateParser
+
+from binalyzer_rest.layout import TemplateLayout
+
+
+TEST_TEMPLATE = """
+    <template name="a">
+        <field name="b">
+            <field name="c" size="4"></field>
+        </field>
+        <field name="b">
+            <field name="d" size="2" padding-before="2"></field>
+        </field>
+        <field>
+            <field name="e" size="8"></field>
+        </field>
+    </template>
+"""
+
+
+def test_layout_of_static_template():
+    template = XMLTemplateParser(TEST_TEMPLATE).parse()
+    template_layout = TemplateLayout.from_template(template)
+    nodes = list(PreOrderIter(template))
+
+    assert template_layout.static
+    assert len(template_layout) == len(nodes)
+    assert template_layout.name == 'a'
+    assert list(template_layout.offsets) == [node.absolute_address
+                                             for node in nodes]
+    assert list(template_layout.sizes) == [node.size for node in nodes]
+    assert list(template_layout.leaves()) == [nodes.index(leaf)
+                                              for leaf in template.leaves]
+    assert list(template_layout.children(0)) == [1, 3, 5]
+    assert template_layout.paths() == ['a', 'a/b', 'a/b/c', 'a/b', 'a/b/d',
+                                       None, None]
+    assert template_layout.nbytes == 7 * (3 * 4 + 2 * 8)
+
+
+def test_find_by_name_and_path():
+    template_layout = TemplateLayout.from_template(
+        XMLTemplateParser(TEST_TEMPLATE).parse())
+
+    assert template_layout.find('a') == 0
+    assert template_layout.find('b') == 1
+    assert template_layout.find('d') == 4
+    assert template_layout.find('a/b/d') == 4
+    assert template_layout.find('/a/b/c/') == 2
+    assert template_layout.find('a//e') == 6
+    assert template_layout.find('a/b/e') is None
+    assert template_layout.find('f') is None
+    assert template_layout.find(None) is None
+
+
+def test_find_path_with_colliding_hash():
+    template_layout = TemplateLayout.from_template(
+        XMLTemplateParser(TEST_TEMPLATE).parse())
+    template_layout.find('a/b')
+    template_layout._path_hashes[hash('a/b/d')] = 2
+
+    assert template_layout.find('a/b/d') == 4
+    assert template_layout.find('a/b/c') == 2
+
+
+def test_layout_of_dynamic_template():
+    template = XMLTemplateParser("""
+        <template name="a">
+            <field name="b" size="1"></field>
+            <field name="c" size="{b}"></field>
+        </template>
+    """).parse()
+
+    assert not TemplateLayout.from_template(template).static
+    assert not TemplateLayout.from_template(template, resolve=False).static
+    assert TemplateLayout.from_template(template).find('a/c') == 2
+
+
+def test_split_into_subtrees():
+    template_layout = TemplateLayout.from_template(XMLTemplateParser("""
+        <template name="a">
+            <field name="b"><field name="c" size="1"></field></field>
+            <field name="d" size="2"></field>
+            <field name="e"><field name="f" size="1"></field></field>
+            <field name="g" size="4"></field>
+        </template>
+    """).parse())
+    overlapping_layout = TemplateLayout.from_template(XMLTemplateParser("""
+        <template name="a">
+            <field name="b" size="4"></field>
+            <field name="c" size="4" offset="2"></field>
+        </template>
+    """).parse())
+
+    assert template_layout.split(1) == [[1, 3, 4, 6]]
+    assert template_layout.split(2) == [[1, 3], [4, 6]]
+    assert template_layout.split(8) == [[1], [3], [4], [6]]
+    assert overlapping_layout.split(2) == []
@@ -0,0 +1,111 @@
+import io
+
+import pytest
+
+from binalyzer import Binalyzer, XMLTemplateParser
+
+from binalyzer_rest import utils
+from binalyzer_rest.cache import PlanCache
+from binalyzer_rest.plan import coalesce, compile_plan
+
+
+TEST_SOURCE_TEMPLATE = """
+    <template name="a">
+        <field name="b" size="4" padding-after="2"></field>
+        <field name="c">
+            <field name="d" size="6"></field>
+            <field name="e" size="3"></field>
+        </field>
+        <field name="f" size="5"></field>
+    </template>
+"""
+
+TEST_DESTINATION_TEMPLATES = [
+    TEST_SOURCE_TEMPLATE,
+    """
+    <template name="a">
+        <field name="b" size="2" padding-before="1"></field>
+        <field name="g" size="2"></field>
+        <field name="c">
+            <field name="d" size="8"></field>
+            <field name="e" size="1" padding-after="4"></field>
+        </field>
+    </template>
+    """,
+    """
+    <template name="a">
+        <field name="f" size="5"></field>
+        <field name="e" size="3" offset="16"></field>
+    </template>
+    """,
+]
+
+TEST_DYNAMIC_TEMPLATE = """
+    <template name="a">
+        <field name="b" size="4"></field>
+        <field name="c" size="{b}"></field>
+    </template>
+"""
+
+TEST_DATA = bytes(range(1, 32))
+
+
+def parse(template_text):
+    return XMLTemplateParser(template_text).parse()
+
+
+def transform(source_template_text, destination_template_text, data):
+    source_template = parse(source_template_text)
+    destination_template = parse(destination_template_text)
+    utils.bind_data(source_template, source_template.name, data)
+    Binalyzer().transform(source_template, destination_template)
+    return b''.join(utils.iter_chunks(destination_template))
+
+
+@pytest.mark.parametrize('destination_template_text',
+                         TEST_DESTINATION_TEMPLATES)
+@pytest.mark.parametrize('data', [TEST_DATA, TEST_DATA[:7]])
+def test_plan_matches_transform(destination_template_text, data):
+    transform_plan = compile_plan(parse(TEST_SOURCE_TEMPLATE),
+                                  parse(destination_template_text))
+
+    expected = transform(TEST_SOURCE_TEMPLATE, destination_template_text,
+                         data)
+    assert transform_plan.apply(data) == expected
+    assert transform_plan.apply(io.BytesIO(data)) == expected
+
+
+def test_plan_coalesces_adjacent_copies():
+    transform_plan = compile_plan(parse(TEST_SOURCE_TEMPLATE),
+                                  parse(TEST_SOURCE_TEMPLATE))
+    assert transform_plan.copies == [(0, 0, 4), (6, 6, 14)]
+
+
+def test_coalesce():
+    assert coalesce([(0, 0, 2), (2, 2, 2), (4, 8, 2), (6, 10, 2),
+                     (12, 12, 1)]) == [(0, 0, 4), (4, 8, 4), (12, 12, 1)]
+
+
+def test_plan_of_dynamic_template():
+    assert compile_plan(parse(TEST_DYNAMIC_TEMPLATE),
+                        parse(TEST_SOURCE_TEMPLATE)) is None
+    assert compile_plan(parse(TEST_SOURCE_TEMPLATE),
+                        parse(TEST_DYNAMIC_TEMPLATE)) is None
+
+
+def test_plan_cache_compiles_once(monkeypatch):
+    compiled = []
+
+    def counting_compile_plan(*args):
+        compiled.append(args)
+        return compile_plan(*args)
+
+    monkeypatch.setattr('binalyzer_rest.cache.compile_plan',
+                        counting_compile_plan)
+    plan_cache = PlanCache()
+    for _ in range(2):
+        assert plan_cache.get_plan('a.xml', TEST_SOURCE_TEMPLATE,
+                                   'b.xml', TEST_SOURCE_TEMPLATE)
+        assert plan_cache.get_plan('a.xml', TEST_DYNAMIC_TEMPLATE,
+                                   'b.xml', TEST_SOURCE_TEMPLATE) is None
+    assert len(compiled) == 2
@@ -0,0 +1,64 @@
+import json
+import pytest
+
+from binalyzer_rest import registry
+from binalyzer_rest.cache import digest, template_cache
+from binalyzer_rest.registry import TemplateRegistry
+
+
+TEST_TEMPLATE = """
+    <template name="a">
+        <field name="b" size="8"></field>
+    </template>
+"""
+
+
+def test_load_directory(tmp_path):
+    (tmp_path / 'a.xml').write_text(TEST_TEMPLATE)
+    (tmp_path / 'b.txt').write_text('')
+
+    template_registry = TemplateRegistry.load(str(tmp_path))
+
+    assert list(template_registry.templates) == ['a']
+    assert template_registry.get('a') == (
+        'file://' + str(tmp_path / 'a.xml'), TEST_TEMPLATE)
+
+
+def test_load_config_file(tmp_path):
+    (tmp_path / 'a.xml').write_text(TEST_TEMPLATE)
+    (tmp_path / 'templates.json').write_text(json.dumps({'b': 'a.xml'}))
+
+    template_registry = TemplateRegistry.load(str(tmp_path / 'templates.json'))
+
+    assert template_registry.get('b')[1] == TEST_TEMPLATE
+    with pytest.raises(registry.UnknownTemplateError):
+        template_registry.get('a')
+
+
+def test_warm_up():
+    template_registry = TemplateRegistry({
+        'a': ('http://localhost/warm_up.xml', TEST_TEMPLATE),
+    })
+    assert not template_registry.ready
+
+    template_registry.warm_up()
+
+    assert template_registry.ready
+    assert ('http://localhost/warm_up.xml',
+            digest(TEST_TEMPLATE)) in template_cache
+
+
+def test_warm_up_failure():
+    template_registry = TemplateRegistry({
+        'a': ('http://localhost/warm_up_failure.xml',
+              '<template name="a" size="abc"></template>'),
+        'b': ('http://localhost/warm_up.xml', TEST_TEMPLATE),
+    })
+
+    template_registry.warm_up()
+
+    assert template_registry.ready
+    assert template_registry.failed
+    assert list(template_registry.errors) == ['a']
+    assert ('http://localhost/warm_up.xml',
+            digest(TEST_TEMPLATE)) in template_cache
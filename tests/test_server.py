@@ -1,12 +1,23 @@
 import os
 import io
+import json
+import time
+import gzip
+import base64
 import pytest
 import unittest
 
 from unittest.mock import MagicMock
 
+from binalyzer import Binalyzer, XMLTemplateParser
+
 from binalyzer_rest import rest
-from binalyzer_rest import utils
+from binalyzer_rest import workers
+from binalyzer_rest import jobs
+from binalyzer_rest import registry
+from binalyzer_rest import admission
+from binalyzer_rest import deployment
+from binalyzer_rest import transport
 from binalyzer_rest.rest import flask_app
 
 
@@ -40,7 +51,10 @@ def requests_get_mock(url):
 
 def requests_put_mock(url, data, headers):
     global TEST_RESPONSE_DATA
-    TEST_RESPONSE_DATA = data.read()
+    if isinstance(data, bytes):
+        TEST_RESPONSE_DATA = data
+    else:
+        TEST_RESPONSE_DATA = b''.join(data)
 
 
 def send_file_mock(filename_or_fp, attachment_filename, mimetype):
@@ -57,25 +71,75 @@ def test_client():
 
 @pytest.fixture(scope="module")
 def test_mock(request):
-    requests_get_tmp = utils.requests.get
-    requests_put_tmp = rest.requests.put
+    transport_get_tmp = transport.get
+    transport_open_data_tmp = transport.open_data
+    transport_put_tmp = transport.put
     send_file_tmp = rest.send_file
-    rest.requests.get = requests_get_mock
+    transport.get = requests_get_mock
+    transport.open_data = requests_get_mock
     rest.send_file = send_file_mock
-    rest.requests.put = requests_put_mock
+    transport.put = requests_put_mock
 
     def reset_mock():
-        utils.requests.get = requests_get_tmp
+        transport.get = transport_get_tmp
+        transport.open_data = transport_open_data_tmp
         rest.send_file = send_file_tmp
-        rest.requests.put = requests_put_tmp
+        transport.put = transport_put_tmp
     request.addfinalizer(reset_mock)
 
 
+@pytest.fixture
+def worker_pool(monkeypatch):
+    worker_pool = workers.WorkerPool(processes=1,
+                                     offload=True,
+                                     shared_memory_threshold=0)
+    monkeypatch.setattr(workers, 'worker_pool', worker_pool)
+    yield worker_pool
+    worker_pool.shutdown()
+
+
 def test_route_health(test_client):
     response = test_client.get('/health')
     assert response.status_code == 200
 
 
+def test_route_health_load(test_client, monkeypatch):
+    controller = admission.AdmissionController(max_transforms=4)
+    monkeypatch.setattr(admission, 'controller', controller)
+
+    with controller.admit(16):
+        load = test_client.get('/health').get_json()['load']
+    assert load['transforms'] == 1
+    assert load['bytes'] == 16
+    assert load['max_transforms'] == 4
+
+
+def test_route_health_during_warm_up(test_client, monkeypatch):
+    template_registry = registry.TemplateRegistry({
+        'a': ('http://localhost/a.xml', '<template name="a"></template>'),
+    })
+    monkeypatch.setattr(registry, 'registry', template_registry)
+
+    assert test_client.get('/health').status_code == 503
+    template_registry.warm_up()
+    assert test_client.get('/health').status_code == 200
+
+
+def test_route_health_after_failed_warm_up(test_client, monkeypatch):
+    template_registry = registry.TemplateRegistry({
+        'a': ('http://localhost/a.xml',
+              '<template name="a" size="abc"></template>'),
+    })
+    monkeypatch.setattr(registry, 'registry', template_registry)
+
+    template_registry.warm_up()
+    response = test_client.get('/health')
+
+    assert response.status_code == 503
+    assert response.get_json()['status'] == 'failed'
+    assert list(response.get_json()['errors']) == ['a']
+
+
 def test_route_transform(test_client, test_mock):
     global TEST_SOURCE_TEMPLATE
     global TEST_DESTINATION_TEMPLATE
@@ -412,14 +476,614 @@ def test_transform_return_file_content(test_client, test_mock):
     assert response.status_code == 200
 
 
+def test_transform_server_timing(test_client, test_mock):
+    global TEST_SOURCE_TEMPLATE
+    global TEST_DESTINATION_TEMPLATE
+    global TEST_SOURCE_DATA
+
+    TEST_SOURCE_DATA = bytes([0x11] * 8)
+
+    TEST_SOURCE_TEMPLATE = """
+        <template name="a">
+            <field name="b" size="8"></field>
+        </template>
+    """
+
+    TEST_DESTINATION_TEMPLATE = """
+        <template name="a">
+            <field name="b" size="8"></field>
+        </template>
+    """
+
+    response = test_client.post('/transform', json={
+        'source_template_url': 'http://localhost:8000/download/source_template.xml',
+        'source_binding': [{
+            'template_name': 'a',
+            'data_url': 'http://localhost:8000/download/source_data.bin',
+        }],
+        'destination_template_url': 'http://localhost:8000/download/destination_template.xml',
+        'destination_binding': [],
+        'deployment_url': 'http://localhost:8000/upload/destination_data.bin',
+    })
+
+    stages = [metric.split(';')[0]
+              for metric in response.headers['Server-Timing'].split(', ')]
+    assert {'bind', 'transform', 'deploy'} <= set(stages)
+
+
+def test_transform_result_cache(test_client, test_mock, result_cache):
+    global TEST_SOURCE_TEMPLATE
+    global TEST_DESTINATION_TEMPLATE
+    global TEST_SOURCE_DATA
+
+    TEST_SOURCE_DATA = bytes([0x11] * 8) + bytes([0x22] * 8)
+
+    TEST_SOURCE_TEMPLATE = """
+        <template name="a">
+            <field name="b" size="8"></field>
+            <field name="c" size="8"></field>
+        </template>
+    """
+
+    TEST_DESTINATION_TEMPLATE = """
+        <template name="a">
+            <field name="c" size="8"></field>
+        </template>
+    """
+
+    params = {
+        'source_template_url': 'http://localhost:8000/download/source_template.xml',
+        'source_binding': [{
+            'template_name': 'a',
+            'data_url': 'http://localhost:8000/download/source_data.bin',
+        }],
+        'destination_template_url': 'http://localhost:8000/download/destination_template.xml',
+        'destination_binding': [],
+        'deployment_url': None,
+    }
+
+    first = test_client.post('/transform', json=params)
+    second = test_client.post('/transform', json=params)
+
+    assert first.data == second.data == bytes([0x22] * 8)
+    assert (result_cache.hits, result_cache.misses) == (1, 1)
+    stages = [metric.split(';')[0]
+              for metric in second.headers['Server-Timing'].split(', ')]
+    assert 'transform' not in stages
+
+    TEST_SOURCE_DATA = bytes([0x33] * 16)
+    third = test_client.post('/transform', json=params)
+
+    assert third.data == bytes([0x33] * 8)
+    assert result_cache.misses == 2
+
+
+def test_transform_registered_templates(test_client, test_mock,
+                                       monkeypatch):
+    global TEST_SOURCE_DATA
+
+    TEST_SOURCE_DATA = bytes([0x11] * 8) + bytes([0x22] * 8)
+
+    monkeypatch.setattr(registry, 'registry', registry.TemplateRegistry({
+        'source': ('file:///source.xml', """
+            <template name="a">
+                <field name="b" size="8"></field>
+                <field name="c" size="8"></field>
+            </template>
+        """),
+        'destination': ('file:///destination.xml', """
+            <template name="a">
+                <field name="c" size="8"></field>
+            </template>
+        """),
+    }))
+
+    response = test_client.post('/transform', json={
+        'source_template': 'source',
+        'source_binding': [{
+            'template_name': 'a',
+            'data_url': 'http://localhost:8000/download/source_data.bin',
+        }],
+        'destination_template': 'destination',
+    })
+
+    assert response.status_code == 200
+    assert response.data == bytes([0x22] * 8)
+
+    response = test_client.post('/transform', json={
+        'source_template': 'unknown',
+        'destination_template': 'destination',
+    })
+
+    assert response.status_code == 400
+
+
+def test_route_metrics(test_client, test_mock):
+    response = test_client.get('/metrics')
+    metrics = response.data.decode('utf-8')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert 'binalyzer_stage_duration_seconds_count{stage="transform"}' in metrics
+    assert 'binalyzer_transferred_bytes_total{direction="deployed"}' in metrics
+    assert 'binalyzer_template_cache_hits_total' in metrics
+
+
+def test_worker_process_transport_configuration(tmp_path, monkeypatch):
+    monkeypatch.setattr(transport, '_transport', transport.Transport(
+        pool_size=2, timeout=7, retries=5, cache_dir=str(tmp_path)))
+    worker_pool = workers.WorkerPool(processes=1)
+    try:
+        options = worker_pool.submit(transport.options).result()
+    finally:
+        worker_pool.shutdown()
+
+    assert options == transport.options()
+    assert (options['timeout'], options['retries']) == (7, 5)
+
+
+def test_transform_in_worker_process(test_client, test_mock, worker_pool):
+    global TEST_SOURCE_TEMPLATE
+    global TEST_DESTINATION_TEMPLATE
+    global TEST_SOURCE_DATA
+
+    TEST_SOURCE_DATA = (bytes([0x11] * 8) +
+                        bytes([0x22] * 8))
+
+    TEST_SOURCE_TEMPLATE = """
+        <template name="a">
+            <field name="b" size="8"></field>
+            <field name="c" size="8"></field>
+        </template>
+    """
+
+    TEST_DESTINATION_TEMPLATE = """
+        <template name="a">
+            <field name="c" size="8"></field>
+            <field name="d" size="8"></field>
+        </template>
+    """
+
+    expected_bytes = (bytes([0x22] * 8) +
+                      bytes([0x00] * 8))
+
+    params = {
+        'source_template_url': 'http://localhost:8000/download/source_template.xml',
+        'source_binding': [{
+            'template_name': 'a',
+            'data_url': 'http://localhost:8000/download/source_data.bin',
+        }],
+        'destination_template_url': 'http://localhost:8000/download/destination_template.xml',
+        'destination_binding': [],
+        'deployment_url': None,
+    }
+
+    response = test_client.post('/transform', json=params)
+    assert response.data == expected_bytes
+
+    response = test_client.post('/transform', json=dict(
+        params, deployment_url='http://localhost:8000/upload/destination_data.bin'))
+    assert TEST_RESPONSE_DATA == expected_bytes
+    assert response.status_code == 200
+
+
+def test_transform_batch(test_client, test_mock):
+    global TEST_SOURCE_TEMPLATE
+    global TEST_DESTINATION_TEMPLATE
+    global TEST_SOURCE_DATA
+
+    TEST_SOURCE_DATA = (bytes([0x11] * 8) +
+                        bytes([0x22] * 8))
+
+    TEST_SOURCE_TEMPLATE = """
+        <template name="a">
+            <field name="b" size="8"></field>
+            <field name="c" size="8"></field>
+        </template>
+    """
+
+    TEST_DESTINATION_TEMPLATE = """
+        <template name="a">
+            <field name="c" size="8"></field>
+            <field name="d" size="8"></field>
+        </template>
+    """
+
+    expected_bytes = (bytes([0x22] * 8) +
+                      bytes([0x00] * 8))
+
+    item = {
+        'source_binding': [{
+            'template_name': 'a',
+            'data_url': 'http://localhost:8000/download/source_data.bin',
+        }],
+        'destination_binding': [],
+    }
+
+    response = test_client.post('/transform/batch', json={
+        'source_template_url': 'http://localhost:8000/download/source_template.xml',
+        'destination_template_url': 'http://localhost:8000/download/destination_template.xml',
+        'items': [
+            dict(item, deployment_url='http://localhost:8000/upload/destination_data.bin'),
+            item,
+            dict(item, source_binding=[{
+                'template_name': 'a',
+                'data_url': 'http://localhost:8000/download/unknown.bin',
+            }]),
+        ],
+    })
+
+    (deployed, returned, failed) = response.get_json()['items']
+    assert response.status_code == 200
+    assert deployed['status'] == 'succeeded'
+    assert TEST_RESPONSE_DATA == expected_bytes
+    assert returned['status'] == 'succeeded'
+    assert base64.b64decode(returned['data']) == expected_bytes
+    assert failed['status'] == 'failed'
+
+
+def test_transform_batch_ndjson(test_client, test_mock):
+    global TEST_SOURCE_TEMPLATE
+    global TEST_DESTINATION_TEMPLATE
+    global TEST_SOURCE_DATA
+
+    TEST_SOURCE_DATA = bytes([0x11] * 8)
+
+    TEST_SOURCE_TEMPLATE = """
+        <template name="a">
+            <field name="b" size="8"></field>
+        </template>
+    """
+
+    TEST_DESTINATION_TEMPLATE = """
+        <template name="a">
+            <field name="b" size="8"></field>
+        </template>
+    """
+
+    item = {
+        'source_binding': [{
+            'template_name': 'a',
+            'data_url': 'http://localhost:8000/download/source_data.bin',
+        }],
+    }
+
+    response = test_client.post('/transform/batch', json={
+        'source_template_url': 'http://localhost:8000/download/source_template.xml',
+        'destination_template_url': 'http://localhost:8000/download/destination_template.xml',
+        'items': [item, item],
+    }, headers={'Accept': 'application/x-ndjson'})
+
+    lines = [json.loads(line) for line in response.data.splitlines()]
+    assert response.mimetype == 'application/x-ndjson'
+    assert sorted(line['index'] for line in lines) == [0, 1]
+    assert all(base64.b64decode(line['data']) == TEST_SOURCE_DATA
+               for line in lines)
+
+
+def wait_for_job(test_client, status_url):
+    for _ in range(100):
+        status = test_client.get(status_url).get_json()
+        if status['status'] in ('succeeded', 'failed'):
+            return status
+        time.sleep(0.05)
+    raise TimeoutError()
+
+
+@pytest.fixture
+def http_transport(monkeypatch):
+    client = transport.Transport()
+    monkeypatch.setattr(transport, 'get', client.get)
+    monkeypatch.setattr(transport, 'open_data', client.open_data)
+    monkeypatch.setattr(transport, 'get_range', client.get_range)
+    monkeypatch.setattr(transport, 'content_length', client.content_length)
+    monkeypatch.setattr(transport, 'put', client.put)
+    monkeypatch.setattr(transport, 'post', client.post)
+    monkeypatch.setattr(transport, 'delete', client.delete)
+
+
+EXTRACT_TEMPLATE = """
+    <template name="a">
+        <field name="b" size="8"></field>
+        <field name="c" size="8"></field>
+        <field name="d" size="131072"></field>
+        <field name="e" size="8"></field>
+    </template>
+"""
+
+
+def test_extract(test_client, file_server, http_transport):
+    file_server.files['/a.xml'] = EXTRACT_TEMPLATE.encode('utf-8')
+    file_server.files['/a.bin'] = (bytes([0x11] * 8) + bytes([0x22] * 8) +
+                                   bytes(131072) + bytes([0x33] * 8))
+
+    response = test_client.post('/extract', json={
+        'template_url': file_server.url + '/a.xml',
+        'data_url': file_server.url + '/a.bin',
+        'fields': ['c', 'a/e'],
+    })
+
+    assert response.status_code == 200
+    assert response.get_json()['fields'] == [
+        {'name': 'c', 'offset': 8, 'size': 8,
+         'data': base64.b64encode(bytes([0x22] * 8)).decode('ascii')},
+        {'name': 'a/e', 'offset': 131088, 'size': 8,
+         'data': base64.b64encode(bytes([0x33] * 8)).decode('ascii')},
+    ]
+    ranges = [headers.get('Range') for (method, path, headers)
+              in file_server.requests if path == '/a.bin' and method == 'GET']
+    assert ranges == ['bytes=0-65535', 'bytes=131072-131095']
+
+
+def test_extract_multipart(test_client, file_server, http_transport):
+    file_server.files['/a.xml'] = EXTRACT_TEMPLATE.encode('utf-8')
+    file_server.files['/a.bin'] = (bytes([0x11] * 8) + bytes([0x22] * 8) +
+                                   bytes(131072) + bytes([0x33] * 8))
+
+    response = test_client.post('/extract', json={
+        'template_url': file_server.url + '/a.xml',
+        'data_url': file_server.url + '/a.bin',
+        'fields': ['b', 'e'],
+    }, headers={'Accept': 'multipart/mixed'})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'multipart/mixed'
+    boundary = response.mimetype_params['boundary'].encode('ascii')
+    parts = response.data.split(b'--' + boundary)
+    assert len(parts) == 4
+    assert parts[1].endswith(b'\r\n\r\n' + bytes([0x11] * 8) + b'\r\n')
+    assert b'Content-Range: bytes 131088-131095/131096' in parts[2]
+    assert parts[2].endswith(b'\r\n\r\n' + bytes([0x33] * 8) + b'\r\n')
+
+
+def test_extract_unknown_field(test_client, file_server, http_transport):
+    file_server.files['/a.xml'] = EXTRACT_TEMPLATE.encode('utf-8')
+    file_server.files['/a.bin'] = bytes(131096)
+
+    response = test_client.post('/extract', json={
+        'template_url': file_server.url + '/a.xml',
+        'data_url': file_server.url + '/a.bin',
+        'fields': ['f'],
+    })
+
+    assert response.status_code == 400
+
+
+def test_jobs_transform_return_file_content(test_client, test_mock):
+    global TEST_SOURCE_TEMPLATE
+    global TEST_DESTINATION_TEMPLATE
+    global TEST_SOURCE_DATA
+
+    TEST_SOURCE_DATA = (bytes([0x11] * 8) +
+                        bytes([0x22] * 8))
+
+    TEST_SOURCE_TEMPLATE = """
+        <template name="a">
+            <field name="b" size="8"></field>
+            <field name="c" size="8"></field>
+        </template>
+    """
+
+    TEST_DESTINATION_TEMPLATE = """
+        <template name="a">
+            <field name="c" size="8"></field>
+            <field name="d" size="8"></field>
+        </template>
+    """
+
+    expected_bytes = (bytes([0x22] * 8) +
+                      bytes([0x00] * 8))
+
+    response = test_client.post('/jobs/transform', json={
+        'source_template_url': 'http://localhost:8000/download/source_template.xml',
+        'source_binding': [{
+            'template_name': 'a',
+            'data_url': 'http://localhost:8000/download/source_data.bin',
+        }],
+        'destination_template_url': 'http://localhost:8000/download/destination_template.xml',
+        'destination_binding': [],
+        'deployment_url': None,
+    })
+
+    assert response.status_code == 202
+    status = wait_for_job(test_client, response.headers['Location'])
+    assert status['status'] == 'succeeded'
+    assert status['run_time'] is not None
+
+    response = test_client.get(status['result_url'])
+    assert response.data == expected_bytes
+
+
+def test_jobs_transform_failure(test_client, test_mock):
+    response = test_client.post('/jobs/transform', json={
+        'source_template_url': 'http://localhost:8000/download/unknown.xml',
+        'destination_template_url': 'http://localhost:8000/download/destination_template.xml',
+    })
+
+    assert response.status_code == 202
+    status = wait_for_job(test_client, response.headers['Location'])
+    assert status['status'] == 'failed'
+    assert 'result_url' not in status
+
+
+def test_jobs_unknown_job(test_client):
+    response = test_client.get('/jobs/unknown')
+    assert response.status_code == 404
+
+
+def test_jobs_transform_drops_results_beyond_size(test_client, file_server,
+                                                  http_transport,
+                                                  monkeypatch):
+    file_server.files['/a.xml'] = (
+        b'<template name="a"><field name="b" size="8"></field></template>')
+    monkeypatch.setattr(jobs, 'job_queue', jobs.JobQueue(max_result_size=12))
+    params = {
+        'source_template_url': file_server.url + '/a.xml',
+        'source_binding': [],
+        'destination_template_url': file_server.url + '/a.xml',
+        'destination_binding': [],
+    }
+
+    locations = []
+    for _ in range(2):
+        response = test_client.post('/jobs/transform', json=params)
+        assert response.status_code == 202
+        locations.append(response.headers['Location'])
+        assert wait_for_job(test_client,
+                            locations[-1])['status'] == 'succeeded'
+
+    first = test_client.get(locations[0]).get_json()
+    assert 'result_url' not in first
+    response = test_client.get(locations[0] + '/result')
+    assert response.status_code == 404
+    second = test_client.get(locations[1]).get_json()
+    assert test_client.get(second['result_url']).data == bytes(8)
+
+    monkeypatch.setattr(jobs, 'job_queue', jobs.JobQueue(max_result_size=4))
+    response = test_client.post('/jobs/transform', json=params)
+    status = wait_for_job(test_client, response.headers['Location'])
+    assert status['status'] == 'failed'
+    assert 'result_url' not in status
+
+
+def test_jobs_transform_admission(test_client, file_server, http_transport,
+                                  monkeypatch):
+    file_server.files['/a.xml'] = (
+        b'<template name="a"><field name="b" size="16"></field></template>')
+    file_server.files['/a.bin'] = bytes(16)
+    controller = admission.AdmissionController(max_bytes=16, max_wait=0)
+    monkeypatch.setattr(admission, 'controller', controller)
+    params = {
+        'source_template_url': file_server.url + '/a.xml',
+        'source_binding': [{
+            'template_name': 'a',
+            'data_url': file_server.url + '/a.bin',
+        }],
+        'destination_template_url': file_server.url + '/a.xml',
+        'destination_binding': [],
+    }
+
+    with controller.admit(16):
+        response = test_client.post('/jobs/transform', json=params)
+        status = wait_for_job(test_client, response.headers['Location'])
+    assert status['status'] == 'failed'
+    assert status['error'] == 'Timed out waiting for admission.'
+
+    response = test_client.post('/jobs/transform', json=params)
+    status = wait_for_job(test_client, response.headers['Location'])
+    assert status['status'] == 'succeeded'
+    assert controller.bytes == 0
+
+
+def test_jobs_transform_rejects_destinations(test_client):
+    response = test_client.post('/jobs/transform', json={
+        'source_template_url': 'http://localhost:8000/source.xml',
+        'destinations': [{
+            'destination_template_url': 'http://localhost:8000/a.xml',
+        }],
+    })
+    assert response.status_code == 400
+
+
 @pytest.mark.skip()
 def test_transform_single_source_template_single_destination_template():
     pass
 
 
-@pytest.mark.skip()
-def test_transform_single_source_template_multiple_destination_templates():
-    pass
+SPLIT_SOURCE_TEMPLATE = """
+    <template name="a">
+        <field name="n" size="1"></field>
+        <field name="g0">
+            <field name="x" size="{n}"></field>
+            <field name="y" size="4"></field>
+        </field>
+        <field name="g1">
+            <field name="x" size="{n}"></field>
+            <field name="y" size="4"></field>
+        </field>
+        <field name="g2">
+            <field name="x" size="{n}"></field>
+        </field>
+    </template>
+"""
+
+SPLIT_DESTINATION_TEMPLATE = """
+    <template name="a">
+        <field name="g0">
+            <field name="x" size="4"></field>
+            <field name="y" size="2"></field>
+        </field>
+        <field name="g1">
+            <field name="y" size="4"></field>
+            <field name="z" size="4"></field>
+        </field>
+        <field name="g2">
+            <field name="x" size="2" padding-before="2"></field>
+        </field>
+    </template>
+"""
+
+
+@pytest.mark.parametrize('offload', [False, True])
+def test_transform_single_source_template_multiple_destination_templates(
+        test_client, file_server, http_transport, monkeypatch, offload):
+    worker_pool = workers.WorkerPool(processes=2, offload=offload,
+                                     shared_memory_threshold=0)
+    monkeypatch.setattr(workers, 'worker_pool', worker_pool)
+    file_server.files['/a.xml'] = SPLIT_SOURCE_TEMPLATE.encode('utf-8')
+    file_server.files['/b.xml'] = SPLIT_DESTINATION_TEMPLATE.encode('utf-8')
+    file_server.files['/c.xml'] = EXTRACT_TEMPLATE.encode('utf-8')
+    file_server.files['/a.bin'] = bytes([3]) + bytes(range(1, 18))
+    file_server.files['/c.bin'] = bytes([0x11] * 8)
+
+    expected = []
+    for (destination_template, destination_data) in (
+            (SPLIT_DESTINATION_TEMPLATE, None),
+            (EXTRACT_TEMPLATE, file_server.files['/c.bin'])):
+        source_template = XMLTemplateParser(SPLIT_SOURCE_TEMPLATE).parse()
+        destination_template = XMLTemplateParser(
+            destination_template).parse()
+        source_template.value = file_server.files['/a.bin']
+        Binalyzer().transform(source_template, destination_template)
+        if destination_data:
+            destination_template.e.value = destination_data
+        expected.append(destination_template.value)
+
+    try:
+        response = test_client.post('/transform', json={
+            'source_template_url': file_server.url + '/a.xml',
+            'source_binding': [{
+                'template_name': 'a',
+                'data_url': file_server.url + '/a.bin',
+            }],
+            'destinations': [{
+                'destination_template_url': file_server.url + '/b.xml',
+                'deployment_url': file_server.url + '/b.bin',
+            }, {
+                'destination_template_url': file_server.url + '/c.xml',
+                'destination_binding': [{
+                    'template_name': 'e',
+                    'data_url': file_server.url + '/c.bin',
+                }],
+            }, {
+                'destination_template_url': file_server.url + '/c.xml',
+                'destination_binding': [{
+                    'template_name': 'e',
+                    'data_url': file_server.url + '/d.bin',
+                }],
+            }],
+        })
+    finally:
+        worker_pool.shutdown()
+
+    assert response.status_code == 200
+    destinations = response.get_json()['destinations']
+    assert [destination['status'] for destination in destinations] == [
+        'succeeded', 'succeeded', 'failed']
+    assert file_server.files['/b.bin'] == expected[0]
+    assert base64.b64decode(destinations[1]['data']) == expected[1]
+    assert len([path for (method, path, _) in file_server.requests
+                if method == 'GET' and path == '/a.bin']) == 1
 
 
 @pytest.mark.skip()
@@ -430,3 +1094,170 @@ def test_transform_multiple_source_templates_multiple_destination_templates():
 @pytest.mark.skip()
 def test_transform_multiple_source_templates_single_destination_templates():
     pass
+
+
+def test_transform_multipart_deployment(test_client, file_server,
+                                        http_transport, monkeypatch):
+    monkeypatch.setattr(deployment, 'deployer',
+                        deployment.MultipartDeployer(part_size=32768))
+    file_server.files['/a.xml'] = EXTRACT_TEMPLATE.encode('utf-8')
+    file_server.files['/a.bin'] = bytes(range(256)) * 512 + bytes(24)
+
+    response = test_client.post('/transform', json={
+        'source_template_url': file_server.url + '/a.xml',
+        'destination_template_url': file_server.url + '/a.xml',
+        'source_binding': [{
+            'template_name': 'a',
+            'data_url': file_server.url + '/a.bin',
+        }],
+        'deployment_url': file_server.url + '/b.bin',
+    })
+
+    assert response.status_code == 200
+    assert file_server.files['/b.bin'] == file_server.files['/a.bin']
+    parts = [path for (method, path, _) in file_server.requests
+             if method == 'PUT' and path.startswith('/b.bin?partNumber=')]
+    assert len(parts) == 5
+
+
+def test_transform_result_cache_of_local_data(test_client, tmp_path,
+                                              monkeypatch, result_cache):
+    client = transport.Transport(local_root=str(tmp_path))
+    monkeypatch.setattr(transport, 'get', client.get)
+    monkeypatch.setattr(transport, 'open_data', client.open_data)
+    (tmp_path / 'a.xml').write_text(EXTRACT_TEMPLATE)
+    (tmp_path / 'a.bin').write_bytes(bytes(131096))
+    params = {
+        'source_template_url': 'file:a.xml',
+        'source_binding': [{
+            'template_name': 'a',
+            'data_url': 'file:a.bin',
+        }],
+        'destination_template_url': 'file:a.xml',
+    }
+
+    assert test_client.post('/transform', json=params).data == bytes(131096)
+    assert test_client.post('/transform', json=params).data == bytes(131096)
+    assert (result_cache.hits, result_cache.misses) == (1, 1)
+
+    # Local files are identified by their metadata, not by their content.
+    (tmp_path / 'a.bin').write_bytes(bytes([0x11] * 131104))
+    response = test_client.post('/transform', json=params)
+    assert response.data == bytes([0x11] * 131096)
+    assert result_cache.misses == 2
+
+
+def test_transform_admission(test_client, file_server, http_transport,
+                             monkeypatch):
+    file_server.files['/a.xml'] = EXTRACT_TEMPLATE.encode('utf-8')
+    file_server.files['/a.bin'] = bytes(131096)
+    controller = admission.AdmissionController(max_bytes=131096, max_wait=0,
+                                               retry_after=3)
+    monkeypatch.setattr(admission, 'controller', controller)
+    params = {
+        'source_template_url': file_server.url + '/a.xml',
+        'source_binding': [{
+            'template_name': 'a',
+            'data_url': file_server.url + '/a.bin',
+        }],
+        'destination_template_url': file_server.url + '/a.xml',
+    }
+
+    with controller.admit(1):
+        response = test_client.post('/transform', json=params)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '3'
+    assert ('GET', '/a.bin') not in [(method, path) for (method, path, _)
+                                     in file_server.requests]
+
+    del file_server.requests[:]
+    response = test_client.post('/transform', json=params)
+    assert response.status_code == 200
+    assert response.data == bytes(131096)
+    response.close()
+    assert controller.load()['transforms'] == 0
+    assert [method for (method, path, _) in file_server.requests
+            if path == '/a.bin'].count('HEAD') == 1
+
+
+def test_transform_compressed(test_client, file_server, http_transport):
+    file_server.files['/a.xml'] = EXTRACT_TEMPLATE.encode('utf-8')
+    file_server.files['/a.bin.gz'] = gzip.compress(bytes([0x11] * 131096))
+    params = {
+        'source_template_url': file_server.url + '/a.xml',
+        'source_binding': [{
+            'template_name': 'a',
+            'data_url': file_server.url + '/a.bin.gz',
+        }],
+        'destination_template_url': file_server.url + '/a.xml',
+    }
+
+    response = test_client.post('/transform', json=params,
+                                headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == bytes([0x11] * 131096)
+
+    params['deployment_url'] = file_server.url + '/b.bin'
+    params['deployment_encoding'] = 'gzip'
+    response = test_client.post('/transform', json=params)
+    assert response.status_code == 200
+    (_, _, headers) = file_server.requests[-1]
+    assert headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(file_server.files['/b.bin']) == bytes([0x11] * 131096)
+
+
+def test_transform_compiled_template(test_client, file_server,
+                                     http_transport):
+    file_server.files['/a.xml'] = EXTRACT_TEMPLATE.encode('utf-8')
+    file_server.files['/a.bin'] = bytes([0x11] * 131096)
+
+    response = test_client.post('/compile', json={
+        'template_url': file_server.url + '/a.xml',
+    })
+    assert response.status_code == 200
+    assert response.data.startswith(b'BNLZTPL\0')
+
+    file_server.files['/a.template'] = response.data
+    response = test_client.post('/transform', json={
+        'source_template_url': file_server.url + '/a.template',
+        'source_binding': [{
+            'template_name': 'a',
+            'data_url': file_server.url + '/a.bin',
+        }],
+        'destination_template_url': file_server.url + '/a.xml',
+    })
+    assert response.status_code == 200
+    assert response.data == bytes([0x11] * 131096)
+
+
+def test_transform_split_into_subtrees(test_client, file_server,
+                                       http_transport, monkeypatch):
+    worker_pool = workers.WorkerPool(processes=2, split=True,
+                                     shared_memory_threshold=0)
+    monkeypatch.setattr(workers, 'worker_pool', worker_pool)
+    file_server.files['/a.xml'] = SPLIT_SOURCE_TEMPLATE.encode('utf-8')
+    file_server.files['/b.xml'] = SPLIT_DESTINATION_TEMPLATE.encode('utf-8')
+    file_server.files['/a.bin'] = bytes([3]) + bytes(range(1, 18))
+
+    source_template = XMLTemplateParser(SPLIT_SOURCE_TEMPLATE).parse()
+    destination_template = XMLTemplateParser(
+        SPLIT_DESTINATION_TEMPLATE).parse()
+    source_template.value = file_server.files['/a.bin']
+    Binalyzer().transform(source_template, destination_template)
+
+    try:
+        response = test_client.post('/transform', json={
+            'source_template_url': file_server.url + '/a.xml',
+            'source_binding': [{
+                'template_name': 'a',
+                'data_url': file_server.url + '/a.bin',
+            }],
+            'destination_template_url': file_server.url + '/b.xml',
+        })
+    finally:
+        worker_pool.shutdown()
+
+    assert response.status_code == 200
+    assert 'worker;' in response.headers['Server-Timing']
+    assert response.data == destination_template.value
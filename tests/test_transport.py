@@ -0,0 +1,142 @@
+import gzip
+import time
+import pytest
+
+from binalyzer_rest import transport
+from binalyzer_rest.transport import Transport
+
+
+def test_get_reuses_pooled_connection(file_server):
+    file_server.files['/a.bin'] = bytes([0x11] * 8)
+    client = Transport(pool_size=1)
+    assert client.get(file_server.url + '/a.bin').content == bytes([0x11] * 8)
+    assert client.get(file_server.url + '/a.bin').content == bytes([0x11] * 8)
+    assert len(file_server.requests) == 2
+
+
+def test_get_revalidates_cached_response(file_server, tmp_path):
+    file_server.files['/a.bin'] = bytes([0x11] * 8)
+    client = Transport(cache_dir=str(tmp_path))
+
+    client.get(file_server.url + '/a.bin')
+    response = client.get(file_server.url + '/a.bin')
+
+    (_, _, headers) = file_server.requests[-1]
+    assert 'If-None-Match' in headers
+    assert response.status_code == 200
+    assert response.content == bytes([0x11] * 8)
+
+
+def test_get_fetches_changed_content(file_server, tmp_path):
+    file_server.files['/a.bin'] = bytes([0x11] * 8)
+    client = Transport(cache_dir=str(tmp_path))
+
+    client.get(file_server.url + '/a.bin')
+    file_server.files['/a.bin'] = bytes([0x22] * 8)
+
+    assert client.get(file_server.url + '/a.bin').content == bytes([0x22] * 8)
+
+
+def test_put(file_server):
+    client = Transport()
+    client.put(file_server.url + '/b.bin', data=bytes([0x33] * 4))
+    assert file_server.files['/b.bin'] == bytes([0x33] * 4)
+
+
+def test_open_data_fetches_ranges(file_server):
+    file_server.files['/a.bin'] = bytes(range(256)) * 4
+    client = Transport()
+    data = client.open_data(file_server.url + '/a.bin')
+
+    assert isinstance(data, transport.RemoteData)
+    assert len(data) == 1024
+    assert [method for (method, _, _) in file_server.requests] == ['HEAD']
+
+    data.block_size = 256
+    data.seek(260)
+    assert data.read(4) == bytes([4, 5, 6, 7])
+    data.seek(0)
+    assert data.read(8) == bytes(range(8))
+    data.seek(252)
+    assert data.read(8) == bytes([252, 253, 254, 255, 0, 1, 2, 3])
+
+    ranges = [headers['Range'] for (method, _, headers)
+              in file_server.requests if method == 'GET']
+    assert ranges == ['bytes=256-511', 'bytes=0-255']
+
+
+def test_open_data_fails_on_changed_content(file_server, monkeypatch):
+    file_server.files['/a.bin'] = bytes([0x11] * 8)
+    monkeypatch.setattr(transport, '_transport', Transport(retries=0))
+    data = transport.open_data(file_server.url + '/a.bin')
+    file_server.files['/a.bin'] = bytes([0x22] * 8)
+
+    with pytest.raises(Exception):
+        data.read()
+
+
+def test_fetcher_fetches_concurrently(monkeypatch):
+    def slow_get(url):
+        time.sleep(0.2)
+        return url
+
+    monkeypatch.setattr(transport, 'get', slow_get)
+    urls = ['http://localhost/{}.bin'.format(i) for i in range(4)]
+
+    start = time.monotonic()
+    with transport.Fetcher(max_workers=4) as fetcher:
+        fetcher.prefetch(urls + urls)
+        assert [fetcher.get(url) for url in urls] == urls
+    assert time.monotonic() - start < 0.6
+
+
+def test_get_local_file(tmp_path):
+    (tmp_path / 'a.bin').write_bytes(bytes([0x11] * 8))
+    client = Transport(local_root=str(tmp_path))
+
+    absolute = client.get((tmp_path / 'a.bin').as_uri())
+    relative = client.get('file:a.bin')
+
+    assert absolute.content == bytes([0x11] * 8)
+    assert relative.buffer[:4] == bytes([0x11] * 4)
+
+
+def test_get_local_file_outside_of_local_root(tmp_path):
+    (tmp_path / 'a.bin').write_bytes(bytes([0x11] * 8))
+    (tmp_path / 'root').mkdir()
+
+    with pytest.raises(PermissionError):
+        Transport().get((tmp_path / 'a.bin').as_uri())
+    with pytest.raises(PermissionError):
+        Transport(local_root=str(tmp_path / 'root')).get('file:../a.bin')
+
+
+def test_open_data_decodes_encoded_response(file_server):
+    file_server.files['/a.bin'] = bytes(range(256)) * 4
+    file_server.encoded.add('/a.bin')
+    client = Transport()
+    data = client.open_data(file_server.url + '/a.bin')
+
+    assert not isinstance(data, transport.RemoteData)
+    assert data.content == bytes(range(256)) * 4
+    (_, _, headers) = file_server.requests[-1]
+    assert 'gzip' in headers['Accept-Encoding']
+
+
+def test_open_data_decompresses_compressed_file(file_server):
+    file_server.files['/a.bin.gz'] = gzip.compress(bytes(range(256)) * 1024)
+    client = Transport()
+    data = client.open_data(file_server.url + '/a.bin.gz')
+
+    assert isinstance(data, transport.DecompressedResource)
+    assert data.buffer[:] == bytes(range(256)) * 1024
+    assert [method for (method, _, _) in file_server.requests] == ['GET']
+
+
+def test_get_decompresses_compressed_file(tmp_path):
+    (tmp_path / 'a.xml.gz').write_bytes(
+        gzip.compress(b'<template name="a"></template>'))
+    client = Transport(local_root=str(tmp_path))
+
+    template = client.get('file:a.xml.gz')
+    assert template.text == '<template name="a"></template>'
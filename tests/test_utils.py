@@ -0,0 +1,104 @@
+import mmap
+
+from binalyzer import XMLTemplateParser
+
+from binalyzer_rest import utils
+from binalyzer_rest import transport
+
+
+def test_iter_chunks_matches_value():
+    template = XMLTemplateParser("""
+        <template name="a">
+            <field name="b" size="5"></field>
+            <field name="c" offset="0x10" size="7"></field>
+            <field name="d" size="3"></field>
+        </template>
+    """).parse()
+    template.value = bytes(range(template.size))
+
+    chunks = list(utils.iter_chunks(template, chunk_size=4))
+
+    assert all(len(chunk) <= 4 for chunk in chunks)
+    assert b''.join(chunks) == template.value
+
+
+def test_iter_chunks_fills_gaps_with_zeros():
+    template = XMLTemplateParser("""
+        <template name="a">
+            <field name="b" size="2"></field>
+            <field name="c" offset="0x8" size="2"></field>
+        </template>
+    """).parse()
+    template.b.value = bytes([0x11] * 2)
+    template.c.value = bytes([0x22] * 2)
+
+    assert b''.join(utils.iter_chunks(template, chunk_size=3)) == (
+        bytes([0x11] * 2) + bytes(6) + bytes([0x22] * 2))
+
+
+def test_bind_local_data_without_copy(tmp_path, monkeypatch):
+    (tmp_path / 'a.bin').write_bytes(bytes([0x11] * 8) + bytes([0x22] * 8))
+    monkeypatch.setattr(transport, '_transport',
+                        transport.Transport(local_root=str(tmp_path)))
+    template = XMLTemplateParser("""
+        <template name="a">
+            <field name="b" size="8"></field>
+            <field name="c" size="8"></field>
+        </template>
+    """).parse()
+
+    utils.bind_data_to_template(template, [{
+        'template_name': 'a',
+        'data_url': 'file:a.bin',
+    }])
+
+    assert isinstance(template.binding_context.data, mmap.mmap)
+    assert template.c.value == bytes([0x22] * 8)
+
+
+def test_bind_remote_data_lazily(file_server, monkeypatch):
+    file_server.files['/a.bin'] = bytes([0x11] * 8) + bytes([0x22] * 8)
+    file_server.files['/c.bin'] = bytes([0x33] * 4) + bytes([0x44] * 4)
+    monkeypatch.setattr(transport, '_transport', transport.Transport())
+    template = XMLTemplateParser("""
+        <template name="a">
+            <field name="b" size="8"></field>
+            <field name="c">
+                <field name="d" size="4"></field>
+                <field name="e" size="4"></field>
+            </field>
+        </template>
+    """).parse()
+
+    utils.bind_data_to_template(template, [{
+        'template_name': 'c',
+        'data_url': file_server.url + '/c.bin',
+    }])
+
+    assert [method for (method, _, _) in file_server.requests] == ['HEAD']
+    assert template.c.e.value == bytes([0x44] * 4)
+    assert b''.join(utils.iter_chunks(template)) == (
+        bytes(8) + bytes([0x33] * 4) + bytes([0x44] * 4))
+    assert len(file_server.requests) == 2
+
+
+def test_bind_bytes_and_stream_below_root():
+    description = """
+        <template name="a">
+            <field name="b" size="4"></field>
+            <field name="c" size="8"></field>
+            <field name="d" size="4"></field>
+        </template>
+    """
+    for size in (4, 16):
+        data = bytes(range(1, size + 1))
+        outputs = []
+        for bound in (data, utils.MemoryStream(bytearray(data))):
+            template = XMLTemplateParser(description).parse()
+            utils.bind_data(template, 'c', bound)
+            outputs.append((template.size, template.value,
+                            b''.join(utils.iter_chunks(template))))
+
+        assert outputs[0] == outputs[1]
+        assert outputs[0][0] == size + 8
+        assert outputs[0][2] == bytes(4) + data + bytes(4)